@@ -6,42 +6,52 @@ Korigovana XRF analiza – prova1 i prova2, detektori 10264 i 19511.
 Ispravke u odnosu na analiza_novi.py:
   1. K target: 3.31 keV (ispravno), hw=0.15 keV (uzak, izbegava Ca)
   2. Pozadinsko oduzimanje: linearna interpolacija ispod svakog pika
-  3. Zn korekcija: oduzima Cu Kβ doprinos (Kβ/Kα ≈ 0.17)
-  4. As: obelezena kao "As+PbLα (inseparabilno)" – uz napomenu
+  3. Preklopi Zn Kα/Cu Kβ, S Kα/Pb Mα i As Kα/Pb Lα: fit familija linija
+     (svi pikseli odjednom, src.analysis.linefit) umesto pravila oduzimanja
+  4. "As" prozor (10.54 keV) prikazuje Pb Lα; As Kα dolazi iz fita
   5. Pb: cisti Lβ signal (validan)
   6. Sve vrednosti klipirane na 0 (net signal ≥ 0)
 
 Izlaz: rezultati_korigovani/
 """
 
-import os, math
+import os, sys, math
+from dataclasses import asdict
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 from scipy.stats import linregress
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "xrf-denoise"))
+from src.data.affine import estimate_affine, warp
+from src.data.archive import mca_folder, scan_fingerprint
+from src.data.cache import CacheManifest
+from src.analysis.integrals import apply_weights, significance
+from src.analysis.lines import LINES, compile_lines
+from src.analysis.linefit import LINE_FAMILIES, LineFitter
+from src.analysis.unmixing import apply_unmixing, overlap_ratios, unmixing_matrix
+from src.data.loader import detect_n_channels, iter_spectra
+
 # ── Colormap helper ────────────────────────────────────────────
 def _mk(name, color):
     return LinearSegmentedColormap.from_list(name, ["#000000", color])
 
 # ── Elementi (sa ispravnim energijama) ─────────────────────────
 #
-#  K  : target pomeren na 3.31 keV, hw=0.15 (uzak prozor, izbegava Ca Kα)
-#  As : zadrzano, ali ce biti korigovano za Pb Lα doprinos
+#  K  : 3.314 keV, ±2 kanala, tesni sidebandovi u dolinama pored Ar i Ca
+#  As : prozor Pb Lα (10.55 keV); As Kα = prozor − odnos × Pb Lβ (KOREKCIJA)
 #  Pb : Lβ1 linija (12.61 keV) – cista, nije zahvacena drugim linijama
+#  Energije, sirine prozora i boje: zajednicki katalog LINES (src.analysis.lines)
 #
+ELEMENT_LINES = {
+    "S":    LINES["S"],     "K":  LINES["K"],     "Ca": LINES["Ca"],
+    "Ti":   LINES["Ti"],    "Fe": LINES["Fe"],    "Cu": LINES["Cu"],
+    "Zn":   LINES["Zn"],    "PbLl": LINES["Pb_Ll"],
+    "As":   LINES["Pb_La"], "Pb": LINES["Pb_Lb"], "PbLg": LINES["Pb_Lg"],
+}
 ELEMENT_MAP = {
-    "S":    {"name": "S Kα",   "kev": 2.31,  "hw": 0.20, "cmap": _mk("S",   "#FFFF66")},
-    "K":    {"name": "K Kα",   "kev": 3.31,  "hw": 0.15, "cmap": _mk("K",   "#FFD700")},
-    "Ca":   {"name": "Ca Kα",  "kev": 3.69,  "hw": 0.30, "cmap": _mk("Ca",  "#FFFFFF")},
-    "Ti":   {"name": "Ti Kα",  "kev": 4.51,  "hw": 0.30, "cmap": _mk("Ti",  "#FF6666")},
-    "Fe":   {"name": "Fe Kα",  "kev": 6.40,  "hw": 0.30, "cmap": _mk("Fe",  "#FF2200")},
-    "Cu":   {"name": "Cu Kα",  "kev": 8.04,  "hw": 0.30, "cmap": _mk("Cu",  "#00FFAA")},
-    "Zn":   {"name": "Zn Kα",  "kev": 8.64,  "hw": 0.20, "cmap": _mk("Zn",  "#66CCFF")},  # hw 0.25→0.20: hi+1 bi pao u Cu Kβ (8.903 keV)
-    "PbLl": {"name": "Pb Ll",  "kev": 9.185, "hw": 0.28, "cmap": _mk("PbLl","#BB88FF")},
-    "As":   {"name": "Pb Lα",  "kev": 10.54, "hw": 0.30, "cmap": _mk("As",  "#FF8800")},
-    "Pb":   {"name": "Pb Lβ",  "kev": 12.61, "hw": 0.30, "cmap": _mk("Pb",  "#CC66FF")},
-    "PbLg": {"name": "Pb Lγ",  "kev": 14.77, "hw": 0.35, "cmap": _mk("PbLg","#9933AA")},
+    k: {"name": s.name, "kev": s.kev, "hw": s.hw, "cmap": _mk(k, s.color)}
+    for k, s in ELEMENT_LINES.items()
 }
 
 ELEMENT_DIFF_MAP = {
@@ -51,15 +61,10 @@ ELEMENT_DIFF_MAP = {
 
 # ── Prikaz: kombinovani Pb + odvojeni As ───────────────────────
 DISPLAY_MAP = {
-    "S":   {"name": "S Kα",              "cmap": _mk("S",  "#FFFF66")},
-    "K":   {"name": "K Kα",              "cmap": _mk("K",  "#FFD700")},
-    "Ca":  {"name": "Ca Kα",             "cmap": _mk("Ca", "#FFFFFF")},
-    "Ti":  {"name": "Ti Kα",             "cmap": _mk("Ti", "#FF6666")},
-    "Fe":  {"name": "Fe Kα",             "cmap": _mk("Fe", "#FF2200")},
-    "Cu":  {"name": "Cu Kα",             "cmap": _mk("Cu", "#00FFAA")},
-    "Zn":  {"name": "Zn Kα",             "cmap": _mk("Zn", "#66CCFF")},
-    "Pb":  {"name": "Pb (Lα+Lβ+Ll+Lγ)", "cmap": _mk("Pb", "#CC66FF")},
-    "As":  {"name": "As Kα (kor.)",      "cmap": _mk("As", "#FF8800")},
+    **{k: {"name": ELEMENT_MAP[k]["name"], "cmap": ELEMENT_MAP[k]["cmap"]}
+       for k in ["S", "K", "Ca", "Ti", "Fe", "Cu", "Zn"]},
+    "Pb":  {"name": "Pb (Lα+Lβ+Ll+Lγ)", "cmap": _mk("Pb", LINES["Pb_Lb"].color)},
+    "As":  {"name": "As Kα (kor.)",      "cmap": _mk("As", LINES["Pb_La"].color)},
 }
 DISPLAY_DIFF_MAP = {
     k: {"name": f"Δ {v['name']}", "cmap": "RdBu_r"}
@@ -70,13 +75,24 @@ DISPLAY_DIFF_MAP = {
 _CAL = np.array([[219, 6.4], [278, 8.0], [363, 10.5], [436, 12.6], [869, 25.3]])
 _SLOPE, _INTERCEPT, *_ = linregress(_CAL[:, 0], _CAL[:, 1])
 
-# ── Korekcioni faktori ─────────────────────────────────────────
-# Zn: Cu Kβ/Kα ≈ 0.17 (standardni odnos za Cu fluorescenciju)
-CU_KB_KA_RATIO = 0.17
-
-# As: Pb Lα / Pb Lβ1 odnos – odredjujemo iz samih podataka (vidi dole)
-# Inicijalna procena: 1.40 (tipicna vrednost za Pb pri 30-40 kV ekscitaciji)
-PB_LA_LB_RATIO_INIT = 1.40
+# ── Korekcija preklopljenih linija ─────────────────────────────
+# "odnosi": prozor cilja − odnos × mapa izvora; odnosi se procenjuju
+#           Theil–Sen-om za sve skenove odjednom (src.analysis.unmixing)
+# "fit"   : amplitude iz fita familija linija (NNLS po pikselu, sporije)
+# Obe korekcije su linearne: jedna (E, D) matrica i jedan matmul po skenu.
+KOREKCIJA = "odnosi"
+KOREKCIJA_OPIS = {"odnosi": "korigovani (Theil–Sen odnosi)", "fit": "iz fita linija"}
+
+# (cilj, izvor): Zn prozor sadrzi Cu Kβ, S prozor Pb Mα, "As" prozor Pb Lα;
+# cist Pb Lβ prozor ("Pb") prati obe Pb linije
+OVERLAPS = [("Zn", "Cu"), ("S", "Pb"), ("As", "Pb")]
+# Odnosi kad procena nije moguca: Cu Kβ/Kα, Pb Mα/Lβ, Pb Lα/Lβ
+RATIO_PRIOR = np.array([0.17, 0.005, 1.40])
+
+# Fit linija: kljuc -> familija iz LINE_FAMILIES. Odnosi linija su fiksirani
+# u familijama (Cu Kβ/Kα = 0.17, Pb Lα/Lβ ≈ 1.40), pa fit sam razdvaja Zn od
+# Cu Kβ, S od Pb Mα i As od Pb Lα. Mape se cuvaju kao "<kljuc>_fit".
+FIT_KEYS = {"S": "S", "Zn": "Zn", "As": "As"}
 
 DATASETS  = {
     "prova1": {"dir": "aurora-antico1-prova1", "w": 120, "h": 60},
@@ -92,174 +108,167 @@ os.makedirs(NPY_CACHE, exist_ok=True)
 #  POMOCNE FUNKCIJE
 # ══════════════════════════════════════════════════════════════
 
-def parse_mca_file(filepath):
-    meta, counts, in_data = {}, [], False
-    with open(filepath) as f:
-        for line in f:
-            line = line.strip()
-            if not line: continue
-            if line == "<<DATA>>":  in_data = True;  continue
-            if line == "<<END>>":   break
-            if in_data:
-                try: counts.append(int(line))
-                except ValueError: pass
-            elif " - " in line:
-                k, v = line.split(" - ", 1)
-                meta[k.strip()] = v.strip()
-    return {
-        "counts": np.array(counts, dtype=np.float64),
-        "time":   float(meta.get("REAL_TIME", 1.0)),
-    }
-
-
-def bg_subtracted_integral(counts, energy, target_kev, hw=0.30, bg_hw=0.25):
-    """
-    Neto signal = integral pika − linearna pozadina.
-
-    Peak prozor : [lo, hi]  = [idx-half_ch, idx+half_ch]
-    BG prozori  : [lo-bg_ch, lo)  i  (hi, hi+1+bg_ch]
-                  Oba prozora ISKLJUCUJU ivicne kanale pika (lo i hi),
-                  simetricno sa Python slice semantikom.
-
-    Vraca max(0, neto_signal) – nikad negativno.
-    """
-    idx      = int(np.argmin(np.abs(energy - target_kev)))
-    half_ch  = max(1, int(round(hw   / _SLOPE)))
-    bg_ch    = max(1, int(round(bg_hw / _SLOPE)))
-
-    lo = max(0,               idx - half_ch)
-    hi = min(len(counts) - 1, idx + half_ch)
-
-    bg_lo_l = max(0,               lo - bg_ch)
-    bg_lo_r = lo
-    bg_hi_l = hi + 1
-    bg_hi_r = min(len(counts) - 1, hi + 1 + bg_ch)
-
-    bg_left  = counts[bg_lo_l:bg_lo_r].mean() if bg_lo_r > bg_lo_l else counts[lo]
-    bg_right = counts[bg_hi_l:bg_hi_r].mean() if bg_hi_r > bg_hi_l else counts[hi]
-
-    n_peak  = hi - lo + 1
-    bg_line = np.linspace(bg_left, bg_right, n_peak)
-
-    return max(0.0, float((counts[lo : hi + 1] - bg_line).sum()))
-
-
-def k_signal(counts, energy):
+def element_integrals(spectra, energy, keys):
     """
-    Specijalna K Kα metoda (3.3138 keV).
+    Neto signali (N, len(keys)) za sve piksele odjednom i njihove Poisson
+    varijanse (N, len(keys)) – iz istog matmul-a sa matricom tezina
+    prozora (src.analysis.integrals): var = counts @ w².
 
-    Problem: K je okruzen Ar Kα (2.957 keV) sleva i Ca Kα (3.69 keV) zdesna.
-    Standardni bg prozor zahvata rep Ar pika (levo) i nagib Ca pika (desno),
-    sto daje lazno visoku pozadinu i net K = 0.
-
-    Resenje: tesni sideband ODMAH uz K pik, u cistoj dolini izmedju pikova:
+    Neto signal = integral pika − linearna pozadina.
+      Peak prozor : [lo, hi]  = [idx-half_ch, idx+half_ch]
+      BG prozori  : [lo-bg_ch, lo)  i  (hi, hi+1+bg_ch]
+                    Oba prozora ISKLJUCUJU ivicne kanale pika (lo i hi).
+    Vrednosti su klipovane na 0 – nikad negativno.
+
+    K Kα (3.3138 keV) je okruzen Ar Kα (2.957 keV) sleva i Ca Kα (3.69 keV)
+    zdesna; standardni bg prozor bi zahvatio rep Ar pika i nagib Ca pika.
+    Zato K koristi tesne sidebandove u cistoj dolini izmedju pikova:
       BG levo : [3.23, 3.28] keV  – posle Ar repa, pre K pika
       BG desno: [3.35, 3.42] keV  – posle K pika, pre Ca nagiba
       K prozor: ±2 kanala oko 3.314 keV (5 kanala = 0.146 keV)
     """
-    k_ch     = int(np.argmin(np.abs(energy - 3.3138)))
-    pk_lo    = k_ch - 2
-    pk_hi    = k_ch + 2
+    # Spec-ovi prozora (src.analysis.lines) -> jedna (C, E) matrica tezina
+    kernel = compile_lines({k: ELEMENT_LINES[k] for k in keys}, energy, _SLOPE)
+    return apply_weights(spectra, kernel.weights, variance=True)
+
 
-    ch_ll = int(np.argmin(np.abs(energy - 3.23)))
-    ch_lr = int(np.argmin(np.abs(energy - 3.28)))
-    ch_rl = int(np.argmin(np.abs(energy - 3.35)))
-    ch_rr = int(np.argmin(np.abs(energy - 3.42)))
+def fit_amplitudes(spectra, energy, keys, label=""):
+    """
+    Amplitude (N, len(keys)) za kljuceve "<el>_fit": svi spektri se fituju
+    odjednom familijama Gausovih linija + kontinuum (src.analysis.linefit),
+    pa se preklopljeni pikovi razdvajaju fitom umesto pravilima oduzimanja.
+    Vraca i Poisson varijanse amplituda (linearizovane, preko pinv²).
+    """
+    fitter = LineFitter(energy)
+    amps, resid, var = fitter.fit(spectra, variance=True)
+    print(f"  [{label}] Fit linija: RMS reziduala {np.sqrt(np.mean(resid ** 2)):.2f} counts/kanal")
+    idx = [fitter.families.index(FIT_KEYS[k[:-len("_fit")]]) for k in keys]
+    return amps[:, idx], var[:, idx]
 
-    bg_left  = counts[ch_ll:ch_lr + 1].mean() if ch_lr >= ch_ll else counts[pk_lo]
-    bg_right = counts[ch_rl:ch_rr + 1].mean() if ch_rr >= ch_rl else counts[pk_hi]
-    bg_per_ch = (bg_left + bg_right) / 2.0
 
-    n   = pk_hi - pk_lo + 1
-    net = max(0.0, float(counts[pk_lo:pk_hi + 1].sum()) - bg_per_ch * n)
-    return net
+def element_params(key, w, h):
+    """Parametri od kojih zavisi mapa elementa (za validaciju cache-a)."""
+    params = {"w": w, "h": h, "slope": _SLOPE, "intercept": _INTERCEPT}
+    if key.endswith("_fit"):
+        return {**params, "method": "linefit", "families": LINE_FAMILIES}
+    return {**params, "method": "line_window", **asdict(ELEMENT_LINES[key])}
 
 
 def process_dataset(folder_path, w, h, label):
     """
-    Cita sve None_N.mca fajlove i vraca 3D matricu (n_elem, h, w).
-    Koristi NPY cache ako postoji.
+    Cita sve None_N.mca fajlove i vraca (cube, var, el_keys): 3D matricu
+    mapa (n_elem, h, w) i Poisson varijanse svake mape istog oblika.
+    folder_path moze biti i folder unutar zip/tar arhive (npr.
+    "prova1.zip/10264"); fajlovi se citaju direktno iz arhive, bez raspakivanja.
+    Koristi NPY cache: manifest belezi izvorne fajlove, kalibraciju i
+    parametre prozora, pa se racunaju samo elementi ciji su se ulazi promenili.
     """
     el_keys = list(ELEMENT_MAP.keys())
+    if KOREKCIJA == "fit":
+        el_keys += [f"{k}_fit" for k in FIT_KEYS]
     n_el    = len(el_keys)
     total   = w * h
 
-    cache_paths = {k: os.path.join(NPY_CACHE, f"{label}_{k}.npy") for k in el_keys}
-    if all(os.path.exists(p) for p in cache_paths.values()):
-        print(f"  [{label}] Ucitavam iz cache-a...")
-        cube = np.stack([np.load(cache_paths[k]) for k in el_keys], axis=0)
-        return cube, el_keys
+    manifest = CacheManifest(NPY_CACHE)
+    sources  = scan_fingerprint(mca_folder(folder_path), total)
+    # Mapa i njena Poisson varijansa (<label>_<el>_var.npy) dele otisak
+    fps      = {f"{label}_{k}{suf}.npy": manifest.fingerprint(sources, element_params(k, w, h))
+                for k in el_keys for suf in ("", "_var")}
+    stale    = set(manifest.stale(fps))
 
     cube = np.zeros((n_el, h, w), dtype=np.float64)
-
-    for i in range(1, total + 1):
-        path = os.path.join(folder_path, f"None_{i}.mca")
-        if not os.path.exists(path):
-            continue
-
-        data   = parse_mca_file(path)
-        counts = data["counts"]
-        energy = np.arange(len(counts)) * _SLOPE + _INTERCEPT
-        row    = (i - 1) // w
-        col    = (i - 1) % w
-
-        for ei, key in enumerate(el_keys):
-            if key == "K":
-                val = k_signal(counts, energy)
-            else:
-                el  = ELEMENT_MAP[key]
-                val = bg_subtracted_integral(counts, energy, el["kev"], el["hw"])
-            cube[ei, row, col] = val
-
-        if i % 500 == 0 or i == total:
-            print(f"  [{label}] {i}/{total} ({100*i//total}%)")
-
+    var  = np.zeros((n_el, h, w), dtype=np.float64)
+    todo = []
     for ei, k in enumerate(el_keys):
-        np.save(cache_paths[k], cube[ei])
+        if {f"{label}_{k}.npy", f"{label}_{k}_var.npy"} & stale:
+            todo.append(ei)
+        else:
+            cube[ei] = np.load(os.path.join(NPY_CACHE, f"{label}_{k}.npy"))
+            var[ei]  = np.load(os.path.join(NPY_CACHE, f"{label}_{k}_var.npy"))
+
+    if not todo:
+        print(f"  [{label}] Ucitavam iz cache-a...")
+        return cube, var, el_keys
+    print(f"  [{label}] Racunam {len(todo)}/{n_el} elemenata: "
+          f"{', '.join(el_keys[ei] for ei in todo)}")
+
+    # Svi spektri u (N, C) matricu (nedostajuci pikseli ostaju 0);
+    # arhive se dekompresuju paralelno (po nit na blok fajlova)
+    n_ch    = detect_n_channels(folder_path, total)
+    spektri = np.zeros((total, n_ch))
+    for i, data in iter_spectra(folder_path, total, n_workers=os.cpu_count()):
+        counts = data["counts"][:n_ch]
+        spektri[i - 1, :len(counts)] = counts
+    print(f"  [{label}] {total}/{total} spektara ucitano")
+
+    energy   = np.arange(n_ch) * _SLOPE + _INTERCEPT
+    win_keys = [el_keys[ei] for ei in todo if el_keys[ei] in ELEMENT_MAP]
+    fit_keys = [el_keys[ei] for ei in todo if el_keys[ei] not in ELEMENT_MAP]
+    vals = {}
+    if win_keys:
+        maps, variances = element_integrals(spektri, energy, win_keys)
+        vals.update(zip(win_keys, zip(maps.T, variances.T)))
+    if fit_keys:
+        maps, variances = fit_amplitudes(spektri, energy, fit_keys, label)
+        vals.update(zip(fit_keys, zip(maps.T, variances.T)))
+    for ei in todo:
+        cube[ei] = vals[el_keys[ei]][0].reshape(h, w)
+        var[ei]  = vals[el_keys[ei]][1].reshape(h, w)
+
+    for ei in todo:
+        np.save(os.path.join(NPY_CACHE, f"{label}_{el_keys[ei]}.npy"), cube[ei])
+        np.save(os.path.join(NPY_CACHE, f"{label}_{el_keys[ei]}_var.npy"), var[ei])
+    manifest.record({f"{label}_{el_keys[ei]}{suf}.npy": fps[f"{label}_{el_keys[ei]}{suf}.npy"]
+                     for ei in todo for suf in ("", "_var")})
     print(f"  [{label}] Cache sacuvan.")
-    return cube, el_keys
+    return cube, var, el_keys
 
 
-def apply_corrections(cube, el_keys):
+def estimate_ratios(cubes):
     """
-    Primenjuje:
-      1. Zn korekcija: Zn_net = Zn - CU_KB_KA_RATIO × Cu
-      2. As korekcija: As_net = As - PB_LA_LB_RATIO × Pb
-         Ratio se odredjuje iz podataka (korelacijom) ako je moguce.
+    Odnosi preklopa (cilj ≈ odnos × izvor, OVERLAPS) za sve skenove odjednom:
+    Theil–Sen nagib cilja prema izvoru po svim pikselima, jedan batch
+    (skenovi × preklopi). Pikseli gde cilj stvarno postoji su outlieri iznad
+    linije i ne pomeraju medijanu nagiba, pa maska donjeg kvartila nije
+    potrebna. Odnosi se ogranicavaju na [0, 2]; bez procene -> RATIO_PRIOR.
     """
-    cube = cube.copy()
-
-    ku = {k: i for i, k in enumerate(el_keys)}
-
-    # ── Zn: oduzmi Cu Kβ doprinos ────────────────────────────
-    if "Cu" in ku and "Zn" in ku:
-        cube[ku["Zn"]] = np.maximum(0, cube[ku["Zn"]] - CU_KB_KA_RATIO * cube[ku["Cu"]])
-
-    # ── Pb Lα (prozor 10.54 keV): As nije prisutan u uzorku,
-    #    sirovi integral direktno prikazuje Pb Lα distribuciju — bez korekcije.
-
-    # ── S: oduzmi Pb Mα doprinos ─────────────────────────────
-    # Pb Mα (2.346 keV) i S Kα (2.308 keV) se preklapaju u S prozoru.
-    # Koristimo donji kvartal S vrednosti (pikseli bez S) da odredimo
-    # Pb Mα / Pb Lβ odnos, pa oduzimamo Pb doprinos.
-    if "S" in ku and "Pb" in ku:
-        s_flat  = cube[ku["S"]].flatten()
-        pb_flat = cube[ku["Pb"]].flatten()
-
-        threshold = np.percentile(s_flat, 25)
-        mask      = s_flat <= threshold
-        if mask.sum() > 50 and pb_flat[mask].std() > 1:
-            from scipy.stats import linregress as lr
-            slope_est, _, r, *_ = lr(pb_flat[mask], s_flat[mask])
-            ratio_s = max(0.0, min(2.0, slope_est))
-            print(f"  [korekcija] Pb Ma/Lb iz podataka: {ratio_s:.4f}  (r={r:.3f})")
-        else:
-            ratio_s = 0.005
-            print(f"  [korekcija] Pb Ma/Lb = inicijalna vrednost: {ratio_s:.4f}")
-
-        cube[ku["S"]] = np.maximum(0, cube[ku["S"]] - ratio_s * cube[ku["Pb"]])
-
-    return cube
+    labels = list(cubes)
+    keys   = cubes[labels[0]][2]
+    n_px   = max(c[0].size // len(keys) for c in cubes.values())
+    stacks = np.zeros((len(labels), len(keys), n_px))
+    masks  = np.zeros((len(labels), len(OVERLAPS), n_px), dtype=bool)
+    for b, lbl in enumerate(labels):
+        flat = cubes[lbl][0].reshape(len(keys), -1)
+        stacks[b, :, :flat.shape[1]] = flat
+        masks[b, :, :flat.shape[1]]  = True
+
+    ratios = overlap_ratios(stacks, keys, OVERLAPS, masks)
+    ratios = np.where(np.isnan(ratios), RATIO_PRIOR, np.clip(ratios, 0.0, 2.0))
+    for b, lbl in enumerate(labels):
+        print(f"  [{'_'.join(lbl)}] odnosi: " + ", ".join(
+            f"{t}<-{s} {ratios[b, o]:.4f}" for o, (t, s) in enumerate(OVERLAPS)))
+    return dict(zip(labels, ratios))
+
+
+def correction_matrix(el_keys, ratios=None):
+    """
+    (E, D) matrica: sirove mape (el_keys) -> display mape (DISPLAY_MAP),
+    primenjuje se jednim matmul-om po skenu (apply_unmixing):
+      - S, Zn, As: prozor − odnos × izvor (unmixing_matrix), a bez odnosa
+        (KOREKCIJA = "fit") amplitude "<el>_fit"
+      - Pb: suma sve cetiri Pb linije (PbLl + PbLα + PbLβ + PbLγ)
+      - ostali: direktno
+    """
+    ku  = {k: i for i, k in enumerate(el_keys)}
+    eye = np.eye(len(el_keys))
+    if ratios is None:
+        cols = {k: eye[:, ku[k]] for k in el_keys}
+        cols.update({k: eye[:, ku[f"{k}_fit"]] for k in FIT_KEYS})
+    else:
+        unmix = unmixing_matrix(el_keys, OVERLAPS, ratios)
+        cols  = {k: unmix[:, ku[k]] for k in el_keys}
+    cols["Pb"] = eye[:, [ku[k] for k in ("PbLl", "As", "Pb", "PbLg")]].sum(axis=1)
+    return np.stack([cols[k] for k in DISPLAY_MAP], axis=1)
 
 
 def render_grid(cube, el_keys, el_map, w, h, save_path, title=""):
@@ -316,26 +325,14 @@ def render_grid(cube, el_keys, el_map, w, h, save_path, title=""):
     print(f"  Sacuvano: {os.path.relpath(save_path)}")
 
 
-def build_display_cube(cube, el_keys, label=""):
-    ku = {k: i for i, k in enumerate(el_keys)}
-    pb_combined = (cube[ku["PbLl"]] + cube[ku["As"]] +
-                   cube[ku["Pb"]]   + cube[ku["PbLg"]])
-    as_raw = cube[ku["As"]]
-    pb_lb  = cube[ku["Pb"]]
-    as_f, pb_f = as_raw.flatten(), pb_lb.flatten()
-    mask = as_f <= np.percentile(as_f, 25)
-    if mask.sum() > 50 and pb_f[mask].std() > 1:
-        from scipy.stats import linregress as lr
-        s, _, r, *_ = lr(pb_f[mask], as_f[mask])
-        ratio = max(0.5, min(2.5, s))
-        print(f"  [{label}] As: Pb Lα/Lβ = {ratio:.3f}  (r={r:.3f})")
-    else:
-        ratio = PB_LA_LB_RATIO_INIT
-    as_corr = np.maximum(0, as_raw - ratio * pb_lb)
-    disp_keys = ["S", "K", "Ca", "Ti", "Fe", "Cu", "Zn", "Pb", "As"]
-    disp = [cube[ku[k]] for k in ["S", "K", "Ca", "Ti", "Fe", "Cu", "Zn"]]
-    disp += [pb_combined, as_corr]
-    return np.stack(disp, axis=0), disp_keys
+def build_display_cube(cube, el_keys, ratios=None, variance=False):
+    """
+    Display cube (S, K, Ca, Ti, Fe, Cu, Zn, Pb, As) iz sirovih mapa, jedan
+    matmul sa correction_matrix; negativne korigovane vrednosti -> 0. Sa
+    variance=True `cube` su Poisson varijanse mapa i vraca varijanse prikaza.
+    """
+    matrix = correction_matrix(el_keys, ratios)
+    return apply_unmixing(cube, matrix, clip=True, variance=variance), list(DISPLAY_MAP)
 
 
 def render_display(cube, disp_keys, w, h, save_path, title="", is_diff=False):
@@ -351,7 +348,8 @@ def render_display(cube, disp_keys, w, h, save_path, title="", is_diff=False):
         img = cube[idx]
         ax  = axes[idx]
         if is_diff:
-            am = np.percentile(np.abs(img), 99) or 1.0
+            # Pikseli van preklopa poravnatih skenova su NaN
+            am = np.nanpercentile(np.abs(img), 99) or 1.0
             vmin, vmax = -am, am
         else:
             vmin = 0
@@ -379,8 +377,9 @@ def render_display(cube, disp_keys, w, h, save_path, title="", is_diff=False):
 #  OBRADA
 # ══════════════════════════════════════════════════════════════
 
-cubes  = {}
-dcubes = {}
+cubes  = {}   # (cube, var, keys) po (prova, det)
+dcubes = {}   # (disp_cube, dkeys)
+dvars  = {}   # Poisson varijanse display mapa
 
 for prova, cfg in DATASETS.items():
     for det in DETEKTORI:
@@ -389,12 +388,15 @@ for prova, cfg in DATASETS.items():
         print(f"\n{'='*60}")
         print(f"  Obrada: {label}  ({cfg['w']}x{cfg['h']})")
         print(f"{'='*60}")
-        cube, keys = process_dataset(folder, cfg["w"], cfg["h"], label)
-        print(f"  Primena korekcija...")
-        cube_corr = apply_corrections(cube, keys)
-        cubes[(prova, det)]  = (cube_corr, keys)
-        disp_cube, dkeys = build_display_cube(cube_corr, keys, label)
-        dcubes[(prova, det)] = (disp_cube, dkeys)
+        cubes[(prova, det)] = process_dataset(folder, cfg["w"], cfg["h"], label)
+
+# ── Korekcija preklopa: odnosi svih skenova u jednom prolazu, ──
+#    pa jedan matmul po skenu (mape i njihove varijanse)
+print(f"\n--- Korekcija preklopljenih linija ({KOREKCIJA}) ---")
+ratios = estimate_ratios(cubes) if KOREKCIJA == "odnosi" else {}
+for key, (cube, var, keys) in cubes.items():
+    dcubes[key]   = build_display_cube(cube, keys, ratios.get(key))
+    dvars[key], _ = build_display_cube(var, keys, ratios.get(key), variance=True)
 
 
 # ── Mape elemenata ────────────────────────────────────────────
@@ -407,13 +409,24 @@ for prova, cfg in DATASETS.items():
         render_display(
             disp_cube, dkeys, cfg["w"], cfg["h"], save,
             title=f"Mape elemenata – {prova}  |  Detektor {det}\n"
-                  f"bg oduzeta · Zn−CuKβ · S−PbMα · Pb kombinovano · As korigovano"
+                  f"bg oduzeta · Zn, S, As {KOREKCIJA_OPIS[KOREKCIJA]} · Pb kombinovano"
         )
 
 # ── Razlike prova1 − prova2 ───────────────────────────────────
+# prova2 se poravnava na prova1 mrezu (rotacija, razmera, pomeraj iz svih
+# display mapa zajedno, src.data.affine) pre oduzimanja; procena se prihvata
+# samo ako je jasno bolja od identiteta (ista mreza). Varijanse se prevode
+# kvadratima bilinearnih tezina, pikseli van preklopa ostaju NaN.
 for det in DETEKTORI:
     d1, dkeys = dcubes[("prova1", det)]
     d2, _     = dcubes[("prova2", det)]
+    v2        = dvars[("prova2", det)]
+    T = estimate_affine(d1, d2)
+    print(f"  [{det}] poravnanje prova2: rotacija {T.angle:+.2f}°, "
+          f"razmera {T.scale[0]:.3f}, pouzdanost {T.confidence:.2f}")
+    if not T.negligible(d1.shape[1:]):
+        d2 = warp(d2, T, d1.shape[1:])
+        v2 = warp(v2, T, d1.shape[1:], squared_weights=True)
     diff = d1 - d2
     cfg1 = DATASETS["prova1"]
     save = os.path.join(IZLAZ, "razlike_prova1_vs_prova2", f"diff_{det}.png")
@@ -422,6 +435,10 @@ for det in DETEKTORI:
         title=f"Razlike: prova1 − prova2  |  Detektor {det}\n"
               f"CRVENO = vise u prova1  |  PLAVO = vise u prova2"
     )
+    # Udeo piksela gde je razlika van Poisson suma (|Δ| > 3σ)
+    z = significance(diff, dvars[("prova1", det)] + v2)
+    print(f"  [{det}] |Δ|>3σ: " + ", ".join(f"{k} {np.mean(np.abs(z[ki][np.isfinite(z[ki])]) > 3):.0%}"
+                                          for ki, k in enumerate(dkeys)))
 
 print(f"\n{'='*60}")
 print(f"  Sve sacuvano u: {os.path.abspath(IZLAZ)}/")
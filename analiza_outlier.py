@@ -4,22 +4,33 @@ analiza_outlier.py
 Izoluje spektre gde je razlika prova1 − prova2 drasticna po pikselu.
 
 Za svaki element:
+  - Poravnava prova2 na prova1 mrezu (rotacija, razmera, pomeraj iz svih
+    mapa detektora zajedno, src.data.affine)
   - Racuna diff[piksel] = prova1_signal − prova2_signal
   - Ova razlika treba da bude ~0 (konstantna) ako je uzorak isti
-  - Pikseli gde |diff| > prag (99. percentil) se smatraju outlierima
+  - Znacajnost z = diff / sqrt(var1 + var2) iz Poisson mapa varijanse
+    koje analiza_korigovana cuva uz mape (<label>_<el>_var.npy)
+  - Pikseli gde |z| > PRAG_Z se smatraju outlierima; bez mapa varijanse
+    prag je 99. percentil |diff|
   - Za top-10 outlier piksela: plota MCA spektar iz prova1 i prova2
     sa anotiranim elementima
 
 Izlaz: rezultati_korigovani/outlier/<element>/piksel_N.png
 """
 
-import os, math
+import os, sys, math
 import numpy as np
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from scipy.stats import linregress
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "xrf-denoise"))
+from src.analysis.integrals import significance
+from src.analysis.lines import LINES
+from src.data.affine import estimate_affine, warp
+from src.data.spectrum_cache import cached_parse
+
 # ── Kalibracija ────────────────────────────────────────────────
 CAL = np.array([[219,6.4],[278,8.0],[363,10.5],[436,12.6],[869,25.3]])
 SLOPE, INTERCEPT, *_ = linregress(CAL[:,0], CAL[:,1])
@@ -28,27 +39,10 @@ ELEMENTS = {
     "S":  2.31, "K":  3.3138, "Ca": 3.69, "Ti": 4.51,
     "Fe": 6.40, "Cu": 8.04,  "Zn": 8.64, "Pb": 12.61,
 }
-ELEMENT_COLORS = {
-    "S": "#FFFF44", "K": "#FFD700", "Ca": "#FFFFFF", "Ti": "#FF9966",
-    "Fe": "#FF2200", "Cu": "#00FFAA", "Zn": "#66CCFF",
-    "Pb Lα": "#FF8800", "Pb Lβ": "#CC66FF", "Pb Ll": "#BB88FF", "Pb Lγ": "#9933AA",
-    "Ar": "#888888",
-}
-ALL_LINES = [
-    ("Ar",    2.957, "#888888"),
-    ("S",     2.31,  "#FFFF44"),
-    ("K",     3.314, "#FFD700"),
-    ("Ca",    3.69,  "#FFFFFF"),
-    ("Ti",    4.51,  "#FF9966"),
-    ("Cr",    5.415, "#00DD55"),
-    ("Fe",    6.40,  "#FF2200"),
-    ("Cu",    8.05,  "#00FFAA"),
-    ("Zn",    8.64,  "#66CCFF"),
-    ("Pb Ll", 9.185, "#BB88FF"),
-    ("Pb Lα", 10.54, "#FF8800"),
-    ("Pb Lβ", 12.61, "#CC66FF"),
-    ("Pb Lγ", 14.77, "#9933AA"),
-]
+# Linije za anotaciju spektara – zajednicki katalog (src.analysis.lines)
+ALL_LINES = [(LINES[k].name, LINES[k].kev, LINES[k].color)
+             for k in ["Ar", "S", "K", "Ca", "Ti", "Cr", "Fe", "Cu", "Zn",
+                       "Pb_Ll", "Pb_La", "Pb_Lb", "Pb_Lg"]]
 
 CACHE   = "rezultati_korigovani/_npy_cache"
 DIR1    = "aurora-antico1-prova1"
@@ -57,30 +51,22 @@ DETEKTORI = ["10264", "19511"]
 W, H    = 120, 60
 IZLAZ   = "rezultati_korigovani/outlier"
 TOP_N   = 10       # koliko outlier spektara po elementu
-PRAG_PERCENTIL = 99.0
+PRAG_Z  = 4.0      # |Δ| / σ iznad kog je razlika znacajna (sa mapama varijanse)
+PRAG_PERCENTIL = 99.0   # rezervni prag bez mapa varijanse
 
 os.makedirs(IZLAZ, exist_ok=True)
 
 
 # ── Parsiranje MCA ─────────────────────────────────────────────
+# Isti piksel se crta za vise elemenata, pa citanja idu kroz SPECTRUM_CACHE
 def parse_mca(path):
-    counts, ind = [], False
-    with open(path) as f:
-        for ln in f:
-            ln = ln.strip()
-            if ln == "<<DATA>>": ind = True; continue
-            if ln == "<<END>>": break
-            if ind:
-                try: counts.append(int(ln))
-                except: pass
-    return np.array(counts, dtype=np.float64)
+    return cached_parse(path)["counts"]
 
 
 # ── Plot spektra za jedan piksel ───────────────────────────────
 def plot_spectrum_pair(pixel_i, det, elem_key, diff_val, sig1, sig2,
-                       path1, path2, save_path):
-    row = int((pixel_i - 1) // W) + 1
-    col = int((pixel_i - 1) % W) + 1
+                       path1, path2, save_path, pixel2=None):
+    pixel2 = pixel_i if pixel2 is None else pixel2
 
     c1 = parse_mca(path1) if os.path.exists(path1) else np.zeros(1024)
     c2 = parse_mca(path2) if os.path.exists(path2) else np.zeros(1024)
@@ -90,7 +76,10 @@ def plot_spectrum_pair(pixel_i, det, elem_key, diff_val, sig1, sig2,
     fig, axes = plt.subplots(1, 2, figsize=(14, 4), dpi=100)
     fig.patch.set_facecolor("#111111")
 
-    for ax, counts, prova_lbl in zip(axes, [c1, c2], ["prova1", "prova2"]):
+    for ax, counts, prova_lbl, pix in zip(axes, [c1, c2], ["prova1", "prova2"],
+                                          [pixel_i, pixel2]):
+        row = int((pix - 1) // W) + 1
+        kol = int((pix - 1) % W) + 1
         ax.set_facecolor("#1A1A1A")
         en = e[:len(counts)]
         ax.plot(en, counts, color="#AADDFF", linewidth=0.6, alpha=0.9)
@@ -110,7 +99,7 @@ def plot_spectrum_pair(pixel_i, det, elem_key, diff_val, sig1, sig2,
         ax.tick_params(colors="white", labelsize=7)
         for sp in ax.spines.values(): sp.set_edgecolor("#555555")
         ax.set_title(
-            f"{prova_lbl}  |  Det {det}  |  Piksel {pixel_i} (r={row}, k={col})\n"
+            f"{prova_lbl}  |  Det {det}  |  Piksel {pix} (r={row}, k={kol})\n"
             f"{elem_key}: {(sig1 if prova_lbl=='prova1' else sig2):.0f} counts",
             color="white", fontsize=8)
 
@@ -127,33 +116,101 @@ def plot_spectrum_pair(pixel_i, det, elem_key, diff_val, sig1, sig2,
     plt.close()
 
 
+_poravnanja = {}
+
+
+def poravnanje(det):
+    """
+    Transformacija prova1 piksel → prova2 koordinate za detektor
+    (src.data.affine), procenjena jednom na svim kesiranim mapama
+    elemenata; None ako je zanemarljiva (< 0.5 piksela) ili mapa nema.
+    Mreze su iste, pa estimate_affine zadrzava identitet osim ako procena
+    nije jasno bolja (min_gain) i razmera blizu 1 (scale_tol).
+    """
+    if det not in _poravnanja:
+        parovi = [(os.path.join(CACHE, f"prova1_{det}_{el}.npy"),
+                   os.path.join(CACHE, f"prova2_{det}_{el}.npy")) for el in ELEMENTS]
+        parovi = [(np.load(p1), np.load(p2)) for p1, p2 in parovi
+                  if os.path.exists(p1) and os.path.exists(p2)]
+        T = None
+        if parovi:
+            m1, m2 = (np.stack(m) for m in zip(*parovi))
+            T = estimate_affine(m1, m2)
+            print(f"  Poravnanje prova2 (det {det}): rotacija {T.angle:+.2f}°, "
+                  f"razmera {T.scale[0]:.3f}, pouzdanost {T.confidence:.2f}")
+            if T.negligible(m1.shape[1:]):
+                T = None
+        _poravnanja[det] = T
+    return _poravnanja[det]
+
+
+def prova2_piksel(det, flat_i):
+    """1-indeksirani prova2 piksel koji odgovara prova1 pikselu flat_i."""
+    T = poravnanje(det)
+    if T is None:
+        return flat_i + 1
+    r, c = np.rint(T.apply([flat_i // W, flat_i % W])).astype(int)
+    return int(np.clip(r, 0, H - 1) * W + np.clip(c, 0, W - 1)) + 1
+
+
+def ucitaj_razliku(det, elem):
+    """
+    (m1, m2, diff, z) iz cache-a analiza_korigovana, ili None ako mape ne
+    postoje. z = diff / σ iz mapa varijanse; None ako njih nema (stari cache).
+    m2 (i njena varijansa) su poravnati na prova1 mrezu; pikseli van
+    preklopa su NaN.
+    """
+    p1 = os.path.join(CACHE, f"prova1_{det}_{elem}.npy")
+    p2 = os.path.join(CACHE, f"prova2_{det}_{elem}.npy")
+    if not os.path.exists(p1) or not os.path.exists(p2):
+        return None
+    m1 = np.load(p1)   # shape (H, W)
+    m2 = np.load(p2)
+    v1 = os.path.join(CACHE, f"prova1_{det}_{elem}_var.npy")
+    v2 = os.path.join(CACHE, f"prova2_{det}_{elem}_var.npy")
+    var = None
+    if os.path.exists(v1) and os.path.exists(v2):
+        var = (np.load(v1), np.load(v2))
+    T = poravnanje(det)
+    if T is not None:
+        m2 = warp(m2, T, m1.shape)
+        if var is not None:
+            var = (var[0], warp(var[1], T, m1.shape, squared_weights=True))
+    diff = (m1 - m2).flatten()   # prova1 − prova2
+    z = None
+    if var is not None:
+        z = significance(diff, (var[0] + var[1]).flatten())
+    return m1, m2, diff, z
+
+
 # ── Glavna petlja ──────────────────────────────────────────────
 print("Outlier analiza: prova1 vs prova2")
-print(f"Parametri: top-{TOP_N} piksela po elementu, prag={PRAG_PERCENTIL}. percentil\n")
+print(f"Parametri: top-{TOP_N} piksela po elementu, prag |z|>{PRAG_Z} "
+      f"(bez varijanse: {PRAG_PERCENTIL}. percentil)\n")
 
-summary = []   # (element, det, pixel_i, diff)
+summary = []   # (element, det, pixel_i, diff, sig1, sig2, z)
 
 for det in DETEKTORI:
     print(f"=== Detektor {det} ===")
     for elem in ELEMENTS:
-        p1 = os.path.join(CACHE, f"prova1_{det}_{elem}.npy")
-        p2 = os.path.join(CACHE, f"prova2_{det}_{elem}.npy")
-        if not os.path.exists(p1) or not os.path.exists(p2):
+        razlika = ucitaj_razliku(det, elem)
+        if razlika is None:
             print(f"  [{elem}] cache ne postoji — preskacam")
             continue
+        m1, m2, diff, z = razlika
 
-        m1 = np.load(p1)   # shape (H, W)
-        m2 = np.load(p2)
-        diff = (m1 - m2).flatten()   # prova1 − prova2
+        # Rang po znacajnosti |z|; bez varijanse po |diff|
+        score = np.abs(diff) if z is None else np.abs(z)
+        prag  = np.nanpercentile(score, PRAG_PERCENTIL) if z is None else PRAG_Z
+        outlier_idx = np.where(score > prag)[0]
+        n_out = len(outlier_idx)
 
-        prag = np.percentile(np.abs(diff), PRAG_PERCENTIL)
-        outlier_idx = np.where(np.abs(diff) > prag)[0]
+        # Sortiraj opadajuce, uzmi top-N
+        outlier_idx = outlier_idx[np.argsort(-score[outlier_idx])][:TOP_N]
 
-        # Sortiraj po |diff| opadajuce, uzmi top-N
-        outlier_idx = outlier_idx[np.argsort(-np.abs(diff[outlier_idx]))][:TOP_N]
-
-        print(f"  [{elem}]  mean_diff={diff.mean():+.1f}  std={diff.std():.1f}  "
-              f"prag={prag:.0f}  outlieri={len(np.where(np.abs(diff)>prag)[0])}/7200")
+        prag_txt = f"prag={prag:.0f}" if z is None else f"prag |z|>{prag:g}"
+        print(f"  [{elem}]  mean_diff={np.nanmean(diff):+.1f}  std={np.nanstd(diff):.1f}  "
+              f"{prag_txt}  outlieri={n_out}/{diff.size}")
 
         out_dir = os.path.join(IZLAZ, f"{elem}_{det}")
         os.makedirs(out_dir, exist_ok=True)
@@ -166,14 +223,17 @@ for det in DETEKTORI:
             sig1 = float(m1.flatten()[flat_i])
             sig2 = float(m2.flatten()[flat_i])
             dv   = diff[flat_i]
+            zv   = float(z[flat_i]) if z is not None else np.nan
+
+            pixel2  = prova2_piksel(det, flat_i)
 
             path1 = os.path.join(DIR1, det, f"None_{pixel_i}.mca")
-            path2 = os.path.join(DIR2, det, f"None_{pixel_i}.mca")
+            path2 = os.path.join(DIR2, det, f"None_{pixel2}.mca")
 
             save = os.path.join(out_dir, f"rank{rank+1:02d}_piksel{pixel_i}.png")
             plot_spectrum_pair(pixel_i, det, elem, dv, sig1, sig2,
-                               path1, path2, save)
-            summary.append((elem, det, pixel_i, dv, sig1, sig2))
+                               path1, path2, save, pixel2)
+            summary.append((elem, det, pixel_i, dv, sig1, sig2, zv))
 
         print(f"         Sacuvano {len(outlier_idx)} spektara u {os.path.relpath(out_dir)}/")
 
@@ -193,24 +253,22 @@ axes = np.array(axes).flatten()
 ax_i = 0
 for elem in ELEMENTS:
     for det in DETEKTORI:
-        p1 = os.path.join(CACHE, f"prova1_{det}_{elem}.npy")
-        p2 = os.path.join(CACHE, f"prova2_{det}_{elem}.npy")
-        if not os.path.exists(p1) or not os.path.exists(p2):
+        razlika = ucitaj_razliku(det, elem)
+        if razlika is None:
             if ax_i < len(axes): axes[ax_i].set_visible(False)
             ax_i += 1; continue
-
-        m1 = np.load(p1).flatten()
-        m2 = np.load(p2).flatten()
-        diff = m1 - m2
+        _, _, diff, z = razlika
 
         ax = axes[ax_i]
-        prag = np.percentile(np.abs(diff), PRAG_PERCENTIL)
-        ax.hist(diff, bins=80, color="#4488FF", alpha=0.75, edgecolor="none")
+        vals = diff if z is None else z
+        vals = vals[np.isfinite(vals)]
+        prag = np.nanpercentile(np.abs(diff), PRAG_PERCENTIL) if z is None else PRAG_Z
+        ax.hist(vals, bins=80, color="#4488FF", alpha=0.75, edgecolor="none")
         ax.axvline( prag, color="red",  linewidth=1.2, linestyle="--", label=f"+prag {prag:.0f}")
         ax.axvline(-prag, color="red",  linewidth=1.2, linestyle="--")
         ax.axvline(0,     color="black", linewidth=0.8)
         ax.set_title(f"{elem}  det{det}", fontsize=8, fontweight="bold")
-        ax.set_xlabel("Δ counts (p1−p2)", fontsize=7)
+        ax.set_xlabel("Δ counts (p1−p2)" if z is None else "z = Δ / σ", fontsize=7)
         ax.tick_params(labelsize=6)
         ax_i += 1
 
@@ -218,7 +276,7 @@ for j in range(ax_i, len(axes)):
     axes[j].set_visible(False)
 
 fig.suptitle("Distribucija razlika prova1 − prova2 po elementu i detektoru\n"
-             "Crvena isprekidana linija = prag (99. percentil |razlike|)",
+             f"Crvena isprekidana linija = prag (|z| = {PRAG_Z:g}; bez varijanse 99. percentil |razlike|)",
              fontsize=11, fontweight="bold")
 plt.tight_layout(rect=[0, 0, 1, 0.95])
 hist_path = os.path.join(IZLAZ, "histogram_razlika.png")
@@ -233,7 +291,7 @@ print(f"  OUTLIER ANALIZA ZAVRSENA")
 print(f"  Ukupno izolovanih spektara: {len(summary)}")
 print(f"  Sve slike u: {os.path.abspath(IZLAZ)}/")
 print(f"{'='*60}")
-print("\nTop outlieri (|Δ| najveci):")
-summary_sorted = sorted(summary, key=lambda x: abs(x[3]), reverse=True)[:20]
-for elem, det, pix, dv, s1, s2 in summary_sorted:
-    print(f"  {elem:3s} det{det}  piksel={pix:5d}  Δ={dv:+8.0f}  (p1={s1:.0f}, p2={s2:.0f})")
+print("\nTop outlieri (|z| najveci; bez varijanse |Δ|):")
+summary_sorted = sorted(summary, key=lambda x: (abs(np.nan_to_num(x[6])), abs(x[3])), reverse=True)[:20]
+for elem, det, pix, dv, s1, s2, zv in summary_sorted:
+    print(f"  {elem:3s} det{det}  piksel={pix:5d}  Δ={dv:+8.0f}  z={zv:+6.1f}  (p1={s1:.0f}, p2={s2:.0f})")
@@ -16,9 +16,8 @@ Napomena: Mn, Co, Ni – iskljuceni, nema neto signala posle bg oduzimanja
 Sve korekcije iz analiza_korigovana.py:
   - Linearna bg subtrakcija
   - K: tesni sideband
-  - Zn: oduzima Cu Kβ (×0.17)
-  - As: oduzima Pb Lα procenjeno iz Pb Lβ
-  - S:  oduzima Pb Mα procenjeno iz Pb Lβ
+  - Zn, S, As: fit familija linija razdvaja Cu Kβ, Pb Mα i Pb Lα
+    (src.analysis.linefit)
 
 Generise:
   1. Mape elemenata za svaki detektor
@@ -27,7 +26,8 @@ Generise:
   4. Sumovani spektar sa anotiranim pikovima
 """
 
-import os, math
+import os, sys, math
+from dataclasses import asdict
 import numpy as np
 import matplotlib
 matplotlib.use("Agg")
@@ -35,23 +35,31 @@ import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 from scipy.stats import linregress
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "xrf-denoise"))
+from src.data.archive import mca_folder, read_mca_files, scan_fingerprint
+from src.data.cache import CacheManifest
+from src.analysis.integrals import apply_weights, significance
+from src.analysis.lines import LINES, compile_lines
+from src.analysis.linefit import LINE_FAMILIES, LineFitter
+from src.analysis.unmixing import apply_unmixing, overlap_ratios, unmixing_matrix
+from src.data.loader import detect_n_channels, iter_spectra
+from src.data.mca import parse_mca_bytes
+
 # ── Colormap helper ────────────────────────────────────────────
 def _mk(name, color):
     return LinearSegmentedColormap.from_list(name, ["#000000", color])
 
 # ── Elementi sa pikovima u ruotato spektru ─────────────────────
+# Energije, prozori i boje iz zajednickog kataloga LINES (src.analysis.lines)
+ELEMENT_LINES = {
+    "S":    LINES["S"],     "K":  LINES["K"],     "Ca": LINES["Ca"],
+    "Ti":   LINES["Ti"],    "Fe": LINES["Fe"],    "Cu": LINES["Cu"],
+    "Zn":   LINES["Zn"],    "PbLl": LINES["Pb_Ll"],
+    "As":   LINES["Pb_La"], "Pb": LINES["Pb_Lb"], "PbLg": LINES["Pb_Lg"],
+}
 ELEMENT_MAP = {
-    "S":    {"name": "S Kα",    "kev": 2.31,  "hw": 0.20, "cmap": _mk("S",   "#FFFF66")},
-    "K":    {"name": "K Kα",    "kev": 3.31,  "hw": 0.15, "cmap": _mk("K",   "#FFD700")},
-    "Ca":   {"name": "Ca Kα",   "kev": 3.69,  "hw": 0.30, "cmap": _mk("Ca",  "#FFFFFF")},
-    "Ti":   {"name": "Ti Kα",   "kev": 4.51,  "hw": 0.30, "cmap": _mk("Ti",  "#FF9966")},
-    "Fe":   {"name": "Fe Kα",   "kev": 6.40,  "hw": 0.30, "cmap": _mk("Fe",  "#FF2200")},
-    "Cu":   {"name": "Cu Kα",   "kev": 8.05,  "hw": 0.30, "cmap": _mk("Cu",  "#00FFAA")},
-    "Zn":   {"name": "Zn Kα",   "kev": 8.64,  "hw": 0.20, "cmap": _mk("Zn",  "#66CCFF")},  # hw 0.25→0.20: hi+1 bi pao u Cu Kβ (8.903 keV)
-    "PbLl": {"name": "Pb Ll",   "kev": 9.185, "hw": 0.28, "cmap": _mk("PbLl","#BB88FF")},
-    "As":   {"name": "Pb Lα",   "kev": 10.54, "hw": 0.30, "cmap": _mk("As",  "#FF8800")},
-    "Pb":   {"name": "Pb Lβ",   "kev": 12.61, "hw": 0.30, "cmap": _mk("Pb",  "#CC66FF")},
-    "PbLg": {"name": "Pb Lγ",   "kev": 14.77, "hw": 0.35, "cmap": _mk("PbLg","#9933AA")},
+    k: {"name": s.name, "kev": s.kev, "hw": s.hw, "cmap": _mk(k, s.color)}
+    for k, s in ELEMENT_LINES.items()
 }
 # Napomena: Ar Kα (2.957 keV) vidljiv samo na det 10264 (tanji Be prozor) – Ar iz vazduha u putu zraka, nije element uzorka
 # Napomena: Cr Kα (5.415 keV) – iskljucen; korelacija izmedju detektora r=0.21, reproducibilnost r=0.37 → statisticki sum
@@ -63,15 +71,10 @@ ELEMENT_DIFF_MAP = {
 
 # ── Prikaz mapa: kombinovani Pb + odvojeni As ──────────────────
 DISPLAY_MAP = {
-    "S":  {"name": "S Kα",              "cmap": _mk("S",  "#FFFF66")},
-    "K":  {"name": "K Kα",              "cmap": _mk("K",  "#FFD700")},
-    "Ca": {"name": "Ca Kα",             "cmap": _mk("Ca", "#FFFFFF")},
-    "Ti": {"name": "Ti Kα",             "cmap": _mk("Ti", "#FF9966")},
-    "Fe": {"name": "Fe Kα",             "cmap": _mk("Fe", "#FF2200")},
-    "Cu": {"name": "Cu Kα",             "cmap": _mk("Cu", "#00FFAA")},
-    "Zn": {"name": "Zn Kα",             "cmap": _mk("Zn", "#66CCFF")},
-    "Pb": {"name": "Pb (Lα+Lβ+Ll+Lγ)", "cmap": _mk("Pb", "#CC66FF")},
-    "As": {"name": "As Kα (kor.)",      "cmap": _mk("As", "#FF8800")},
+    **{k: {"name": ELEMENT_MAP[k]["name"], "cmap": ELEMENT_MAP[k]["cmap"]}
+       for k in ["S", "K", "Ca", "Ti", "Fe", "Cu", "Zn"]},
+    "Pb":  {"name": "Pb (Lα+Lβ+Ll+Lγ)", "cmap": _mk("Pb", LINES["Pb_Lb"].color)},
+    "As":  {"name": "As Kα (kor.)",      "cmap": _mk("As", LINES["Pb_La"].color)},
 }
 DISPLAY_DIFF_MAP = {
     k: {"name": f"Δ {v['name']}", "cmap": "RdBu_r"}
@@ -82,8 +85,16 @@ DISPLAY_DIFF_MAP = {
 _CAL   = np.array([[219,6.4],[278,8.0],[363,10.5],[436,12.6],[869,25.3]])
 _SLOPE, _INTERCEPT, *_ = linregress(_CAL[:,0], _CAL[:,1])
 
-CU_KB_KA_RATIO = 0.17
-PB_LA_LB_RATIO_INIT = 1.40
+# Korekcija preklopljenih linija (kao u analiza_korigovana):
+# "odnosi" – prozor − Theil–Sen odnos × izvor, "fit" – amplitude iz fita linija
+KOREKCIJA = "odnosi"
+KOREKCIJA_OPIS = {"odnosi": "korigovani (Theil–Sen odnosi)", "fit": "iz fita linija"}
+# (cilj, izvor): Cu Kβ u Zn prozoru, Pb Mα u S prozoru, Pb Lα u "As" prozoru
+OVERLAPS = [("Zn", "Cu"), ("S", "Pb"), ("As", "Pb")]
+RATIO_PRIOR = np.array([0.17, 0.005, 1.40])   # Cu Kβ/Kα, Pb Mα/Lβ, Pb Lα/Lβ
+
+# Fit linija: kljuc -> familija (mape "<kljuc>_fit")
+FIT_KEYS = {"S": "S", "Zn": "Zn", "As": "As"}
 
 DETEKTORI = ["10264", "19511"]
 RUOTATO   = "aurora-antico1-ruotato"
@@ -97,153 +108,138 @@ os.makedirs(NPY_CACHE, exist_ok=True)
 #  POMOCNE FUNKCIJE
 # ══════════════════════════════════════════════════════════════
 
-def parse_mca_file(filepath):
-    meta, counts, in_data = {}, [], False
-    with open(filepath) as f:
-        for line in f:
-            line = line.strip()
-            if not line: continue
-            if line == "<<DATA>>":  in_data = True;  continue
-            if line == "<<END>>":   break
-            if in_data:
-                try: counts.append(int(line))
-                except ValueError: pass
-            elif " - " in line:
-                k, v = line.split(" - ", 1)
-                meta[k.strip()] = v.strip()
-    return {"counts": np.array(counts, dtype=np.float64),
-            "time":   float(meta.get("REAL_TIME", 1.0))}
-
-
-def bg_subtracted_integral(counts, energy, target_kev, hw=0.30, bg_hw=0.25):
-    idx     = int(np.argmin(np.abs(energy - target_kev)))
-    half_ch = max(1, int(round(hw   / _SLOPE)))
-    bg_ch   = max(1, int(round(bg_hw / _SLOPE)))
-    lo = max(0,               idx - half_ch)
-    hi = min(len(counts) - 1, idx + half_ch)
-    bg_lo_l = max(0,               lo - bg_ch)
-    bg_lo_r = lo
-    bg_hi_l = hi + 1
-    bg_hi_r = min(len(counts) - 1, hi + 1 + bg_ch)
-    bg_left  = counts[bg_lo_l:bg_lo_r].mean() if bg_lo_r > bg_lo_l else counts[lo]
-    bg_right = counts[bg_hi_l:bg_hi_r].mean() if bg_hi_r > bg_hi_l else counts[hi]
-    n_peak   = hi - lo + 1
-    bg_line  = np.linspace(bg_left, bg_right, n_peak)
-    return max(0.0, float((counts[lo:hi+1] - bg_line).sum()))
-
-
-def k_signal(counts, energy):
-    """K Kα sa tesnim sidebandzima (izbegava Ar i Ca)."""
-    k_ch  = int(np.argmin(np.abs(energy - 3.3138)))
-    pk_lo = k_ch - 2
-    pk_hi = k_ch + 2
-    ch_ll = int(np.argmin(np.abs(energy - 3.23)))
-    ch_lr = int(np.argmin(np.abs(energy - 3.28)))
-    ch_rl = int(np.argmin(np.abs(energy - 3.35)))
-    ch_rr = int(np.argmin(np.abs(energy - 3.42)))
-    bg_left  = counts[ch_ll:ch_lr+1].mean() if ch_lr >= ch_ll else counts[pk_lo]
-    bg_right = counts[ch_rl:ch_rr+1].mean() if ch_rr >= ch_rl else counts[pk_hi]
-    bg_per_ch = (bg_left + bg_right) / 2.0
-    return max(0.0, float(counts[pk_lo:pk_hi+1].sum()) - bg_per_ch * (pk_hi - pk_lo + 1))
-
-
-def integral_for(counts, energy, key):
-    if key == "K":
-        return k_signal(counts, energy)
-    el = ELEMENT_MAP[key]
-    return bg_subtracted_integral(counts, energy, el["kev"], el["hw"])
+def integrals_for(spectra, energy, keys):
+    """Neto signali (N, len(keys)) za sve piksele odjednom i njihove Poisson
+    varijanse (counts @ w², isti matmul); K Kα sa tesnim sidebandzima
+    (izbegava Ar i Ca), ostali sa linearnom pozadinom."""
+    # Spec-ovi prozora (src.analysis.lines) -> jedna (C, E) matrica tezina
+    kernel = compile_lines({k: ELEMENT_LINES[k] for k in keys}, energy, _SLOPE)
+    return apply_weights(spectra, kernel.weights, variance=True)
+
+
+def fit_amplitudes(spectra, energy, keys, label=""):
+    """Amplitude (N, len(keys)) za kljuceve "<el>_fit" iz fita familija linija
+    + kontinuum (svi spektri odjednom, src.analysis.linefit) i njihove
+    Poisson varijanse."""
+    fitter = LineFitter(energy)
+    amps, resid, var = fitter.fit(spectra, variance=True)
+    print(f"  [{label}] Fit linija: RMS reziduala {np.sqrt(np.mean(resid ** 2)):.2f} counts/kanal")
+    idx = [fitter.families.index(FIT_KEYS[k[:-len("_fit")]]) for k in keys]
+    return amps[:, idx], var[:, idx]
+
+
+def element_params(key):
+    """Parametri od kojih zavisi mapa elementa (za validaciju cache-a)."""
+    params = {"w": W, "h": H, "slope": _SLOPE, "intercept": _INTERCEPT}
+    if key.endswith("_fit"):
+        return {**params, "method": "linefit", "families": LINE_FAMILIES}
+    return {**params, "method": "line_window", **asdict(ELEMENT_LINES[key])}
 
 
 def process_dataset(folder, label):
     el_keys = list(ELEMENT_MAP.keys())
+    if KOREKCIJA == "fit":
+        el_keys += [f"{k}_fit" for k in FIT_KEYS]
     total   = W * H
 
-    cache_paths = {k: os.path.join(NPY_CACHE, f"{label}_{k}.npy") for k in el_keys}
-    if all(os.path.exists(p) for p in cache_paths.values()):
-        print(f"  [{label}] Ucitavam iz cache-a...")
-        return np.stack([np.load(cache_paths[k]) for k in el_keys], axis=0), el_keys
+    # Manifest: samo elementi ciji su se fajlovi/kalibracija/prozori promenili
+    manifest = CacheManifest(NPY_CACHE)
+    sources  = scan_fingerprint(mca_folder(folder), total)
+    # Mapa i njena Poisson varijansa (<label>_<el>_var.npy) dele otisak
+    fps      = {f"{label}_{k}{suf}.npy": manifest.fingerprint(sources, element_params(k))
+                for k in el_keys for suf in ("", "_var")}
+    stale    = set(manifest.stale(fps))
 
     cube = np.zeros((len(el_keys), H, W), dtype=np.float64)
-    _ec  = {}
-
-    for i in range(1, total + 1):
-        path = os.path.join(folder, f"None_{i}.mca")
-        if not os.path.exists(path):
-            continue
-        data   = parse_mca_file(path)
-        counts = data["counts"]
-        n_ch   = len(counts)
-        if n_ch not in _ec:
-            _ec[n_ch] = np.arange(n_ch) * _SLOPE + _INTERCEPT
-        energy = _ec[n_ch]
-        row, col = (i-1) // W, (i-1) % W
-        for ei, key in enumerate(el_keys):
-            cube[ei, row, col] = integral_for(counts, energy, key)
-        if i % 500 == 0 or i == total:
-            print(f"  [{label}] {i}/{total} ({100*i//total}%)")
-
+    var  = np.zeros((len(el_keys), H, W), dtype=np.float64)
+    todo = [ei for ei, k in enumerate(el_keys)
+            if {f"{label}_{k}.npy", f"{label}_{k}_var.npy"} & stale]
     for ei, k in enumerate(el_keys):
-        np.save(cache_paths[k], cube[ei])
+        if ei not in todo:
+            cube[ei] = np.load(os.path.join(NPY_CACHE, f"{label}_{k}.npy"))
+            var[ei]  = np.load(os.path.join(NPY_CACHE, f"{label}_{k}_var.npy"))
+    if not todo:
+        print(f"  [{label}] Ucitavam iz cache-a...")
+        return cube, var, el_keys
+    print(f"  [{label}] Racunam {len(todo)}/{len(el_keys)} elemenata")
+
+    # (N, C) matrica spektara; folder moze biti i unutar zip/tar arhive
+    # (paralelna dekompresija)
+    n_ch    = detect_n_channels(folder, total)
+    spektri = np.zeros((total, n_ch))
+    for i, data in iter_spectra(folder, total, n_workers=os.cpu_count()):
+        counts = data["counts"][:n_ch]
+        spektri[i - 1, :len(counts)] = counts
+
+    energy   = np.arange(n_ch) * _SLOPE + _INTERCEPT
+    win_keys = [el_keys[ei] for ei in todo if el_keys[ei] in ELEMENT_MAP]
+    fit_keys = [el_keys[ei] for ei in todo if el_keys[ei] not in ELEMENT_MAP]
+    vals = {}
+    if win_keys:
+        maps, variances = integrals_for(spektri, energy, win_keys)
+        vals.update(zip(win_keys, zip(maps.T, variances.T)))
+    if fit_keys:
+        maps, variances = fit_amplitudes(spektri, energy, fit_keys, label)
+        vals.update(zip(fit_keys, zip(maps.T, variances.T)))
+    for ei in todo:
+        cube[ei] = vals[el_keys[ei]][0].reshape(H, W)
+        var[ei]  = vals[el_keys[ei]][1].reshape(H, W)
+
+    for ei in todo:
+        np.save(os.path.join(NPY_CACHE, f"{label}_{el_keys[ei]}.npy"), cube[ei])
+        np.save(os.path.join(NPY_CACHE, f"{label}_{el_keys[ei]}_var.npy"), var[ei])
+    manifest.record({f"{label}_{el_keys[ei]}{suf}.npy": fps[f"{label}_{el_keys[ei]}{suf}.npy"]
+                     for ei in todo for suf in ("", "_var")})
     print(f"  [{label}] Cache sacuvan.")
-    return cube, el_keys
-
-
-def apply_corrections(cube, el_keys, label=""):
-    cube = cube.copy()
-    ku   = {k: i for i, k in enumerate(el_keys)}
+    return cube, var, el_keys
 
-    # Zn − Cu Kβ
-    if "Cu" in ku and "Zn" in ku:
-        cube[ku["Zn"]] = np.maximum(0, cube[ku["Zn"]] - CU_KB_KA_RATIO * cube[ku["Cu"]])
 
-    # Pb Lα (prozor 10.54 keV): As nije prisutan u uzorku,
-    # sirovi integral direktno prikazuje Pb Lα distribuciju — bez korekcije.
-
-    # S − Pb Mα
-    if "S" in ku and "Pb" in ku:
-        s_f, pb_f = cube[ku["S"]].flatten(), cube[ku["Pb"]].flatten()
-        mask = s_f <= np.percentile(s_f, 25)
-        if mask.sum() > 30 and pb_f[mask].std() > 1:
-            s2, _, r, *_ = linregress(pb_f[mask], s_f[mask])
-            r_s = max(0.0, min(2.0, s2))
-            print(f"  [{label}] Pb Ma/Lb = {r_s:.4f}  (r={r:.3f})")
-        else:
-            r_s = 0.005
-        cube[ku["S"]] = np.maximum(0, cube[ku["S"]] - r_s * cube[ku["Pb"]])
-
-    return cube
-
-
-def build_display_cube(cube, el_keys, label=""):
+def estimate_ratios(cubes):
+    """
+    Odnosi preklopa (OVERLAPS) za oba detektora u jednom batch-u: Theil–Sen
+    nagib cilja prema izvoru po svim pikselima (pikseli sa ciljem su
+    outlieri i ne pomeraju medijanu). Ograniceni na [0, 2]; bez procene ->
+    RATIO_PRIOR.
     """
-    Gradi display cube (8 kanala) od raw cube (10 kanala):
-      - S, Ca, Ti, Fe, Cu, Zn  ->  direktno (vec korigovani)
+    dets   = list(cubes)
+    keys   = cubes[dets[0]][2]
+    stacks = np.stack([cubes[d][0].reshape(len(keys), -1) for d in dets])
+    ratios = overlap_ratios(stacks, keys, OVERLAPS)
+    ratios = np.where(np.isnan(ratios), RATIO_PRIOR, np.clip(ratios, 0.0, 2.0))
+    for b, det in enumerate(dets):
+        print(f"  [ruotato_{det}] odnosi: " + ", ".join(
+            f"{t}<-{s} {ratios[b, o]:.4f}" for o, (t, s) in enumerate(OVERLAPS)))
+    return dict(zip(dets, ratios))
+
+
+def correction_matrix(el_keys, ratios=None):
+    """
+    (E, D) matrica sirove mape -> display mape (DISPLAY_MAP), jedan matmul:
+      - S, Zn, As  ->  prozor − odnos × izvor; bez odnosa (KOREKCIJA = "fit")
+                       amplitude "<el>_fit"
       - Pb  ->  suma svih Pb linija (PbLl + PbLα + PbLβ + PbLγ)
-      - As  ->  korigovani As signal (PbLα prozor − ratio × PbLβ)
+      - K, Ca, Ti, Fe, Cu  ->  direktno
     """
-    ku = {k: i for i, k in enumerate(el_keys)}
-
-    # Kombinovani Pb: suma svih cetiri Pb linija
-    pb_combined = (cube[ku["PbLl"]] + cube[ku["As"]] +
-                   cube[ku["Pb"]]   + cube[ku["PbLg"]])
-
-    # Odvojeni As: oduzmi Pb Lα doprinos iz As/PbLα prozora
-    as_raw = cube[ku["As"]]
-    pb_lb  = cube[ku["Pb"]]
-    as_f, pb_f = as_raw.flatten(), pb_lb.flatten()
-    mask = as_f <= np.percentile(as_f, 25)
-    if mask.sum() > 30 and pb_f[mask].std() > 1:
-        s, _, r, *_ = linregress(pb_f[mask], as_f[mask])
-        ratio = max(0.5, min(2.5, s))
-        print(f"  [{label}] As: Pb Lα/Lβ ratio = {ratio:.3f}  (r={r:.3f})")
+    ku  = {k: i for i, k in enumerate(el_keys)}
+    eye = np.eye(len(el_keys))
+    if ratios is None:
+        cols = {k: eye[:, ku[k]] for k in el_keys}
+        cols.update({k: eye[:, ku[f"{k}_fit"]] for k in FIT_KEYS})
     else:
-        ratio = PB_LA_LB_RATIO_INIT
-    as_corr = np.maximum(0, as_raw - ratio * pb_lb)
+        unmix = unmixing_matrix(el_keys, OVERLAPS, ratios)
+        cols  = {k: unmix[:, ku[k]] for k in el_keys}
+    cols["Pb"] = eye[:, [ku[k] for k in ("PbLl", "As", "Pb", "PbLg")]].sum(axis=1)
+    return np.stack([cols[k] for k in DISPLAY_MAP], axis=1)
 
-    disp_keys = ["S", "K", "Ca", "Ti", "Fe", "Cu", "Zn", "Pb", "As"]
-    disp = [cube[ku[k]] for k in ["S", "K", "Ca", "Ti", "Fe", "Cu", "Zn"]]
-    disp += [pb_combined, as_corr]
-    return np.stack(disp, axis=0), disp_keys
+
+def build_display_cube(cube, el_keys, ratios=None, variance=False):
+    """
+    Display cube (9 kanala) iz sirovih mapa jednim matmul-om sa
+    correction_matrix; negativne vrednosti -> 0. Sa variance=True `cube`
+    su Poisson varijanse mapa.
+    """
+    matrix = correction_matrix(el_keys, ratios)
+    return apply_unmixing(cube, matrix, clip=True, variance=variance), list(DISPLAY_MAP)
 
 
 def render_display(cube, disp_keys, save_path, title="", is_diff=False):
@@ -371,19 +367,8 @@ def plot_stacked_spectrum(det_folder, det_label, save_path):
     """Sumirani spektar sa anotiranim pikovima."""
     stacked = np.zeros(1024)
     n = 0
-    for i in range(1, W*H+1):
-        path = os.path.join(det_folder, f"None_{i}.mca")
-        if not os.path.exists(path): continue
-        counts = []
-        in_data = False
-        with open(path) as f:
-            for line in f:
-                line = line.strip()
-                if line == "<<DATA>>": in_data = True; continue
-                if line == "<<END>>": break
-                if in_data:
-                    try: counts.append(int(line))
-                    except: pass
+    for _, raw in read_mca_files(mca_folder(det_folder), range(1, W*H+1)):
+        _, counts = parse_mca_bytes(raw)
         if len(counts) >= 1024:
             stacked[:1024] += counts[:1024]
             n += 1
@@ -441,8 +426,9 @@ def plot_stacked_spectrum(det_folder, det_label, save_path):
 #  OBRADA
 # ══════════════════════════════════════════════════════════════
 
-cubes  = {}   # (cube_corr, keys)   — 10 kanala, za internu upotrebu
-dcubes = {}   # (disp_cube, dkeys)  — 8 kanala, za prikaz
+cubes  = {}   # (cube, var, keys) — sirove mape + Poisson varijanse
+dcubes = {}   # (disp_cube, dkeys)  — 9 kanala, za prikaz
+dvars  = {}   # Poisson varijanse display mapa
 
 for det in DETEKTORI:
     folder = os.path.join(RUOTATO, det)
@@ -450,12 +436,14 @@ for det in DETEKTORI:
     print(f"\n{'='*60}")
     print(f"  Obrada: {label}  ({W}×{H} = {W*H} tacaka)")
     print(f"{'='*60}")
-    cube, keys = process_dataset(folder, label)
-    print(f"  Korekcije...")
-    cube_corr = apply_corrections(cube, keys, label)
-    cubes[det] = (cube_corr, keys)
-    disp_cube, dkeys = build_display_cube(cube_corr, keys, det)
-    dcubes[det] = (disp_cube, dkeys)
+    cubes[det] = process_dataset(folder, label)
+
+# Korekcija preklopa: odnosi oba detektora odjednom, pa jedan matmul po skenu
+print(f"\n--- Korekcija preklopljenih linija ({KOREKCIJA}) ---")
+ratios = estimate_ratios(cubes) if KOREKCIJA == "odnosi" else {}
+for det, (cube, var, keys) in cubes.items():
+    dcubes[det]   = build_display_cube(cube, keys, ratios.get(det))
+    dvars[det], _ = build_display_cube(var, keys, ratios.get(det), variance=True)
 
 
 # ── Sumirani spektri ──────────────────────────────────────────
@@ -472,7 +460,7 @@ for det in DETEKTORI:
     render_display(disp_cube, dkeys,
         os.path.join(IZLAZ, f"elementi_{det}.png"),
         title=f"Mape elemenata – Ruotato  |  Detektor {det}\n"
-              f"bg oduzeta  ·  Zn−CuKβ  ·  S−PbMα  ·  Pb kombinovano  ·  As korigovano  ({W}×{H})")
+              f"bg oduzeta  ·  Zn, S, As {KOREKCIJA_OPIS[KOREKCIJA]}  ·  Pb kombinovano  ({W}×{H})")
 
 
 # ── Suma oba detektora (bolji SNR) ────────────────────────────
@@ -491,6 +479,10 @@ render_display(disp_diff, dkeys,
     title="Razlika detektora: 10264 − 19511  |  Ruotato\n"
           "CRVENO = vise u 10264  |  PLAVO = vise u 19511",
     is_diff=True)
+# Udeo piksela gde se detektori razlikuju van Poisson suma (|Δ| > 3σ)
+z = significance(disp_diff, dvars["10264"] + dvars["19511"])
+print("  |Δ|>3σ: " + ", ".join(f"{k} {np.mean(np.abs(z[ki]) > 3):.0%}"
+                               for ki, k in enumerate(dkeys)))
 
 
 # ── Individualne mape po elementu ────────────────────────────
@@ -21,6 +21,9 @@ matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from scipy.stats import linregress
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "xrf-denoise"))
+from src.data.mca import parse_mca_bytes
+
 # ── Kalibracija ───────────────────────────────────────────────
 CAL = np.array([[219, 6.4], [278, 8.0], [363, 10.5], [436, 12.6], [869, 25.3]])
 SLOPE, INTERCEPT, *_ = linregress(CAL[:, 0], CAL[:, 1])
@@ -62,29 +65,13 @@ for det in DETEKTORI:
 
 # ── Parsiranje MCA fajla ───────────────────────────────────────
 def parse_mca(filepath):
-    counts, in_data = [], False
-    real_time = 3.0
-    with open(filepath) as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            if line == "<<DATA>>":
-                in_data = True
-                continue
-            if line == "<<END>>":
-                break
-            if in_data:
-                try:
-                    counts.append(int(line))
-                except ValueError:
-                    pass
-            elif line.startswith("REAL_TIME"):
-                try:
-                    real_time = float(line.split(" - ", 1)[1])
-                except Exception:
-                    pass
-    return np.array(counts, dtype=np.float64), real_time
+    with open(filepath, "rb") as f:
+        meta, counts = parse_mca_bytes(f.read())
+    try:
+        real_time = float(meta.get("REAL_TIME", 3.0))
+    except ValueError:
+        real_time = 3.0
+    return counts.astype(np.float64), real_time
 
 
 # ── Glavna petlja ──────────────────────────────────────────────
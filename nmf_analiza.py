@@ -33,6 +33,12 @@ from scipy.stats import linregress
 from sklearn.decomposition import NMF
 from sklearn.preprocessing import normalize
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "xrf-denoise"))
+from src.analysis.lines import known_peaks
+from src.data.continuum import cached_continuum, remove_continuum, snip_width
+from src.data.header_index import acquisition_times, build_header_index
+from src.data.loader import average_cps, load_counts_matrix
+
 # ─── Konfiguracija ───────────────────────────────────────────────────────────
 DATASET_LABEL = sys.argv[1] if len(sys.argv) > 1 else 'prova1'
 _DATASET_MAP  = {
@@ -49,95 +55,59 @@ os.makedirs(IZLAZ, exist_ok=True)
 _CAL = np.array([[219, 6.4], [278, 8.0], [363, 10.5], [436, 12.6], [869, 25.3]])
 _SLOPE, _INTERCEPT, *_ = linregress(_CAL[:, 0], _CAL[:, 1])
 
+# SNIP kontinuum (rasejanje, zakocno zracenje) pre NMF: sirina u keV,
+# None = bez uklanjanja. Npr. 0.5 - komponente tada opisuju samo pikove.
+SNIP_SIRINA_KEV = None
+
 # Poznati XRF pikovi za anotaciju
-POZNATI_PIKOVI = {
-    'K':     3.31,
-    'Ca':    3.69,
-    'Ti':    4.51,
-    'Fe Ka': 6.40,
-    'Fe Kb': 7.06,
-    'Cu Ka': 8.05,
-    'Zn Ka': 8.64,
-    'Pb La': 10.55,
-    'Pb Lb': 12.61,
-    'Sr Ka': 14.16,
-    'Sn Ka': 25.27,
-}
+POZNATI_PIKOVI = known_peaks(["K", "Ca", "Ti", "Fe", "Fe_Kb", "Cu", "Zn",
+                              "Pb_La", "Pb_Lb", "Sr", "Sn"])
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  UCITAVANJE SIROVIH SPEKTARA
 # ══════════════════════════════════════════════════════════════════════════════
 
-def parse_mca_file(filepath):
-    meta, counts, in_data = {}, [], False
-    with open(filepath) as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            if line == "<<DATA>>":
-                in_data = True
-                continue
-            if line == "<<END>>":
-                in_data = False
-                break
-            if in_data:
-                try:
-                    counts.append(int(line))
-                except ValueError:
-                    pass
-            elif " - " in line:
-                k, v = line.split(" - ", 1)
-                meta[k.strip()] = v.strip()
-    return {
-        "counts": np.array(counts, dtype=np.float64),
-        "time":   float(meta.get("REAL_TIME", 1.0)),
-    }
-
-
 TOTAL = ROWS * COLS
-CACHE_PATH = os.path.join(IZLAZ, f'spektri_matrica_{DATASET_LABEL}.npy')
+CACHE_PATH = os.path.join(IZLAZ, f'spektri_matrica_{DATASET_LABEL}_1-30keV.npy')
 
+# Koristan opseg (1 - 30 keV) da izbacimo sum na krajevima: samo ti kanali
+# se ucitavaju i cuvaju
+ch_lo = max(0, int((1.0 - _INTERCEPT) / _SLOPE))
+ch_hi = int((30.0 - _INTERCEPT) / _SLOPE)
+
+# Sirovi brojevi (n_det, piksela, kanala) u najmanjem uint tipu + vremena;
+# CPS (prosek detektora) se racuna tek pri pretprocesiranju, ispod.
 if os.path.exists(CACHE_PATH):
     print(f"Ucitavam kesirane spektre iz {CACHE_PATH}...")
-    D = np.load(CACHE_PATH)
-    n_channels = D.shape[1]
+    counts = np.load(CACHE_PATH)
+    # Vremena akvizicije iz indeksa zaglavlja (bez citanja spektara);
+    # indeks se kesira u IZLAZ, sirovi dataset se ne menja
+    times = np.stack([acquisition_times(build_header_index(DATASET_DIR, det, ROWS, COLS,
+                                                         cache_dir=IZLAZ))
+                      for det in DETEKTORI])
 else:
     print(f"Ucitavam {TOTAL} spektara iz oba detektora...")
-    # Ucitaj prvi fajl da odredimo broj kanala
-    test_path = os.path.join(DATASET_DIR, DETEKTORI[0], 'None_1.mca')
-    test_data = parse_mca_file(test_path)
-    n_channels = len(test_data['counts'])
-    print(f"  Kanala po spektru: {n_channels}")
-
-    D = np.zeros((TOTAL, n_channels), dtype=np.float64)
-
-    for det in DETEKTORI:
-        folder = os.path.join(DATASET_DIR, det)
-        print(f"  Detektor {det}...", end=" ", flush=True)
-        for i in range(1, TOTAL + 1):
-            path = os.path.join(folder, f'None_{i}.mca')
-            data = parse_mca_file(path)
-            counts = data['counts']
-            t = data['time']
-            # Normalizacija na CPS (counts per second)
-            cps = counts / max(t, 0.1)
-            # Dodajemo (prosek dva detektora)
-            D[i - 1] += cps / len(DETEKTORI)
-
-            if i % 1000 == 0:
-                print(f"{i}", end=" ", flush=True)
-        print("OK")
+    # Oba detektora se citaju istovremeno (bez child procesa - skripta nema __main__)
+    counts, times = load_counts_matrix(DATASET_DIR, DETEKTORI, TOTAL,
+                                       channels=slice(ch_lo, ch_hi))
 
     # Sacuvaj kes
-    np.save(CACHE_PATH, D)
+    np.save(CACHE_PATH, counts)
     print(f"  Kesirano: {CACHE_PATH}")
 
-print(f"  Matrica spektara: {D.shape} ({D.shape[0]} piksela x {D.shape[1]} kanala)")
+n_channels = counts.shape[2]
+print(f"  Matrica spektara: {counts.shape[1]} piksela x {n_channels} kanala "
+      f"({counts.dtype}, {counts.nbytes / 1e6:.0f} MB)")
 
-# Energijska osa
-energy = np.arange(n_channels) * _SLOPE + _INTERCEPT
+if SNIP_SIRINA_KEV:
+    # Kontinuum se racuna jednom i kesira uz matricu spektara
+    sirina = snip_width(SNIP_SIRINA_KEV, _SLOPE)
+    print(f"  Uklanjam SNIP kontinuum ({sirina} kanala)...")
+    counts = remove_continuum(counts, cached_continuum(counts, sirina, CACHE_PATH))
+
+# Energijska osa (ucitanih kanala)
+energy = (ch_lo + np.arange(n_channels)) * _SLOPE + _INTERCEPT
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -146,11 +116,9 @@ energy = np.arange(n_channels) * _SLOPE + _INTERCEPT
 
 print("Pretprocesiranje...")
 
-# Ogranicimo na koristan opseg (1 - 30 keV) da izbacimo sum na krajevima
-ch_lo = max(0, int((1.0 - _INTERCEPT) / _SLOPE))
-ch_hi = min(n_channels, int((30.0 - _INTERCEPT) / _SLOPE))
-D_trim = D[:, ch_lo:ch_hi]
-energy_trim = energy[ch_lo:ch_hi]
+# Spektri su vec ograniceni na koristan opseg (1 - 30 keV)
+D_trim = average_cps(counts, times)
+energy_trim = energy
 
 # NMF zahteva ne-negativne vrednosti
 D_trim = np.maximum(D_trim, 0)
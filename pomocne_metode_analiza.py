@@ -1,12 +1,17 @@
 import math
 import os
-from functools import lru_cache
+import sys
 from typing import Any
 
 import numpy as np
 from matplotlib import pyplot as plt
 from scipy.stats import linregress
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "xrf-denoise"))
+from src.analysis.integrals import dynamic_peak_areas
+from src.data.loader import detect_n_channels, ingest_folders
+from src.data.spectrum_cache import SPECTRUM_CACHE, cached_parse
+
 # Strictly White -> Color or Black -> Color
 ELEMENT_MAP = {
    #"S":  {"name": "Sulphur", "kev": 2.31, "cmap": "YlOrBr"}, # White-Yellow-Brown
@@ -30,96 +35,62 @@ ELEMENT_DIFF_MAP = {
 }
 
 def get_dynamic_area(energy_axis, cps, target_kev):
-    idx = int(np.argmin(np.abs(energy_axis - target_kev)))
+    """
+    Peak area over the monotone flanks around target_kev (at most ~1 keV per side).
+    cps may be one spectrum (C,) or a batch (..., C); see dynamic_peak_areas.
+    """
     #smoothed = gaussian_filter1d(cps, sigma=1.5)
+    area = dynamic_peak_areas(cps, energy_axis, target_kev, max_kev=1.0)
+    return float(area) if np.ndim(cps) == 1 else area
 
-    l = idx
-    while l > 0 and cps[l - 1] < cps[l]:
-        l -= 1
-        if energy_axis[idx] - energy_axis[l] > 1.0:
-            break
-
-    r = idx
-    while r < cps.shape[0] - 1 and cps[r + 1] < cps[r]:
-        r += 1
-        if energy_axis[r] - energy_axis[idx] > 1.0:
-            break
-
-    # Using the updated trapezoid function
-    return np.trapezoid(cps[l:r + 1], x=energy_axis[l:r + 1])
+def process_image_data(folder_path, width=120, height=60, elemenent_map=None, n_workers=1):
+    return process_many([folder_path], width, height, elemenent_map, n_workers)[0]
 
-def process_image_data(folder_path, width=120, height=60, elemenent_map=None):
+def process_many(folder_paths, width=120, height=60, elemenent_map=None, n_workers=1):
+    """process_image_data for several folders; all of them are read concurrently."""
     if elemenent_map is None:
         elemenent_map = ELEMENT_MAP
     total_points = width * height
     element_keys = list(elemenent_map.keys())
 
-    # NEW: Initialize as a 3D matrix (Channels, Height, Width)
-    matrix_3d = np.zeros((len(element_keys), height, width))
-
     cal_pts = np.array([[219, 6.4], [278, 8], [363, 10.5], [436, 12.6], [869, 25.3]])
     slope, intercept, _, _, _ = linregress(cal_pts[:, 0], cal_pts[:, 1])
 
-    for i in range(1, total_points + 1):
-        filename = f"None_{i}.mca"
-        path = os.path.join(folder_path, filename)
+    # Raw spectra of every folder are read into (height, width, channels) cubes in one pass
+    n_chs = [detect_n_channels(folder_path, total_points) for folder_path in folder_paths]
+    ingested = ingest_folders(folder_paths, height, width, n_chs,
+                              n_workers=n_workers, dtype=np.float64)
+
+    results = []
+    for folder_path, n_ch, (counts_cube, times, missing) in zip(folder_paths, n_chs, ingested):
+        # NEW: Initialize as a 3D matrix (Channels, Height, Width)
+        matrix_3d = np.zeros((len(element_keys), height, width))
 
-        if not os.path.exists(path):
+        for i in missing:
             # Useful for debugging missing steps in the scan
-            print(f"Warning: Missing file {filename}")
-            continue
+            print(f"Warning: Missing file None_{i}.mca in {folder_path}")
+        missing = set(missing)
 
-        data = parse_mca_file(path)
-        energy_axis = (np.arange(len(data['counts'])) * slope) + intercept
-        cps = data['counts'] / data['time']
-        row = (i - 1) // width
-        col = (i - 1) % width
+        energy_axis = (np.arange(n_ch) * slope) + intercept
+        # All present pixels at once; missing ones stay 0
+        present = np.ones(total_points, dtype=bool)
+        present[[i - 1 for i in missing]] = False
+        cps = counts_cube.reshape(total_points, n_ch)[present] / times[present, None]
 
         for idx, key in enumerate(element_keys):
-            area = get_dynamic_area(energy_axis, cps, elemenent_map[key]['kev'])
-            matrix_3d[idx, row, col] = area
-
-        if i%100 == 0:
-            print(f"Processed {i}...")
+            matrix_3d[idx].reshape(-1)[present] = get_dynamic_area(
+                energy_axis, cps, elemenent_map[key]['kev'])
+        print(f"Processed {int(present.sum())} spectra in {folder_path}")
 
-    return matrix_3d, element_keys, width, height
+        results.append((matrix_3d, element_keys, width, height))
+    return results
 
-@lru_cache(maxsize=None)
 def parse_mca_file(filepath):
     """
     Parses a .mca file, extracting metadata and the raw counts.
-    Stops reading data when the <<END>> tag is encountered.
+    Served from the shared SPECTRUM_CACHE (see SPECTRUM_CACHE.info() for hit/miss/evict counts).
     """
-    metadata = {}
-    counts = []
-    in_data_section = False
-
-    with open(filepath, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line: continue
-
-            if line == "<<DATA>>":
-                in_data_section = True
-                continue
-            if line == "<<END>>":
-                in_data_section = False
-                break
-
-            if in_data_section:
-                try:
-                    counts.append(int(line))
-                except ValueError:
-                    continue
-            else:
-                if " - " in line:
-                    parts = line.split(" - ", 1)
-                    metadata[parts[0].strip()] = parts[1].strip()
-
-    return {
-        "counts": np.array(counts, dtype=np.float64),
-        "time": float(metadata.get("REAL_TIME", 1.0))
-    }
+    return cached_parse(filepath)
 
 def render_element_grid(matrix_3d: np.ndarray[Any, np.dtype[np.float64]], element_keys, element_map, width = 120, height = 60, savename ="", figname =""):
     num_elements = len(element_keys)
@@ -161,8 +132,8 @@ def render_element_grid(matrix_3d: np.ndarray[Any, np.dtype[np.float64]], elemen
         print(f"Figure saved to: {savename}")
     plt.show(block = False)
 
-def full_thing(folder_path, save_path, w=120, h=60):
-    cube, keys, w, h = process_image_data(folder_path, w, h)
+def full_thing(folder_path, save_path, w=120, h=60, n_workers=1):
+    cube, keys, w, h = process_image_data(folder_path, w, h, n_workers=n_workers)
     render_element_grid(cube, keys, ELEMENT_MAP, w, h, save_path)
     return cube, keys
 
@@ -246,10 +217,16 @@ def render_comparisons(strips: list[np.ndarray[Any, np.dtype[np.float64]]], elem
 
 
 if __name__ == "__main__":
-    cube_prova1_10264, keys = full_thing("Resources/aurora-antico1-prova1/10264", "rezultati/prova1/10264.png")
-    cube_prova2_10264, _ = full_thing("Resources/aurora-antico1-prova2/10264", "rezultati/prova2/10264.png")
-    cube_prova1_19511, _ = full_thing("Resources/aurora-antico1-prova1/19511", "rezultati/prova1/19511.png")
-    cube_prova2_19511, _ = full_thing("Resources/aurora-antico1-prova2/19511", "rezultati/prova2/19511.png")
+    n_workers = os.cpu_count() or 1
+    # All four (campaign, detector) folders are read in one concurrent pass
+    scans = [(f"Resources/aurora-antico1-{prova}/{det}", f"rezultati/{prova}/{det}.png")
+             for prova, det in [("prova1", "10264"), ("prova2", "10264"),
+                                ("prova1", "19511"), ("prova2", "19511")]]
+    results = process_many([folder for folder, _ in scans], n_workers=n_workers)
+    for (cube, keys, w, h), (_, save_path) in zip(results, scans):
+        render_element_grid(cube, keys, ELEMENT_MAP, w, h, save_path)
+    (cube_prova1_10264, keys, _, _), (cube_prova2_10264, *_), \
+        (cube_prova1_19511, *_), (cube_prova2_19511, *_) = results
 
     render_comparisons([cube_prova1_19511, cube_prova1_10264, cube_prova1_10264-cube_prova1_19511],
                        keys,
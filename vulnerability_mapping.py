@@ -79,6 +79,14 @@ from scipy.ndimage import gaussian_filter, uniform_filter
 from sklearn.decomposition import NMF
 from scipy.signal import find_peaks
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "xrf-denoise"))
+from src.analysis.lines import known_peaks
+from src.data.archive import mca_folder, scan_fingerprint
+from src.data.cache import CacheManifest
+from src.data.continuum import cached_continuum, remove_continuum, snip_width
+from src.data.header_index import acquisition_times, build_header_index
+from src.data.loader import average_cps, load_counts_matrix
+
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  KONFIGURACIJA
@@ -97,13 +105,15 @@ os.makedirs(IZLAZ, exist_ok=True)
 _CAL = np.array([[219, 6.4], [278, 8.0], [363, 10.5], [436, 12.6], [869, 25.3]])
 _SLOPE, _INTERCEPT, *_ = linregress(_CAL[:, 0], _CAL[:, 1])
 
+# Koristan opseg za NMF (1-30 keV) - samo ovi kanali se ucitavaju i cuvaju
+NMF_KANALI = slice(max(0, int((1.0 - _INTERCEPT) / _SLOPE)), int((30.0 - _INTERCEPT) / _SLOPE))
+
+# SNIP kontinuum pre NMF: sirina u keV, None = bez uklanjanja (npr. 0.5)
+SNIP_SIRINA_KEV = None
+
 # Poznati XRF pikovi
-POZNATI_PIKOVI = {
-    'K':     3.31, 'Ca':    3.69, 'Ti':    4.51,
-    'Fe Ka': 6.40, 'Fe Kb': 7.06, 'Cu Ka': 8.05,
-    'Zn Ka': 8.64, 'Pb La': 10.55, 'Pb Lb': 12.61,
-    'Sr Ka': 14.16, 'Sn Ka': 25.27,
-}
+POZNATI_PIKOVI = known_peaks(["K", "Ca", "Ti", "Fe", "Fe_Kb", "Cu", "Zn",
+                              "Pb_La", "Pb_Lb", "Sr", "Sn"])
 
 # ─── Colormap za rizik (zelena=bezbedan → zuta=umeren → crvena=visok) ────────
 RISK_CMAP = LinearSegmentedColormap.from_list('risk', [
@@ -137,63 +147,48 @@ def norm_percentil(mapa, q_lo=8, q_hi=99):
     return np.clip((mapa - bg) / (peak - bg + 1e-10), 0, 1)
 
 
-def parse_mca_file(filepath):
-    """Parsira .mca fajl i vraca counts niz i vreme akvizicije."""
-    meta, counts, in_data = {}, [], False
-    with open(filepath) as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            if line == "<<DATA>>":
-                in_data = True
-                continue
-            if line == "<<END>>":
-                in_data = False
-                break
-            if in_data:
-                try:
-                    counts.append(int(line))
-                except ValueError:
-                    pass
-            elif " - " in line:
-                k, v = line.split(" - ", 1)
-                meta[k.strip()] = v.strip()
-    return {
-        "counts": np.array(counts, dtype=np.float64),
-        "time":   float(meta.get("REAL_TIME", 1.0)),
-    }
-
+def ucitaj_spektre(dataset_label, dataset_dir, n_workers=1):
+    """
+    Ucitava sirove spektre oba detektora: (counts, times).
 
-def ucitaj_spektre(dataset_label, dataset_dir):
-    """Ucitava kompletnu matricu spektara (7200 x n_channels)."""
-    cache_path = os.path.join(IZLAZ, f'spektri_{dataset_label}.npy')
-    if os.path.exists(cache_path):
+    counts: (n_det, 7200, kanala u NMF_KANALI) najmanji uint tip,
+    times: (n_det, 7200). CPS (prosek detektora) se racuna tek pri upotrebi
+    (average_cps).
+    dataset_dir moze biti i zip/tar arhiva kampanje; spektri se citaju
+    direktno iz nje, bez raspakivanja.
+    """
+    cache_name = f'spektri_{dataset_label}.npy'
+    cache_path = os.path.join(IZLAZ, cache_name)
+    manifest = CacheManifest(IZLAZ)
+    sources = ":".join(scan_fingerprint(mca_folder(os.path.join(dataset_dir, det)), TOTAL)
+                       for det in DETEKTORI)
+    fingerprint = {cache_name: manifest.fingerprint(
+        sources, {'detektori': DETEKTORI, 'total': TOTAL, 'storage': 'counts',
+                  'kanali': [NMF_KANALI.start, NMF_KANALI.stop]})}
+    if not manifest.stale(fingerprint):
         print(f"  Ucitavam kesirane spektre: {dataset_label}")
-        return np.load(cache_path)
+        # Vremena akvizicije iz indeksa zaglavlja (bez citanja spektara);
+        # indeks se kesira u IZLAZ, sirovi dataset se ne menja
+        times = np.stack([acquisition_times(build_header_index(dataset_dir, det, ROWS, COLS,
+                                                             cache_dir=IZLAZ))
+                          for det in DETEKTORI])
+        return np.load(cache_path), times
 
     print(f"  Ucitavam {TOTAL} spektara: {dataset_label}...")
-    test_data = parse_mca_file(os.path.join(dataset_dir, DETEKTORI[0], 'None_1.mca'))
-    n_ch = len(test_data['counts'])
-    D = np.zeros((TOTAL, n_ch), dtype=np.float64)
+    # Oba detektora se citaju istovremeno (jedan zajednicki pool)
+    counts, times = load_counts_matrix(dataset_dir, DETEKTORI, TOTAL, n_workers=n_workers,
+                                       channels=NMF_KANALI)
 
-    for det in DETEKTORI:
-        folder = os.path.join(dataset_dir, det)
-        for i in range(1, TOTAL + 1):
-            data = parse_mca_file(os.path.join(folder, f'None_{i}.mca'))
-            D[i - 1] += (data['counts'] / max(data['time'], 0.1)) / len(DETEKTORI)
-            if i % 2000 == 0:
-                print(f"    {det}: {i}/{TOTAL}", flush=True)
-
-    np.save(cache_path, D)
-    return D
+    np.save(cache_path, counts)
+    manifest.record(fingerprint)
+    return counts, times
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  FAZA 1: NMF SLEPA EKSTRAKCIJA PIGMENATA
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def faza1_nmf(D, dataset_label, K_range=range(3, 9)):
+def faza1_nmf(spektri, dataset_label, K_range=range(3, 9)):
     """
     NMF dekompozicija: D ≈ W × H
     Automatski odredjuje optimalni K pomocu elbow metode.
@@ -203,14 +198,16 @@ def faza1_nmf(D, dataset_label, K_range=range(3, 9)):
     print("  FAZA 1: NMF SLEPA EKSTRAKCIJA PIGMENATA")
     print("=" * 70)
 
-    n_ch = D.shape[1]
-    energy = np.arange(n_ch) * _SLOPE + _INTERCEPT
-
-    # Trim na koristan opseg (1-30 keV)
-    ch_lo = max(0, int((1.0 - _INTERCEPT) / _SLOPE))
-    ch_hi = min(n_ch, int((30.0 - _INTERCEPT) / _SLOPE))
-    D_trim = np.maximum(D[:, ch_lo:ch_hi], 0)
-    energy_trim = energy[ch_lo:ch_hi]
+    # Spektri su vec ograniceni na koristan opseg (NMF_KANALI, 1-30 keV)
+    counts, times = spektri
+    if SNIP_SIRINA_KEV:
+        # Kontinuum se kesira uz matricu spektara (ucitaj_spektre)
+        sirina = snip_width(SNIP_SIRINA_KEV, _SLOPE)
+        print(f"  Uklanjam SNIP kontinuum ({sirina} kanala)...")
+        counts = remove_continuum(counts, cached_continuum(
+            counts, sirina, os.path.join(IZLAZ, f'spektri_{dataset_label}.npy')))
+    D_trim = np.maximum(average_cps(counts, times), 0)
+    energy_trim = (NMF_KANALI.start + np.arange(counts.shape[2])) * _SLOPE + _INTERCEPT
 
     # Elbow metoda za optimalni K
     print("  Odredjivanje optimalnog K...")
@@ -839,11 +836,12 @@ if __name__ == '__main__':
     mape_p1 = ucitaj_element_mape('prova1')
     mape_p2 = ucitaj_element_mape('prova2')
 
-    D_p1 = ucitaj_spektre('prova1', 'aurora-antico1-prova1')
-    D_p2 = ucitaj_spektre('prova2', 'aurora-antico1-prova2')
+    n_workers = os.cpu_count() or 1
+    spektri_p1 = ucitaj_spektre('prova1', 'aurora-antico1-prova1', n_workers)
+    spektri_p2 = ucitaj_spektre('prova2', 'aurora-antico1-prova2', n_workers)
 
     # ─── Faza 1: NMF (samo na prova1, prova2 koristi iste komponente) ────────
-    nmf_p1 = faza1_nmf(D_p1, 'prova1')
+    nmf_p1 = faza1_nmf(spektri_p1, 'prova1')
 
     # ─── Faza 2: Vulnerability mapping za oba dataseta ───────────────────────
     vuln_p1 = faza2_vulnerability(mape_p1, 'prova1')
@@ -36,9 +36,12 @@ import json
 import time
 
 from src.config import Config
+from src.data.continuum import cached_continuum, remove_continuum, snip_continuum, snip_width
 from src.data.loader import load_datacube
+from src.data.registration import apply_row_shifts, row_offsets
 from src.models.unet1d import UNet1D
-from src.analysis.cross_validation import datacube_to_element_map
+from src.analysis.integrals import apply_weights, significance
+from src.analysis.lines import compile_lines, element_specs, known_peaks
 
 # ═════════════════════════════════════════════════════════════════════════════
 #  CONFIG
@@ -48,17 +51,17 @@ cfg = Config()
 
 ELEMENTI = list(cfg.elements.keys())  # ['Ca', 'Ti', 'Fe', 'Cu', 'Pb_La']
 
+NMF_RANGE_KEV = (1.0, 14.0)  # Energy range used by NMF (and kept after denoising)
+DETECTION_SIGMA = 3.0        # Net/sigma at which an element counts as fully detected (CVI)
+CVI_SMOOTH_SIGMA = 1.0       # Gaussian smoothing of the risk maps (pixels); hides row zig-zag
+
 RISK_CMAP = LinearSegmentedColormap.from_list('risk', [
     (0.0, '#1a9641'), (0.3, '#a6d96a'), (0.5, '#ffffbf'),
     (0.7, '#fdae61'), (1.0, '#d7191c'),
 ])
 
-POZNATI_PIKOVI = {
-    'K':     3.31, 'Ca':    3.69, 'Ti':    4.51,
-    'Fe Ka': 6.40, 'Fe Kb': 7.06, 'Cu Ka': 8.05,
-    'Zn Ka': 8.64, 'Pb La': 10.55, 'Pb Lb': 12.61,
-    'Sr Ka': 14.16, 'Sn Ka': 25.27,
-}
+POZNATI_PIKOVI = known_peaks(["K", "Ca", "Ti", "Fe", "Fe_Kb", "Cu", "Zn",
+                              "Pb_La", "Pb_Lb", "Sr", "Sn"])
 
 PRAVILA_RIZIKA = [
     {'id': 'R1', 'el_a': 'Ti',    'el_b': 'Ca',    'w': 1.00,
@@ -94,42 +97,58 @@ def norm_percentil(mapa, q_lo=8, q_hi=99):
     return np.clip((mapa - bg) / (peak - bg + 1e-10), 0, 1)
 
 
-def denoise_datacube(model, datacube, global_scale, device, batch_size=256):
+def denoise_datacube(model, datacube, global_scale, device, batch_size=256,
+                     channels=slice(None)):
+    """Denoise full spectra; keep only `channels` of the output."""
     H, W, C = datacube.shape
     flat = datacube.reshape(-1, C)
     N = flat.shape[0]
-    denoised = np.zeros_like(flat)
+    denoised = np.zeros((N, len(range(C)[channels])), dtype=np.float32)
 
     model.eval()
     with torch.no_grad():
         for i in range(0, N, batch_size):
-            batch = flat[i:i+batch_size]
+            # Raw cubes may hold integer counts: convert one batch at a time
+            batch = np.asarray(flat[i:i+batch_size], dtype=np.float32)
             x = torch.from_numpy(batch / global_scale).unsqueeze(1).to(device)
             y = model(x).squeeze(1).cpu().numpy() * global_scale
-            denoised[i:i+batch_size] = np.maximum(y, 0)
-
-    return denoised.reshape(H, W, C)
+            denoised[i:i+batch_size] = np.maximum(y[:, channels], 0)
 
+    return denoised.reshape(H, W, -1)
 
-def extract_element_maps(datacube):
-    """Extract element maps from a datacube using configured elements."""
-    maps = {}
-    for el, info in cfg.elements.items():
-        maps[el] = datacube_to_element_map(
-            datacube, info['kev'], cfg.cal_slope, cfg.cal_intercept
-        )
-    return maps
 
+def extract_element_maps(datacube, channel_offset=0, variance=False, baseline=False):
+    """Extract element maps from a datacube using configured elements.
 
-def run_nmf(spectra_flat, K_range=range(3, 9)):
-    """NMF blind decomposition with elbow method for optimal K."""
-    n_ch = spectra_flat.shape[1]
-    energy = np.arange(n_ch) * cfg.cal_slope + cfg.cal_intercept
-
-    ch_lo = max(0, int((1.0 - cfg.cal_intercept) / cfg.cal_slope))
-    ch_hi = min(n_ch, int((14.0 - cfg.cal_intercept) / cfg.cal_slope))
-    D_trim = np.maximum(spectra_flat[:, ch_lo:ch_hi], 0)
-    energy_trim = energy[ch_lo:ch_hi]
+    The element windows are compiled (src.analysis.lines) into one (C, E)
+    weight matrix, so every map comes from a single matmul. Windows are
+    +-0.3 keV sums as in datacube_to_element_map; an element with 'bg_hw'
+    (every element with baseline=True) gets the linear sideband baseline
+    subtracted. With variance=True the Poisson variance maps come from the
+    same matmul and a (maps, variances) pair of dicts is returned (only
+    meaningful for a cube in counts).
+    """
+    energy = (channel_offset + np.arange(datacube.shape[-1])) * cfg.cal_slope + cfg.cal_intercept
+    elements = cfg.elements
+    if baseline:
+        elements = {el: {'bg_hw': 0.25, **info} for el, info in elements.items()}
+    weights = compile_lines(element_specs(elements), energy, cfg.cal_slope).weights
+    out = apply_weights(datacube, weights, clip=False, variance=variance,
+                        dtype=np.result_type(datacube.dtype, np.float32))
+    if not variance:
+        return {el: out[..., e] for e, el in enumerate(cfg.elements)}
+    maps, var = out
+    return ({el: maps[..., e] for e, el in enumerate(cfg.elements)},
+            {el: var[..., e] for e, el in enumerate(cfg.elements)})
+
+
+def run_nmf(spectra_trim, ch_lo, K_range=range(3, 9)):
+    """NMF blind decomposition with elbow method for optimal K.
+
+    `spectra_trim` holds the NMF_RANGE_KEV channels only, starting at `ch_lo`.
+    """
+    D_trim = np.maximum(spectra_trim, 0)
+    energy_trim = (ch_lo + np.arange(D_trim.shape[1])) * cfg.cal_slope + cfg.cal_intercept
 
     # --- Remove Hg artifact channels ---
     # Mercury (Hg La ~9.99 keV, Hg Lb ~11.82 keV) appears as a rectangular
@@ -192,8 +211,16 @@ def run_nmf(spectra_flat, K_range=range(3, 9)):
     }
 
 
-def compute_cvi(norm_maps):
-    """Compute CVI per pixel from normalized element maps."""
+def compute_cvi(norm_maps, significance_maps=None, smooth_sigma=CVI_SMOOTH_SIGMA):
+    """Compute CVI per pixel from normalized element maps.
+
+    With `significance_maps` ({el: net / sigma} of the raw maps), the risk of
+    every rule is scaled by the detection confidence of its elements,
+    clip(z / DETECTION_SIGMA, 0, 1): pixels where an element is not
+    detected above the Poisson noise cannot raise the CVI. Risk maps are
+    smoothed with a Gaussian of `smooth_sigma` pixels (0: none, for a cube
+    whose row jitter was corrected).
+    """
     cvi = np.zeros((cfg.rows, cfg.cols))
     dominant_risk = np.zeros((cfg.rows, cfg.cols), dtype=int)
     risk_maps = {}
@@ -207,8 +234,13 @@ def compute_cvi(norm_maps):
             risk = w * a
         else:
             risk = w * np.sqrt(a * b)
+        if significance_maps is not None:
+            conf_a = np.clip(significance_maps[pravilo['el_a']] / DETECTION_SIGMA, 0, 1)
+            conf_b = np.clip(significance_maps[pravilo['el_b']] / DETECTION_SIGMA, 0, 1)
+            risk = risk * np.sqrt(conf_a * conf_b)
 
-        risk = gaussian_filter(risk, sigma=1.0)
+        if smooth_sigma > 0:
+            risk = gaussian_filter(risk, sigma=smooth_sigma)
         risk = np.clip(risk, 0, 1)
         risk_maps[pravilo['id']] = risk
 
@@ -860,6 +892,12 @@ if __name__ == '__main__':
                         help='Skip SAM segmentation (if checkpoint missing or slow)')
     parser.add_argument('--dataset', default='prova1',
                         help='Dataset name (default: prova1)')
+    parser.add_argument('--snip', action='store_true',
+                        help='Remove the SNIP continuum before maps and NMF '
+                             '(width: cfg.snip_width_kev)')
+    parser.add_argument('--dejitter', action='store_true',
+                        help='Correct row-to-row lateral scan offsets before all '
+                             'steps (the CVI risk maps are then not smoothed)')
     args = parser.parse_args()
 
     t0 = time.time()
@@ -880,8 +918,17 @@ if __name__ == '__main__':
     cache_dir = cfg.abs_path(cfg.processed_dir)
 
     cube_raw, _ = load_datacube(dataset_path, cfg.detector_a, cfg.rows, cfg.cols,
-                                cache_path=cache_dir / f"{cfg.detector_a}_raw.npy")
+                                cache_path=cache_dir / f"{cfg.detector_a}_raw.npy",
+                                n_workers=cfg.n_workers)
     print(f"  Datacube shape: {cube_raw.shape}")
+    if args.dejitter:
+        # Row offsets (stage backlash, serpentine scan) from all element maps
+        # of the raw counts, then one resampling pass over every channel
+        ref_maps = extract_element_maps(cube_raw)
+        offsets, _ = row_offsets(np.stack([ref_maps[el] for el in ELEMENTI]))
+        cube_raw = apply_row_shifts(cube_raw, offsets)
+        print(f"  Row jitter corrected: max |offset| {np.abs(offsets).max():.2f} px, "
+              f"row-to-row {np.abs(np.diff(offsets)).mean():.2f} px")
 
     # ─── Step 2: Denoise ───────────────────────────────────────────────────
     print("\n[2/7] Denoising datacube with trained UNet1D...")
@@ -902,26 +949,48 @@ if __name__ == '__main__':
                                      weights_only=True))
 
     t_denoise = time.time()
-    cube_denoised = denoise_datacube(model, cube_raw, global_scale, cfg.device)
+    # The model needs full spectra, but only the NMF range is kept afterwards;
+    # every element window lies inside it
+    keep = cfg.channel_range(*NMF_RANGE_KEV)
+    cube_denoised = denoise_datacube(model, cube_raw, global_scale, cfg.device,
+                                     channels=keep)
     t_denoise = time.time() - t_denoise
     print(f"  Denoised in {t_denoise:.1f}s "
           f"({t_denoise/cfg.n_pixels*1000:.2f} ms/spectrum)")
 
     # ─── Step 3: Extract element maps ──────────────────────────────────────
     print("\n[3/7] Extracting element maps...")
+    counts_raw = cube_raw
+    if args.snip:
+        # Continuum of the raw cube is cached next to it (not for a
+        # dejittered cube, which is no longer that cache); maps and NMF
+        # both start from the net spectra
+        width = snip_width(cfg.snip_width_kev, cfg.cal_slope)
+        print(f"  Removing SNIP continuum ({width} channels)...")
+        cube_raw = remove_continuum(cube_raw, cached_continuum(
+            cube_raw, width, None if args.dejitter else cache_dir / f"{cfg.detector_a}_raw.npy"))
+        cube_denoised = remove_continuum(cube_denoised, snip_continuum(cube_denoised, width))
     maps_raw = extract_element_maps(cube_raw)
-    maps_denoised = extract_element_maps(cube_denoised)
+    maps_denoised = extract_element_maps(cube_denoised, channel_offset=keep.start)
     norm_maps = {el: norm_percentil(maps_denoised[el]) for el in ELEMENTI}
+    # Detection significance for the CVI: net signal above the sideband
+    # baseline of the measured counts over its Poisson sigma, maps and
+    # variances from one matmul (denoised spectra have no Poisson variance)
+    net_raw, var_raw = extract_element_maps(counts_raw, variance=True, baseline=True)
+    z_maps = {el: significance(net_raw[el], var_raw[el]) for el in ELEMENTI}
+    detected = ", ".join(f"{el} {np.mean(z_maps[el] > DETECTION_SIGMA):.0%}" for el in ELEMENTI)
+    print(f"  Detected above {DETECTION_SIGMA:g} sigma: {detected}")
     print(f"  Elements: {', '.join(ELEMENTI)}")
 
     # ─── Step 4: NMF ──────────────────────────────────────────────────────
     print("\n[4/7] NMF blind decomposition on denoised spectra...")
     spectra_flat = cube_denoised.reshape(-1, cube_denoised.shape[-1])
-    nmf_res = run_nmf(spectra_flat)
+    nmf_res = run_nmf(spectra_flat, keep.start)
 
     # ─── Step 5: CVI ──────────────────────────────────────────────────────
     print("\n[5/7] Computing Chemical Vulnerability Index...")
-    cvi_data = compute_cvi(norm_maps)
+    cvi_data = compute_cvi(norm_maps, z_maps,
+                           smooth_sigma=0.0 if args.dejitter else CVI_SMOOTH_SIGMA)
 
     # ─── Step 6: SAM (optional) ───────────────────────────────────────────
     segments_data = None
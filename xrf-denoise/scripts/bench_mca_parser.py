@@ -0,0 +1,119 @@
+"""
+Benchmark: block .mca parser vs the original line-by-line parser.
+
+Parses every None_N.mca in a detector folder with both parsers, checks that
+counts and header metadata are identical and reports per-file timings.
+Without --folder, a synthetic folder of Amptek-style files is generated.
+
+Usage:
+    py -3.11 scripts/bench_mca_parser.py [--folder ../aurora-antico1-prova1/10264]
+                                         [--n-files 2000] [--repeat 3]
+"""
+
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import argparse
+import tempfile
+import time
+import numpy as np
+
+from src.data.mca import parse_mca_file, parse_mca_lines
+
+
+def write_synthetic_folder(folder: Path, n_files: int, n_channels: int = 1024,
+                           seed: int = 42) -> list[Path]:
+    """Write n_files Amptek-style .mca files with Poisson counts."""
+    rng = np.random.default_rng(seed)
+    ch = np.arange(n_channels)
+    shape = 40 * np.exp(-ch / 300) + 400 * np.exp(-0.5 * ((ch - 219) / 4) ** 2)
+    paths = []
+    for i in range(1, n_files + 1):
+        counts = rng.poisson(shape)
+        header = (
+            "<<PMCA SPECTRUM>>\n"
+            "TAG - live_data\n"
+            "DESCRIPTION - \n"
+            "GAIN - 2\n"
+            "THRESHOLD - 0\n"
+            "LIVE_MODE - 0\n"
+            "PRESET_TIME - 3\n"
+            f"LIVE_TIME - {2.9 + 0.01 * rng.random():.3f}\n"
+            "REAL_TIME - 3.000\n"
+            f"START_TIME - 01/01/2025 12:{i // 60 % 60:02d}:{i % 60:02d}\n"
+            "SERIAL_NUMBER - 10264\n"
+            "<<DATA>>\n"
+        )
+        body = "\n".join(map(str, counts))
+        footer = "\n<<END>>\n<<DP5 CONFIGURATION>>\nRESC=Y;\n<<DP5 CONFIGURATION END>>\n"
+        path = folder / f"None_{i}.mca"
+        path.write_text(header + body + footer)
+        paths.append(path)
+    return paths
+
+
+def time_parser(parser, paths: list[Path], repeat: int) -> float:
+    """Best-of-`repeat` wall time (seconds) to parse all paths."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for p in paths:
+            parser(p)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--folder', default=None,
+                        help='Detector folder with None_N.mca files')
+    parser.add_argument('--n-files', type=int, default=2000,
+                        help='Number of files to parse (default: 2000)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Timing repetitions, best is reported (default: 3)')
+    args = parser.parse_args()
+
+    tmp = None
+    if args.folder:
+        folder = Path(args.folder)
+        paths = [folder / f"None_{i}.mca" for i in range(1, args.n_files + 1)]
+        paths = [p for p in paths if p.exists()]
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        folder = Path(tmp.name)
+        print(f"Generating {args.n_files} synthetic .mca files...")
+        paths = write_synthetic_folder(folder, args.n_files)
+
+    if not paths:
+        print(f"No None_N.mca files found in {folder}")
+        sys.exit(1)
+
+    # ─── Correctness ─────────────────────────────────────────────────────────
+    mismatches = 0
+    for p in paths:
+        new, old = parse_mca_file(p), parse_mca_lines(p)
+        if (not np.array_equal(new['counts'], old['counts'])
+                or new['meta'] != old['meta'] or new['time'] != old['time']):
+            mismatches += 1
+    print(f"Checked {len(paths)} files: {mismatches} mismatches")
+
+    # ─── Timing ──────────────────────────────────────────────────────────────
+    t_old = time_parser(parse_mca_lines, paths, args.repeat)
+    t_new = time_parser(parse_mca_file, paths, args.repeat)
+    n = len(paths)
+    print(f"  line parser : {t_old:7.3f}s  ({t_old / n * 1e6:7.1f} us/file)")
+    print(f"  block parser: {t_new:7.3f}s  ({t_new / n * 1e6:7.1f} us/file)")
+    print(f"  speedup     : {t_old / t_new:.1f}x")
+    print(f"  projected 7200-file ingest: {t_old / n * 7200:.1f}s -> "
+          f"{t_new / n * 7200:.1f}s")
+
+    if tmp is not None:
+        tmp.cleanup()
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Pack a dataset of None_N.mca files into a single scan container.
+
+The container holds the raw counts of every detector as compact unsigned
+integers plus per-pixel header columns and the energy calibration.
+load_datacube / load_both_detectors accept the container path in place of
+the dataset directory and memory-map it instead of parsing .mca files.
+
+Usage:
+    py -3.11 scripts/pack_scan.py --dataset ../aurora-antico1-prova1
+                                  [--out data/aurora-antico1-prova1.npz]
+                                  [--rows 60] [--cols 120]
+"""
+
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import argparse
+import time
+
+from src.data.container import open_scan, pack_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--dataset', required=True,
+                        help='Dataset directory with detector subfolders')
+    parser.add_argument('--out', default=None,
+                        help='Output container (default: data/<dataset>.npz)')
+    parser.add_argument('--rows', type=int, default=60)
+    parser.add_argument('--cols', type=int, default=120)
+    args = parser.parse_args()
+
+    dataset = Path(args.dataset)
+    out = Path(args.out) if args.out else PROJECT_ROOT / 'data' / f'{dataset.name}.npz'
+
+    print(f"Packing {dataset} -> {out}")
+    t0 = time.perf_counter()
+    pack_dataset(dataset, out, rows=args.rows, cols=args.cols)
+    print(f"  Done in {time.perf_counter() - t0:.1f}s "
+          f"({out.stat().st_size / 1e6:.1f} MB)")
+
+    t0 = time.perf_counter()
+    with open_scan(out) as scan:
+        shapes = {d: scan.counts(d).shape for d in scan.detectors}
+    print(f"  Reopened in {(time.perf_counter() - t0) * 1e3:.1f} ms: {shapes}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Scan QA from .mca headers only: dwell, dead-time, timing-drift and gaps.
+
+Builds (or loads) the header index of each detector — no count data is
+read — and plots REAL_TIME, dead-time fraction, start-time drift and
+missing pixels side by side.
+
+Usage:
+    py -3.11 scripts/scan_qa.py --dataset ../aurora-antico1-prova1
+                                [--detectors 10264 19511] [--rows 60] [--cols 120]
+"""
+
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import argparse
+import time
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from src.data.header_index import (build_header_index, acquisition_times,
+                                   dead_time_map, timing_drift_map, missing_map)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument('--detectors', nargs='+', default=['10264', '19511'])
+    parser.add_argument('--rows', type=int, default=60)
+    parser.add_argument('--cols', type=int, default=120)
+    parser.add_argument('--out', default=None,
+                        help='Output PNG (default: figures/qa_<dataset>.png)')
+    args = parser.parse_args()
+
+    dataset = Path(args.dataset)
+    out = (Path(args.out) if args.out
+           else PROJECT_ROOT / 'figures' / f'qa_{dataset.name}.png')
+    out.parent.mkdir(parents=True, exist_ok=True)
+    r, c = args.rows, args.cols
+
+    fig, axes = plt.subplots(len(args.detectors), 4,
+                             figsize=(20, 3.2 * len(args.detectors)), squeeze=False)
+    for row_axes, det in zip(axes, args.detectors):
+        t0 = time.perf_counter()
+        index = build_header_index(dataset, det, r, c)
+        print(f"  {det}: header index in {time.perf_counter() - t0:.2f}s")
+
+        real = acquisition_times(index).reshape(r, c)
+        dead = dead_time_map(index, r, c)
+        drift = timing_drift_map(index, r, c)
+        gaps = missing_map(index, r, c)
+        print(f"    REAL_TIME {np.nanmin(real):.3f}-{np.nanmax(real):.3f} s, "
+              f"dead time {np.nanmean(dead) * 100:.2f}% mean, "
+              f"|drift| max {np.nanmax(np.abs(drift)) if np.isfinite(drift).any() else np.nan:.1f} s, "
+              f"{int(gaps.sum())} missing")
+
+        panels = [(real, 'REAL_TIME [s]', 'viridis'),
+                  (dead * 100, 'Dead time [%]', 'magma'),
+                  (drift, 'Start-time drift [s]', 'RdBu_r'),
+                  (gaps, 'Missing pixels', 'gray_r')]
+        for ax, (img, title, cmap) in zip(row_axes, panels):
+            im = ax.imshow(img, cmap=cmap)
+            ax.set_title(f"{det}: {title}")
+            ax.axis('off')
+            plt.colorbar(im, ax=ax, fraction=0.025)
+
+    fig.tight_layout()
+    fig.savefig(out, dpi=100)
+    print(f"  Saved {out}")
+
+
+if __name__ == '__main__':
+    main()
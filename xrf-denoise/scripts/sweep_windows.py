@@ -0,0 +1,71 @@
+"""
+Sweep element-window parameters against both detectors in one call.
+
+Loads (or reuses the cached) detector A and B cubes with their prefix-sum
+indexes, evaluates every combination of peak half-width, background
+offset and background width for each configured element, and prints the
+best combinations by cross-detector Pearson r (and mean SNR).
+
+Usage:
+    py -3.11 scripts/sweep_windows.py --dataset ../aurora-antico1-prova1
+                                      [--hw 0.15 0.2 0.3 0.4] [--bg-offset 0.5 0.8 1.2]
+                                      [--bg-width 0.1 0.2 0.3] [--top 3]
+"""
+
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import argparse
+import time
+import numpy as np
+
+from src.config import Config
+from src.data.loader import load_datacubes
+from src.analysis.sweep import sweep_windows
+
+
+def main():
+    cfg = Config()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument('--detectors', nargs=2, default=[cfg.detector_a, cfg.detector_b])
+    parser.add_argument('--rows', type=int, default=cfg.rows)
+    parser.add_argument('--cols', type=int, default=cfg.cols)
+    parser.add_argument('--hw', type=float, nargs='+', default=[0.15, 0.2, 0.25, 0.3, 0.4])
+    parser.add_argument('--bg-offset', type=float, nargs='+', default=[0.5, 0.8, 1.0, 1.2])
+    parser.add_argument('--bg-width', type=float, nargs='+', default=[0.1, 0.2, 0.3])
+    parser.add_argument('--top', type=int, default=3)
+    args = parser.parse_args()
+
+    dataset = Path(args.dataset)
+    cache_dir = cfg.abs_path(cfg.processed_dir)
+    sources = [(dataset, det) for det in args.detectors]
+    cubes, meta = load_datacubes(
+        sources, args.rows, args.cols, n_workers=cfg.n_workers, index=True,
+        cache_paths={key: cache_dir / f"{dataset.name}_{key[1]}_raw.npy" for key in sources})
+
+    grid = {'peak_half_width_kev': args.hw, 'bg_offset_kev': args.bg_offset,
+            'bg_width_kev': args.bg_width}
+    t0 = time.perf_counter()
+    results = sweep_windows(meta[sources[0]]['index'], cfg.elements,
+                            {el: grid for el in cfg.elements},
+                            cfg.cal_slope, cfg.cal_intercept,
+                            data_b=meta[sources[1]]['index'])
+    n = len(args.hw) * len(args.bg_offset) * len(args.bg_width)
+    print(f"  {n} combinations x {len(results)} elements in "
+          f"{time.perf_counter() - t0:.2f}s")
+
+    for el, res in results.items():
+        print(f"\n  {el} ({cfg.elements[el]['kev']} keV)")
+        print(f"    {'hw':>5} {'bg_off':>6} {'bg_w':>5} {'r(A,B)':>7} {'SNR':>7}")
+        for m in np.argsort(-np.nan_to_num(res['pearson_r'], nan=-1))[:args.top]:
+            print(f"    {res['peak_half_width_kev'][m]:5.2f} {res['bg_offset_kev'][m]:6.2f} "
+                  f"{res['bg_width_kev'][m]:5.2f} {res['pearson_r'][m]:7.4f} "
+                  f"{res['mean_snr'][m]:7.2f}")
+
+
+if __name__ == '__main__':
+    main()
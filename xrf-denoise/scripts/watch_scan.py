@@ -0,0 +1,119 @@
+"""
+Live watch mode: build element maps while the scanner is still writing files.
+
+Polls a detector folder for new None_N.mca files, parses each one once and
+updates the element maps and the running sum spectrum. Every --emit-every
+seconds the partial maps are written to --out (PNG + .npy), so Fe/Cu/Pb
+distributions can be followed during a multi-hour scan.
+
+Usage:
+    py -3.11 scripts/watch_scan.py --dataset ../aurora-antico1-prova3
+                                   [--detector 10264] [--interval 2]
+                                   [--emit-every 60] [--elements Fe Cu Pb_La]
+                                   [--timeout 600]
+
+Watching stops once no new file has appeared for --timeout seconds (a
+skipped pixel or an aborted final write would otherwise wait forever);
+the pixels that were never written or left incomplete are then listed.
+"""
+
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import argparse
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from src.config import Config
+from src.data.live import LiveScan
+
+cfg = Config()
+
+
+def save_partial(live: LiveScan, keys: list[str], out_dir: Path):
+    """Write the current maps of `keys` and the sum spectrum to out_dir."""
+    fig, axes = plt.subplots(1, len(keys) + 1, figsize=(5 * (len(keys) + 1), 3.5))
+    for ax, key in zip(axes, keys):
+        m = live.element_map(key)
+        np.save(out_dir / f'live_{key}.npy', m)
+        finite = m[np.isfinite(m)]
+        vmax = np.percentile(finite, 99) if finite.size else 1.0
+        ax.imshow(m, cmap='inferno', vmin=0, vmax=vmax)
+        ax.set_title(f"{cfg.elements[key]['name']}")
+        ax.axis('off')
+
+    ax = axes[-1]
+    if live.sum_spectrum is not None:
+        np.save(out_dir / 'live_sum_spectrum.npy', live.sum_spectrum)
+        energy = np.arange(len(live.sum_spectrum)) * cfg.cal_slope + cfg.cal_intercept
+        ax.semilogy(energy, np.maximum(live.sum_spectrum, 1))
+        ax.set_xlim(1, 20)
+        ax.set_xlabel('keV')
+    ax.set_title('Sum spectrum')
+
+    total = live.rows * live.cols
+    fig.suptitle(f"{live.folder}  —  {live.n_acquired}/{total} pixels "
+                 f"({100 * live.n_acquired / total:.1f}%)")
+    fig.tight_layout()
+    fig.savefig(out_dir / 'live_maps.png', dpi=100)
+    plt.close(fig)
+    print(f"  [{live.n_acquired}/{total}] partial maps -> {out_dir}", flush=True)
+
+
+def format_pixels(indices, limit: int = 20) -> str:
+    """'None_3, None_17, ...' for the first `limit` 1-based pixel indices."""
+    shown = ", ".join(f"None_{i}" for i in indices[:limit])
+    return shown + (f", ... ({len(indices)} total)" if len(indices) > limit else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--dataset', required=True,
+                        help='Dataset directory the scanner writes into')
+    parser.add_argument('--detector', default=cfg.detector_a)
+    parser.add_argument('--rows', type=int, default=cfg.rows)
+    parser.add_argument('--cols', type=int, default=cfg.cols)
+    parser.add_argument('--elements', nargs='+', default=['Fe', 'Cu', 'Pb_La'],
+                        help='Elements from Config.elements to display')
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help='Seconds between folder polls (default: 2)')
+    parser.add_argument('--emit-every', type=float, default=60.0,
+                        help='Seconds between partial map outputs (default: 60)')
+    parser.add_argument('--timeout', type=float, default=600.0,
+                        help='Stop after this many seconds without a new file '
+                             '(default: 600; 0 waits indefinitely)')
+    parser.add_argument('--out', default=None,
+                        help='Output directory (default: figures/live/<dataset>)')
+    args = parser.parse_args()
+
+    folder = Path(args.dataset) / args.detector
+    out_dir = (Path(args.out) if args.out
+               else cfg.abs_path(cfg.figures_dir) / 'live' / Path(args.dataset).name)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    live = LiveScan(folder, args.rows, args.cols, cfg.elements,
+                    cfg.cal_slope, cfg.cal_intercept, n_channels=cfg.n_channels)
+    print(f"Watching {folder} ({args.rows}x{args.cols}), "
+          f"maps every {args.emit_every:.0f}s -> {out_dir}")
+    live.watch(interval=args.interval, emit_every=args.emit_every,
+               on_update=lambda s: save_partial(s, args.elements, out_dir),
+               timeout=args.timeout or None)
+    if live.complete:
+        print("Scan complete.")
+        return
+    print(f"Stopped after {args.timeout:.0f}s without a new file: "
+          f"{live.n_acquired}/{live.rows * live.cols} pixels acquired.")
+    incomplete, missing = sorted(live.incomplete), live.missing()
+    if incomplete:
+        print(f"  Incomplete (no <<END>>): {format_pixels(incomplete)}")
+    if missing:
+        print(f"  Never written: {format_pixels(missing)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@
 import numpy as np
 from scipy.stats import pearsonr
 
+from ..data.spectral_index import window_integral
+
 
 def datacube_to_element_map(
     datacube: np.ndarray,
@@ -10,14 +12,20 @@ def datacube_to_element_map(
     cal_slope: float,
     cal_intercept: float,
     half_width_kev: float = 0.3,
+    channel_offset: int = 0,
 ) -> np.ndarray:
-    """Extract elemental map by integrating around emission line."""
+    """Extract elemental map by integrating around emission line.
+
+    `datacube` may also be a SpectralIndex of the cube (two plane reads
+    instead of a window sum). `channel_offset` is the absolute index of the
+    cube's first channel, for cubes loaded with a restricted channel range.
+    """
     C = datacube.shape[-1]
-    ch_center = int(round((kev_center - cal_intercept) / cal_slope))
+    ch_center = int(round((kev_center - cal_intercept) / cal_slope)) - channel_offset
     half_ch = max(1, int(round(half_width_kev / cal_slope)))
     lo = max(0, ch_center - half_ch)
     hi = min(C, ch_center + half_ch + 1)
-    return datacube[..., lo:hi].sum(axis=-1)
+    return window_integral(datacube, lo, hi)
 
 
 def cross_detector_validation(
@@ -37,12 +45,18 @@ def cross_detector_validation(
       - If true, denoising extracted real signal, not noise artifacts.
       - r(denoised_A, denoised_B) serves as negative control:
         if it drops below r(denoised_A, raw_B), the model may be over-smoothing.
+      - chi2_raw_A_vs_B: reduced chi-square of raw A against raw B scaled to
+        A's total counts, with the Poisson variance of both window sums
+        (a raw window sum is its own variance). ~1 when the detectors differ
+        only by counting noise; the excess is real detector disagreement
+        the correlations cannot separate from noise.
 
     Parameters
     ----------
     denoised_a : np.ndarray, shape (H, W, C) — denoised detector A
     raw_a : np.ndarray — raw detector A
     raw_b : np.ndarray — raw detector B (independent witness)
+        Each cube may be passed as its SpectralIndex instead.
     elements : dict — {name: {'kev': float}}
     cal_slope, cal_intercept : float
     denoised_b : np.ndarray or None — denoised detector B (for negative control)
@@ -63,10 +77,15 @@ def cross_detector_validation(
         r_denoised, _ = pearsonr(map_denoised_a.ravel(), map_raw_b.ravel())
         improvement = r_denoised - r_raw
 
+        scale = map_raw_a.sum() / max(map_raw_b.sum(), 1)
+        chi2 = np.mean((map_raw_a - scale * map_raw_b) ** 2
+                       / np.maximum(map_raw_a + scale ** 2 * map_raw_b, 1))
+
         entry = {
             'r_raw_vs_B': float(r_raw),
             'r_denoised_vs_B': float(r_denoised),
             'improvement': float(improvement),
+            'chi2_raw_A_vs_B': float(chi2),
         }
 
         if denoised_b is not None:
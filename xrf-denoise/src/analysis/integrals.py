@@ -0,0 +1,227 @@
+"""Batched background-subtracted peak integrals for whole scans.
+
+Vectorized form of the per-pixel bg_subtracted_integral / k_signal helpers
+of the analysis scripts. The peak window and sideband baseline of every
+line are compiled once into a column of channel weights (LineSpec /
+compile_lines in src.analysis.lines; window_column, k_column for single
+lines); stacked into a (C, E) matrix they give the net maps of all
+pixels and lines from a single matmul (apply_weights). dynamic_peak_areas
+does the same for the monotone-flank window of get_dynamic_area
+(pomocne_metode_analiza).
+Results equal the scalar code up to float rounding.
+
+Net maps are linear in the counts, so their Poisson variance follows in
+the same matmul: var(spectrum @ w) = counts @ w**2 (apply_weights with
+variance=True); significance turns a map and its variance into a z map.
+"""
+
+import numpy as np
+
+from .lines import LineSpec, compile_lines, nearest_channel
+
+
+def window_column(
+    energy: np.ndarray,
+    target_kev: float,
+    slope: float,
+    hw: float = 0.30,
+    bg_hw: float | None = 0.25,
+) -> np.ndarray:
+    """
+    Channel weights (C,) of one peak window: spectrum @ w is its net integral.
+
+    +1 on the peak channels; with `bg_hw`, the linear baseline over the
+    adjacent sidebands is folded in (see compile_lines). With bg_hw=None
+    the column is a plain window sum.
+    """
+    spec = LineSpec(target_kev, hw=hw, bg_hw=bg_hw or 0.25,
+                    baseline="none" if bg_hw is None else "linear")
+    return compile_lines({"line": spec}, energy, slope).weights[:, 0]
+
+
+def k_column(
+    energy: np.ndarray,
+    peak_kev: float = 3.3138,
+    left_kev: tuple[float, float] = (3.23, 3.28),
+    right_kev: tuple[float, float] = (3.35, 3.42),
+    half_ch: int = 2,
+) -> np.ndarray:
+    """
+    Channel weights (C,) of the K Kα net signal with tight sidebands in the
+    valleys next to Ar Kα and Ca Kα (see k_signals and LINES['K']).
+    """
+    slope = float(energy[1] - energy[0])
+    spec = LineSpec(peak_kev, hw=half_ch * slope, sidebands=(left_kev, right_kev))
+    return compile_lines({"K": spec}, energy, slope).weights[:, 0]
+
+
+def apply_weights(
+    spectra: np.ndarray,
+    weights: np.ndarray,
+    clip: bool = True,
+    dtype: np.dtype = np.float64,
+    variance: bool = False,
+) -> np.ndarray | tuple[np.ndarray, np.ndarray]:
+    """
+    All net maps of a cube from one matmul with a (C, E) weight matrix.
+
+    Only the channel span where some weight is non-zero is converted and
+    multiplied, so adding lines costs almost nothing.
+
+    Parameters
+    ----------
+    spectra : np.ndarray, shape (..., C)
+    weights : np.ndarray, shape (C, E)
+        Columns from window_column / k_column, e.g. np.stack(cols, axis=1).
+    clip : bool
+        Clip negative net values to 0.
+    dtype : np.dtype
+        Compute dtype.
+    variance : bool
+        Also return the Poisson variance of every net value, counts @ w**2
+        (the squared weights ride along as extra columns of the matmul).
+        Only meaningful for spectra in counts.
+
+    Returns
+    -------
+    np.ndarray, shape (..., E)
+        Net maps; with variance=True a (maps, variances) tuple. Variances
+        are of the unclipped net values.
+    """
+    used = np.flatnonzero(np.any(weights != 0, axis=1))
+    lo, hi = (used[0], used[-1] + 1) if used.size else (0, 0)
+    n_e = weights.shape[1]
+    w = weights[lo:hi].astype(dtype)
+    if variance:
+        w = np.concatenate([w, w * w], axis=1)
+    flat = spectra.reshape(-1, spectra.shape[-1])
+    out = flat[:, lo:hi].astype(dtype) @ w
+    maps = out[:, :n_e]
+    if clip:
+        np.maximum(maps, 0, out=maps)
+    maps = maps.reshape(*spectra.shape[:-1], n_e)
+    if not variance:
+        return maps
+    return maps, np.maximum(out[:, n_e:], 0).reshape(*spectra.shape[:-1], n_e)
+
+
+def significance(maps: np.ndarray, variances: np.ndarray) -> np.ndarray:
+    """Net value in units of its Poisson sigma, net / sqrt(max(var, 1))."""
+    return maps / np.sqrt(np.maximum(variances, 1))
+
+
+def bg_subtracted_integrals(
+    spectra: np.ndarray,
+    energy: np.ndarray,
+    slope: float,
+    windows: list[tuple[float, float, float]],
+) -> np.ndarray:
+    """
+    Net peak integrals above a linear sideband baseline, for all pixels.
+
+    The baseline runs from the mean of the left sideband to the mean of
+    the right one across the peak window (an empty sideband falls back to
+    the edge channel of the peak); negative results are clipped to 0.
+
+    Parameters
+    ----------
+    spectra : np.ndarray, shape (..., C)
+        Spectra, e.g. an (N, C) matrix or an (H, W, C) cube.
+    energy : np.ndarray, shape (C,)
+        Channel energies in keV.
+    slope : float
+        Calibration slope (keV per channel), converts widths to channels.
+    windows : list of (target_kev, hw, bg_hw)
+        Peak centre, peak half-width and sideband width per element, keV.
+
+    Returns
+    -------
+    np.ndarray, shape (..., len(windows)), float64
+    """
+    weights = np.stack([window_column(energy, kev, slope, hw, bg_hw)
+                        for kev, hw, bg_hw in windows], axis=1)
+    return apply_weights(spectra, weights)
+
+
+def k_signals(
+    spectra: np.ndarray,
+    energy: np.ndarray,
+    peak_kev: float = 3.3138,
+    left_kev: tuple[float, float] = (3.23, 3.28),
+    right_kev: tuple[float, float] = (3.35, 3.42),
+    half_ch: int = 2,
+) -> np.ndarray:
+    """
+    K Kα net signal with tight sidebands in the valleys next to Ar Kα and
+    Ca Kα (batched k_signal).
+
+    Peak: ±half_ch channels around peak_kev; background per channel is the
+    mean of the two sideband means (inclusive channel ranges).
+
+    Returns
+    -------
+    np.ndarray, shape (...), float64
+    """
+    weights = k_column(energy, peak_kev, left_kev, right_kev, half_ch)[:, None]
+    return apply_weights(spectra, weights)[..., 0]
+
+
+def _leading_run(mask: np.ndarray) -> np.ndarray:
+    """Length of the leading run of True in every row of `mask` (N, K)."""
+    if mask.shape[1] == 0:
+        return np.zeros(mask.shape[0], dtype=int)
+    return np.where(mask.all(axis=1), mask.shape[1], mask.argmin(axis=1))
+
+
+def dynamic_peak_areas(
+    spectra: np.ndarray,
+    energy: np.ndarray,
+    target_kev: float,
+    max_kev: float = 1.0,
+) -> np.ndarray:
+    """
+    Area of the peak nearest `target_kev`, integrated over its own
+    monotone flanks (batched get_dynamic_area).
+
+    From the peak channel the window extends left and right while the
+    spectrum keeps strictly descending, taking at most the step that first
+    goes more than `max_kev` away from the peak; the area is the trapezoid
+    integral over the window. Boundaries of all spectra come from the sign
+    runs of np.diff next to the peak, the ragged windows are integrated as
+    masked sums of trapezoid segments.
+
+    Parameters
+    ----------
+    spectra : np.ndarray, shape (..., C)
+    energy : np.ndarray, shape (C,)
+    target_kev : float
+    max_kev : float
+        Distance from the peak channel beyond which no further step is taken.
+
+    Returns
+    -------
+    np.ndarray, shape (...), float64
+    """
+    flat = spectra.reshape(-1, spectra.shape[-1])
+    n_ch = flat.shape[1]
+    idx = nearest_channel(energy, target_kev)
+
+    # Steps allowed per side: up to and including the first one beyond max_kev
+    beyond_l = np.flatnonzero(energy[idx] - energy[idx::-1] > max_kev)
+    beyond_r = np.flatnonzero(energy[idx:] - energy[idx] > max_kev)
+    k_l = min(idx, beyond_l[0] if beyond_l.size else idx)
+    k_r = min(n_ch - 1 - idx, beyond_r[0] if beyond_r.size else n_ch - 1 - idx)
+
+    lo, hi = idx - k_l, idx + k_r
+    seg = flat[:, lo:hi + 1].astype(np.float64)
+    # falling[:, s]: channel idx-s-1 < idx-s (left), idx+s+1 < idx+s (right)
+    falling_l = (np.diff(seg[:, :k_l + 1], axis=1) > 0)[:, ::-1]
+    falling_r = np.diff(seg[:, k_l:], axis=1) < 0
+    left = k_l - _leading_run(falling_l)  # window bounds within seg
+    right = k_l + _leading_run(falling_r)
+
+    x = energy[lo:hi + 1]
+    trap = np.diff(x) * (seg[:, 1:] + seg[:, :-1]) / 2.0
+    j = np.arange(trap.shape[1])
+    inside = (j >= left[:, None]) & (j < right[:, None])
+    return np.where(inside, trap, 0.0).sum(axis=1).reshape(spectra.shape[:-1])
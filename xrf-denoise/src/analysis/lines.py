@@ -0,0 +1,192 @@
+"""Declarative line-window specs, compiled per calibration.
+
+A LineSpec describes how one line is read from a spectrum: the peak
+window, the sidebands that define its baseline (adjacent bands of width
+bg_hw, or explicit keV ranges placed in clean valleys), the baseline model
+and the line families (src.analysis.linefit) that overlap the window.
+LINES is the shared catalogue the analysis scripts and Config take their
+energies, names and colours from.
+
+compile_lines turns a set of specs into a LineKernel for one energy axis:
+channel bounds of every peak and sideband as index arrays, plus the (C, E)
+weight matrix that apply_weights multiplies all spectra with. Adding a
+line means adding a spec, not another extraction function.
+"""
+
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class LineSpec:
+    """
+    One emission line window.
+
+    Attributes
+    ----------
+    kev : float
+        Line energy (peak centre), keV.
+    name : str
+        Display name, e.g. 'Fe Kα'.
+    hw : float
+        Peak half-width, keV.
+    bg_hw : float
+        Width of the adjacent sidebands, keV (ignored with `sidebands`).
+    sidebands : ((lo, hi), (lo, hi)) or None
+        Explicit left/right sideband ranges in keV (inclusive nearest
+        channels), for lines squeezed between neighbours (K Kα between Ar
+        and Ca).
+    baseline : str
+        'linear': subtract the straight line from the mean of the left
+        sideband to the mean of the right one; 'none': plain window sum.
+    overlaps : tuple of str
+        linefit families whose lines fall in the window; such a window is
+        better read from a fit than from the window sum.
+    color : str
+        Map / annotation colour.
+    """
+    kev: float
+    name: str = ""
+    hw: float = 0.30
+    bg_hw: float = 0.25
+    sidebands: tuple | None = None
+    baseline: str = "linear"
+    overlaps: tuple = ()
+    color: str = "#FFFFFF"
+
+
+LINES = {
+    "S":     LineSpec(2.31,   "S Kα",  hw=0.20, overlaps=("PbM",), color="#FFFF66"),
+    "Ar":    LineSpec(2.957,  "Ar Kα", color="#888888"),
+    # K Kα sits between Ar Kα and Ca Kα: tight sidebands in the clean valleys
+    "K":     LineSpec(3.3138, "K Kα",  hw=0.06, sidebands=((3.23, 3.28), (3.35, 3.42)),
+                      overlaps=("Ar", "Ca"), color="#FFD700"),
+    "Ca":    LineSpec(3.69,   "Ca Kα", color="#FFFFFF"),
+    "Ti":    LineSpec(4.51,   "Ti Kα", color="#FF9966"),
+    "Cr":    LineSpec(5.415,  "Cr Kα", color="#00DD55"),
+    "Fe":    LineSpec(6.40,   "Fe Kα", color="#FF2200"),
+    "Fe_Kb": LineSpec(7.06,   "Fe Kβ", color="#CC2200"),
+    "Cu":    LineSpec(8.05,   "Cu Kα", color="#00FFAA"),
+    # hw 0.20: with 0.25 the right sideband would reach Cu Kβ (8.903 keV)
+    "Zn":    LineSpec(8.64,   "Zn Kα", hw=0.20, overlaps=("Cu",), color="#66CCFF"),
+    "Pb_Ll": LineSpec(9.185,  "Pb Ll", hw=0.28, color="#BB88FF"),
+    "Pb_La": LineSpec(10.55,  "Pb Lα", overlaps=("As",), color="#FF8800"),
+    "Pb_Lb": LineSpec(12.61,  "Pb Lβ", color="#CC66FF"),
+    "Pb_Lg": LineSpec(14.77,  "Pb Lγ", hw=0.35, color="#9933AA"),
+    "Sr":    LineSpec(14.16,  "Sr Kα", color="#66FF66"),
+    "Sn":    LineSpec(25.27,  "Sn Kα", color="#6699FF"),
+}
+
+
+def known_peaks(keys) -> dict:
+    """{name: keV} of catalogue lines, for spectrum annotation and peak naming."""
+    return {LINES[k].name: LINES[k].kev for k in keys}
+
+
+def element_specs(elements: dict) -> dict:
+    """
+    LineSpecs for a Config.elements-style dict {name: {'kev': ...}}: plain
+    window sums of ±hw (default 0.3 keV), with the linear sideband baseline
+    only for entries that give 'bg_hw'.
+    """
+    return {el: LineSpec(info['kev'], info.get('name', el), hw=info.get('hw', 0.30),
+                         bg_hw=info.get('bg_hw') or 0.25,
+                         baseline="linear" if info.get('bg_hw') else "none")
+            for el, info in elements.items()}
+
+
+def nearest_channel(energy: np.ndarray, kev: float) -> int:
+    """Channel whose energy is closest to `kev` (argmin |energy - kev|)."""
+    return int(np.argmin(np.abs(energy - kev)))
+
+
+def peak_window(
+    energy: np.ndarray,
+    target_kev: float,
+    slope: float,
+    hw: float = 0.30,
+    bg_hw: float = 0.25,
+) -> tuple[int, int, int, int]:
+    """
+    Channel bounds of a peak and its two adjacent sidebands.
+
+    Returns (lo, hi, bg_l, bg_r): peak channels lo..hi (inclusive), left
+    sideband [bg_l, lo), right sideband [hi + 1, bg_r). The right sideband
+    stops one channel short of the spectrum end.
+    """
+    n_ch = len(energy)
+    idx = nearest_channel(energy, target_kev)
+    half_ch = max(1, int(round(hw / slope)))
+    bg_ch = max(1, int(round(bg_hw / slope)))
+    lo = max(0, idx - half_ch)
+    hi = min(n_ch - 1, idx + half_ch)
+    return lo, hi, max(0, lo - bg_ch), min(n_ch - 1, hi + 1 + bg_ch)
+
+
+@dataclass
+class LineKernel:
+    """
+    Line specs compiled for one energy axis.
+
+    peak, left, right are (E, 2) arrays of channel bounds [lo, hi); an
+    empty sideband (lo == hi) falls back to the edge channel of the peak.
+    weights is the (C, E) matrix: spectra @ weights gives every net signal.
+    """
+    keys: list
+    peak: np.ndarray
+    left: np.ndarray
+    right: np.ndarray
+    baseline: np.ndarray
+    weights: np.ndarray = field(repr=False)
+
+    def column(self, key: str) -> np.ndarray:
+        return self.weights[:, self.keys.index(key)]
+
+
+def compile_lines(specs: dict, energy: np.ndarray, slope: float) -> LineKernel:
+    """
+    Compile {key: LineSpec} for channel energies `energy` (keV) and
+    calibration slope `slope` (keV per channel).
+
+    Peak: nearest channel ±round(hw / slope) (at least 1). Linear baseline:
+    -n/2 spread evenly over each sideband (n = peak width in channels),
+    since the sum of a straight line from mean(left) to mean(right) over
+    the peak is n * (left + right) / 2.
+    """
+    n_ch = len(energy)
+    keys = list(specs)
+    peak = np.zeros((len(keys), 2), dtype=int)
+    left = np.zeros((len(keys), 2), dtype=int)
+    right = np.zeros((len(keys), 2), dtype=int)
+    baseline = np.array([specs[k].baseline == "linear" for k in keys])
+    for e, key in enumerate(keys):
+        spec = specs[key]
+        lo, hi, bg_l, bg_r = peak_window(energy, spec.kev, slope, spec.hw, spec.bg_hw)
+        peak[e] = lo, hi + 1
+        if not baseline[e]:
+            left[e], right[e] = (lo, lo), (hi + 1, hi + 1)
+        elif spec.sidebands is not None:
+            (ll, lr), (rl, rr) = ((nearest_channel(energy, a), nearest_channel(energy, b))
+                                  for a, b in spec.sidebands)
+            left[e] = (ll, lr + 1) if lr >= ll else (lo, lo)
+            right[e] = (rl, rr + 1) if rr >= rl else (hi + 1, hi + 1)
+        else:
+            left[e], right[e] = (bg_l, lo), (hi + 1, bg_r)
+
+    weights = np.zeros((n_ch, len(keys)))
+    for e in range(len(keys)):
+        (lo, hi), (ll, lr), (rl, rr) = peak[e], left[e], right[e]
+        weights[lo:hi, e] += 1.0
+        if not baseline[e]:
+            continue
+        n = hi - lo
+        if lr > ll:
+            weights[ll:lr, e] -= n / 2.0 / (lr - ll)
+        else:
+            weights[lo, e] -= n / 2.0
+        if rr > rl:
+            weights[rl:rr, e] -= n / 2.0 / (rr - rl)
+        else:
+            weights[hi - 1, e] -= n / 2.0
+    return LineKernel(keys, peak, left, right, baseline, weights)
@@ -2,6 +2,7 @@
 
 import numpy as np
 from ..config import Config
+from ..data.spectral_index import window_integral
 
 
 def compute_element_snr(
@@ -20,7 +21,7 @@ def compute_element_snr(
 
     Parameters
     ----------
-    datacube : np.ndarray, shape (H, W, C) or (N, C)
+    datacube : np.ndarray, shape (H, W, C) or (N, C), or its SpectralIndex
     element_kev : float
         Center energy of emission line in keV.
     peak_half_width_kev, bg_offset_kev, bg_width_kev : float
@@ -32,7 +33,6 @@ def compute_element_snr(
     """
     original_shape = datacube.shape[:-1]
     C = datacube.shape[-1]
-    flat = datacube.reshape(-1, C)
 
     def kev_to_ch(kev):
         return int(round((kev - cal_intercept) / cal_slope))
@@ -52,9 +52,9 @@ def compute_element_snr(
     bg_lo_r = min(C, pk_center + bg_offset - bg_half)
     bg_hi_r = min(C, pk_center + bg_offset + bg_half + 1)
 
-    peak_integral = flat[:, pk_lo:pk_hi].sum(axis=1)
-    bg_left = flat[:, bg_lo_l:bg_hi_l].sum(axis=1)
-    bg_right = flat[:, bg_lo_r:bg_hi_r].sum(axis=1)
+    peak_integral = window_integral(datacube, pk_lo, pk_hi)
+    bg_left = window_integral(datacube, bg_lo_l, bg_hi_l)
+    bg_right = window_integral(datacube, bg_lo_r, bg_hi_r)
 
     # Scale background to match peak window width
     bg_width_channels = (bg_hi_l - bg_lo_l) + (bg_hi_r - bg_lo_r)
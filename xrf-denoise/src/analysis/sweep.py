@@ -0,0 +1,154 @@
+"""Window-parameter sweeps for element maps.
+
+Every combination of peak half-width, background offset and background
+width of an element is evaluated in one pass over the cube's SpectralIndex:
+the channel bounds of all combinations become index arrays, and the three
+window sums per combination (peak, left and right sideband) are gathered
+from the prefix-sum planes at once. Map quality is then scored per
+combination: mean SNR as in compute_element_snr and, with a second
+detector, the cross-detector Pearson r of the net maps.
+"""
+
+import itertools
+
+import numpy as np
+
+from ..data.spectral_index import SpectralIndex
+
+
+def _as_index(data) -> SpectralIndex:
+    return data if isinstance(data, SpectralIndex) else SpectralIndex.from_cube(data)
+
+
+def _window_sums(index: SpectralIndex, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Sums over channels [lo[m], hi[m]) of every pixel, shape (M, N), float64;
+    bounds must already lie within the cube."""
+    planes = index.planes.reshape(index.n_channels + 1, -1)
+    return planes[hi].astype(np.float64) - planes[lo]
+
+
+def _row_pearson(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pearson r of every row pair of a and b (M, N); NaN for constant rows."""
+    a = a - a.mean(axis=1, keepdims=True)
+    b = b - b.mean(axis=1, keepdims=True)
+    denom = np.sqrt((a * a).sum(axis=1) * (b * b).sum(axis=1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (a * b).sum(axis=1) / denom
+
+
+def sweep_element_windows(
+    data_a,
+    element_kev: float,
+    cal_slope: float,
+    cal_intercept: float,
+    peak_half_width_kev=(0.3,),
+    bg_offset_kev=(0.8,),
+    bg_width_kev=(0.3,),
+    data_b=None,
+) -> dict:
+    """
+    Score every combination of window parameters for one element.
+
+    The window geometry is that of compute_element_snr: a peak window of
+    ±peak_half_width_kev and two sidebands of ±bg_width_kev centred
+    bg_offset_kev left and right of the line; the background is the
+    sideband mean scaled to the peak width.
+
+    Parameters
+    ----------
+    data_a : np.ndarray (..., C) or SpectralIndex
+        Detector A cube (an index is built once if a cube is given).
+    element_kev, cal_slope, cal_intercept : float
+    peak_half_width_kev, bg_offset_kev, bg_width_kev : sequence of float
+        Values to sweep; the full grid of combinations is evaluated.
+    data_b : np.ndarray or SpectralIndex, optional
+        Detector B (independent witness) for the cross-detector Pearson r.
+
+    Returns
+    -------
+    dict of np.ndarray, one entry per combination (M,):
+        'peak_half_width_kev', 'bg_offset_kev', 'bg_width_kev',
+        'mean_snr', and 'pearson_r' if data_b is given.
+    """
+    grid = np.array(list(itertools.product(peak_half_width_kev, bg_offset_kev, bg_width_kev)),
+                    dtype=np.float64)
+    hw, off, bgw = grid.T
+    centre = int(round((element_kev - cal_intercept) / cal_slope))
+    pk_half = np.maximum(1, np.round(hw / cal_slope).astype(int))
+    bg_half = np.maximum(1, np.round(bgw / cal_slope).astype(int))
+    bg_off = np.round(off / cal_slope).astype(int)
+    bounds = {
+        'peak': (centre - pk_half, centre + pk_half + 1),
+        'left': (centre - bg_off - bg_half, centre - bg_off + bg_half + 1),
+        'right': (centre + bg_off - bg_half, centre + bg_off + bg_half + 1),
+    }
+
+    def net_and_snr(index):
+        n_ch = index.n_channels
+        sums, widths = {}, {}
+        for name, (lo, hi) in bounds.items():
+            lo = np.clip(lo, 0, n_ch)
+            hi = np.clip(np.maximum(hi, lo), 0, n_ch)
+            sums[name] = _window_sums(index, lo, hi)
+            widths[name] = hi - lo
+        bg = (sums['left'] + sums['right']) * (
+            widths['peak'] / np.maximum(widths['left'] + widths['right'], 1))[:, None]
+        net = sums['peak'] - bg
+        return net, net / np.sqrt(np.maximum(sums['peak'], 1))
+
+    net_a, snr_a = net_and_snr(_as_index(data_a))
+    result = {
+        'peak_half_width_kev': hw,
+        'bg_offset_kev': off,
+        'bg_width_kev': bgw,
+        'mean_snr': snr_a.mean(axis=1),
+    }
+    if data_b is not None:
+        net_b, _ = net_and_snr(_as_index(data_b))
+        result['pearson_r'] = _row_pearson(net_a, net_b)
+    return result
+
+
+def sweep_windows(
+    data_a,
+    elements: dict,
+    grids: dict,
+    cal_slope: float,
+    cal_intercept: float,
+    data_b=None,
+) -> dict:
+    """
+    Window-parameter sweep for several elements on the same cubes.
+
+    The SpectralIndex of each cube is built once and shared by all
+    elements.
+
+    Parameters
+    ----------
+    data_a, data_b : np.ndarray or SpectralIndex
+        See sweep_element_windows.
+    elements : dict
+        {name: {'kev': float}}, e.g. Config.elements.
+    grids : dict
+        {name: {'peak_half_width_kev': [...], 'bg_offset_kev': [...],
+        'bg_width_kev': [...]}}; missing keys (or elements) use the
+        compute_element_snr defaults.
+
+    Returns
+    -------
+    dict of name -> result of sweep_element_windows
+    """
+    index_a = _as_index(data_a)
+    index_b = None if data_b is None else _as_index(data_b)
+    return {el: sweep_element_windows(index_a, info['kev'], cal_slope, cal_intercept,
+                                      data_b=index_b, **grids.get(el, {}))
+            for el, info in elements.items()}
+
+
+def best_windows(results: dict, metric: str = 'pearson_r') -> dict:
+    """Best combination per element by `metric`: {name: {param: value, ..., metric: value}}."""
+    best = {}
+    for el, res in results.items():
+        m = int(np.nanargmax(res[metric]))
+        best[el] = {k: float(v[m]) for k, v in res.items()}
+    return best
@@ -0,0 +1,154 @@
+"""Linear unmixing of overlapping line windows.
+
+A window map of a line that shares channels with another element's line
+(Cu Kβ in the Zn Kα window, Pb Mα in the S Kα window, Pb Lα in the As Kα
+window) is corrected by subtracting a ratio times a clean window map of the
+interfering element. Every such correction is an off-diagonal entry of an
+(E, E) matrix, so all corrections of an element stack are one matmul.
+
+The ratios are estimated per scan with the Theil-Sen estimator (median of
+pairwise slopes): pixels that do contain the target element are outliers
+above the contamination line and do not pull the ratio, unlike a
+least-squares regression. All scans and overlaps are estimated together,
+one batched pass over sampled pixel pairs.
+"""
+
+import numpy as np
+
+
+def theil_sen(
+    x: np.ndarray,
+    y: np.ndarray,
+    mask: np.ndarray | None = None,
+    n_pairs: int = 20000,
+    seed: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Theil-Sen line y = slope * x + intercept for every row of a batch.
+
+    Parameters
+    ----------
+    x, y : np.ndarray, shape (..., N)
+        Samples, one regression per leading index.
+    mask : np.ndarray of bool, shape (..., N), optional
+        Samples to use per row (all by default).
+    n_pairs : int
+        Pixel pairs per row. With fewer than n_pairs distinct pairs all of
+        them are used, otherwise n_pairs random pairs of the row's masked
+        samples (the estimate is then a close random approximation).
+    seed : int
+        Seed of the pair sampling.
+
+    Returns
+    -------
+    slope, intercept : np.ndarray, shape (...)
+        Median pairwise slope and median residual intercept; NaN for rows
+        with fewer than two usable samples.
+    """
+    shape = x.shape[:-1]
+    n = x.shape[-1]
+    x = x.reshape(-1, n).astype(np.float64)
+    y = y.reshape(-1, n).astype(np.float64)
+    m = np.ones(x.shape, dtype=bool) if mask is None else mask.reshape(-1, n)
+
+    # Masked samples of every row first: order[b, :k_b] are its sample indices
+    k = m.sum(axis=1)
+    order = np.argsort(~m, axis=1, kind="stable")
+    rows = np.arange(len(x))[:, None]
+    if n * (n - 1) // 2 <= n_pairs:
+        i, j = np.triu_indices(n, 1)
+        i, j = np.broadcast_to(i, (len(x), i.size)), np.broadcast_to(j, (len(x), j.size))
+        usable = (i < k[:, None]) & (j < k[:, None])
+    else:
+        # Same uniform draws for every row: rows with equal data and masks
+        # get equal estimates
+        rng = np.random.default_rng(seed)
+        i = (rng.random(n_pairs) * k[:, None]).astype(int)
+        j = (rng.random(n_pairs) * k[:, None]).astype(int)
+        usable = i != j
+    i = order[rows, np.minimum(i, n - 1)]
+    j = order[rows, np.minimum(j, n - 1)]
+
+    dx = x[rows, j] - x[rows, i]
+    dy = y[rows, j] - y[rows, i]
+    usable &= dx != 0
+    slopes = np.where(usable, dy / np.where(usable, dx, 1.0), np.nan)
+
+    slope = np.full(len(x), np.nan)
+    intercept = np.full(len(x), np.nan)
+    ok = usable.any(axis=1)
+    slope[ok] = np.nanmedian(slopes[ok], axis=1)
+    resid = np.where(m, y - slope[:, None] * x, np.nan)
+    intercept[ok] = np.nanmedian(resid[ok], axis=1)
+    return slope.reshape(shape), intercept.reshape(shape)
+
+
+def overlap_ratios(
+    stacks: np.ndarray,
+    keys: list,
+    overlaps: list,
+    masks: np.ndarray | None = None,
+    n_pairs: int = 20000,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Contamination ratio of every overlap in every scan, in one batch.
+
+    Parameters
+    ----------
+    stacks : np.ndarray, shape (B, E, N)
+        Element window maps of B scans (pixels flattened), in `keys` order.
+    keys : list of str
+        Element keys of the E maps.
+    overlaps : list of (target, source)
+        The target window also counts `ratio` times the source map.
+    masks : np.ndarray of bool, shape (B, len(overlaps), N), optional
+        Pixels where the target element is absent, so target ~ ratio *
+        source there (all pixels by default; Theil-Sen tolerates a minority
+        of pixels that do contain it).
+
+    Returns
+    -------
+    np.ndarray, shape (B, len(overlaps))
+        Theil-Sen slopes of target against source; NaN where a mask leaves
+        fewer than two pixels.
+    """
+    tgt = [keys.index(t) for t, _ in overlaps]
+    src = [keys.index(s) for _, s in overlaps]
+    slope, _ = theil_sen(stacks[:, src], stacks[:, tgt], masks, n_pairs, seed)
+    return slope
+
+
+def unmixing_matrix(keys: list, overlaps: list, ratios: np.ndarray) -> np.ndarray:
+    """
+    (..., E, E) correction matrix: corrected = maps @ M for maps (..., E).
+
+    Identity, with -ratio at [source, target] of every overlap; `ratios`
+    is (..., len(overlaps)), e.g. one row per scan from overlap_ratios.
+    """
+    ratios = np.asarray(ratios, dtype=np.float64)
+    matrix = np.broadcast_to(np.eye(len(keys)), (*ratios.shape[:-1], len(keys), len(keys))).copy()
+    for o, (target, source) in enumerate(overlaps):
+        matrix[..., keys.index(source), keys.index(target)] -= ratios[..., o]
+    return matrix
+
+
+def apply_unmixing(
+    stack: np.ndarray,
+    matrix: np.ndarray,
+    clip: bool = False,
+    variance: bool = False,
+) -> np.ndarray:
+    """
+    Apply an (E, D) mixing matrix to an element-first stack (E, ...).
+
+    Returns the (D, ...) stack sum_e matrix[e, d] * stack[e]; one matmul
+    for all pixels. With variance=True `stack` holds independent variances
+    and matrix ** 2 is applied instead (clip is then ignored).
+    """
+    weights = matrix * matrix if variance else matrix
+    flat = stack.reshape(stack.shape[0], -1)
+    out = (weights.T @ flat).reshape(matrix.shape[1], *stack.shape[1:])
+    if clip and not variance:
+        np.maximum(out, 0, out=out)
+    return out
@@ -4,6 +4,8 @@ from dataclasses import dataclass, field
 from pathlib import Path
 import torch
 
+from .analysis.lines import LINES
+
 
 @dataclass
 class Config:
@@ -24,19 +26,24 @@ class Config:
     dataset_train: str = "aurora-antico1-prova1"  # Train/val/test on prova1
     dataset_val_external: str = "aurora-antico1-prova2"  # External validation
 
-    # Elements to analyze (Sn EXCLUDED — artifact)
+    # Elements to analyze (Sn EXCLUDED — artifact); energies from src.analysis.lines
     elements: dict = field(default_factory=lambda: {
-        'Ca':    {'kev': 3.69, 'name': 'Calcium Ka'},
-        'Ti':    {'kev': 4.51, 'name': 'Titanium Ka'},
-        'Fe':    {'kev': 6.40, 'name': 'Iron Ka'},
-        'Cu':    {'kev': 8.05, 'name': 'Copper Ka'},
-        'Pb_La': {'kev': 10.55, 'name': 'Lead La'},
+        el: {'kev': LINES[el].kev, 'name': name} for el, name in [
+            ('Ca', 'Calcium Ka'),
+            ('Ti', 'Titanium Ka'),
+            ('Fe', 'Iron Ka'),
+            ('Cu', 'Copper Ka'),
+            ('Pb_La', 'Lead La'),
+        ]
     })
 
     # Energy calibration (from existing codebase)
     cal_slope: float = 0.0292       # keV per channel
     cal_intercept: float = -0.0044  # keV offset (approx from linregress)
 
+    # SNIP continuum removal (src/data/continuum.py)
+    snip_width_kev: float = 0.5     # Clipping half-width, ~ broadest peak to keep out
+
     # ─── Model (Experiment A: from scratch) ──────────────────────────────────
     base_filters: int = 32
     n_encoder_blocks: int = 4
@@ -59,6 +66,7 @@ class Config:
 
     # ─── Hardware ────────────────────────────────────────────────────────────
     device: str = "cuda" if torch.cuda.is_available() else "cpu"
+    n_workers: int = 4              # Processes for parallel .mca ingest
 
     # ─── Paths (relative to xrf-denoise/) ────────────────────────────────────
     project_root: str = ""          # Set at runtime
@@ -89,3 +97,7 @@ class Config:
     def kev_to_channel(self, kev: float) -> int:
         """Convert keV to channel index."""
         return int(round((kev - self.cal_intercept) / self.cal_slope))
+
+    def channel_range(self, kev_lo: float, kev_hi: float) -> slice:
+        """Channel slice covering [kev_lo, kev_hi) keV, for window-restricted loading."""
+        return slice(max(0, self.kev_to_channel(kev_lo)), self.kev_to_channel(kev_hi))
@@ -0,0 +1,174 @@
+"""Read scans straight out of zip/tar archives.
+
+A path that runs through an archive file, e.g. 'prova3.zip/10264' or
+'campaigns.tar/aurora-antico1-prova1/19511', names the folder of
+None_N.mca members inside it. mca_folder() turns such a path into an
+ArchiveFolder and returns plain directories unchanged, so the loaders
+accept both without extracting anything to disk.
+
+Members of a zip or an uncompressed tar are independent, so chunks of
+pixels can be decompressed in parallel by separate workers, each with its
+own archive handle. A compressed tar (.tar.gz, .tgz, .tar.bz2, .tar.xz) is
+one compressed stream and is read in a single sequential pass.
+"""
+
+import re
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from .cache import mca_paths, source_fingerprint
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2",
+                    ".tar.xz", ".txz")
+_MCA_RE = re.compile(r"None_(\d+)\.mca")
+
+
+def split_archive_path(path: str | Path) -> tuple[Path, str] | None:
+    """(archive file, folder inside it) for a path through an archive, else None."""
+    parts = Path(path).parts
+    for k in range(1, len(parts) + 1):
+        head = Path(*parts[:k])
+        if head.name.lower().endswith(ARCHIVE_SUFFIXES) and head.is_file():
+            return head, "/".join(parts[k:])
+    return None
+
+
+def is_archive(path: str | Path) -> bool:
+    """True if `path` is an archive file or a folder inside one."""
+    return split_archive_path(path) is not None
+
+
+class ArchiveFolder:
+    """
+    Folder of None_N.mca members inside a zip or tar archive.
+
+    `inner` is the folder path inside the archive (e.g. '10264'); a single
+    wrapping directory such as 'aurora-antico1-prova1/10264' is found too.
+    An empty `inner` accepts any folder, as long as only one holds spectra.
+    The member index is built once and travels with the object when it is
+    sent to worker processes.
+    """
+
+    def __init__(self, archive: str | Path, inner: str = ""):
+        self.archive = Path(archive)
+        self.inner = inner.strip("/")
+        # By suffix: is_zipfile() also accepts a tar that contains a zip (.npz)
+        self.is_zip = self.archive.name.lower().endswith(".zip")
+        self.splittable = self.is_zip
+        if not self.is_zip:
+            try:
+                with tarfile.open(self.archive, "r:"):
+                    self.splittable = True
+            except tarfile.ReadError:
+                pass  # compressed tar: stream only
+        self._members = None
+
+    def __str__(self) -> str:
+        return f"{self.archive}/{self.inner}" if self.inner else str(self.archive)
+
+    def _match(self, member: str) -> tuple[str, int] | None:
+        """(folder, N) if `member` is a None_N.mca under this folder."""
+        if member.startswith("__MACOSX/"):
+            return None
+        head, _, base = member.rpartition("/")
+        m = _MCA_RE.fullmatch(base)
+        if m is None:
+            return None
+        if self.inner and head != self.inner and not head.endswith("/" + self.inner):
+            return None
+        return head, int(m.group(1))
+
+    def _check_unique(self, heads: set):
+        if len(heads) > 1:
+            raise ValueError(f"{self}: spectra in several folders {sorted(heads)}; "
+                             f"give the folder inside the archive explicitly")
+
+    def members(self) -> dict:
+        """
+        N -> member of every None_N.mca (zip: name, uncompressed tar:
+        (data offset, size)). Not available for compressed tars.
+        """
+        if self._members is not None:
+            return self._members
+        if not self.splittable:
+            raise ValueError(f"{self.archive} is a compressed stream; use read()")
+        found, heads = {}, set()
+        if self.is_zip:
+            with zipfile.ZipFile(self.archive) as zf:
+                entries = [(name, name) for name in zf.namelist()]
+        else:
+            with tarfile.open(self.archive, "r:") as tf:
+                entries = [(ti.name, (ti.offset_data, ti.size))
+                           for ti in tf.getmembers() if ti.isfile()]
+        for name, ref in entries:
+            hit = self._match(name)
+            if hit:
+                heads.add(hit[0])
+                found[hit[1]] = ref
+        self._check_unique(heads)
+        self._members = found
+        return found
+
+    def read(self, indices: Iterable[int]) -> Iterator[tuple[int, bytes]]:
+        """
+        Yield (N, raw bytes) for every None_N.mca present with N in `indices`:
+        in index order from a zip or uncompressed tar, in archive order from
+        a compressed tar.
+        """
+        wanted = set(indices)
+        if self.is_zip:
+            members = self.members()
+            with zipfile.ZipFile(self.archive) as zf:
+                for i in sorted(wanted & members.keys()):
+                    yield i, zf.read(members[i])
+        elif self.splittable:
+            members = self.members()
+            with open(self.archive, "rb") as f:
+                for i in sorted(wanted & members.keys()):
+                    offset, size = members[i]
+                    f.seek(offset)
+                    yield i, f.read(size)
+        else:
+            heads = set()
+            with tarfile.open(self.archive, "r|*") as tf:
+                for ti in tf:
+                    hit = self._match(ti.name) if ti.isfile() else None
+                    if hit is None:
+                        continue
+                    heads.add(hit[0])
+                    self._check_unique(heads)
+                    if hit[1] in wanted:
+                        yield hit[1], tf.extractfile(ti).read()
+
+
+def mca_folder(path: str | Path) -> Path | ArchiveFolder:
+    """Spectrum folder for `path`: an ArchiveFolder if it runs through an archive."""
+    split = split_archive_path(path)
+    return ArchiveFolder(*split) if split else Path(path)
+
+
+def read_mca_files(
+    folder: Path | ArchiveFolder,
+    indices: Iterable[int],
+) -> Iterator[tuple[int, bytes]]:
+    """Yield (N, raw bytes) of every existing None_N.mca, N in `indices`."""
+    if isinstance(folder, ArchiveFolder):
+        yield from folder.read(indices)
+        return
+    for i in indices:
+        path = folder / f"None_{i}.mca"
+        if path.exists():
+            with open(path, "rb") as f:
+                yield i, f.read()
+
+
+def scan_fingerprint(folder: Path | ArchiveFolder, total: int) -> str:
+    """
+    Cache-manifest source digest of a scan folder: the None_N.mca files of a
+    directory, or the archive file itself.
+    """
+    if isinstance(folder, ArchiveFolder):
+        return source_fingerprint([folder.archive]) + f":{folder.inner}"
+    return source_fingerprint(mca_paths(folder, total))
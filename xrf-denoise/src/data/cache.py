@@ -0,0 +1,119 @@
+"""Manifest-checked .npy caches.
+
+Every cache directory keeps a manifest.json that records, per cache entry,
+a fingerprint of what the entry was computed from:
+
+    sources  digest of the source files (name + size + mtime, or content hash)
+    params   digest of the extraction parameters (calibration, windows, ...)
+
+An entry is reused only while both digests still match, so editing a
+spectrum, the calibration or a window width recomputes exactly the entries
+that depend on it instead of requiring the whole cache to be wiped.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from pathlib import Path
+from typing import Iterable
+
+MANIFEST_NAME = "manifest.json"
+
+
+def mca_paths(folder: str | Path, total: int) -> list[Path]:
+    """None_1.mca ... None_{total}.mca in `folder` (existing or not)."""
+    folder = Path(folder)
+    return [folder / f"None_{i}.mca" for i in range(1, total + 1)]
+
+
+def source_fingerprint(paths: Iterable[str | Path], content_hash: bool = False) -> str:
+    """
+    Digest of a set of source files.
+
+    Parameters
+    ----------
+    paths : iterable of str or Path
+        Files the cached result was computed from. Missing files are part
+        of the fingerprint, so a file appearing later invalidates the entry.
+    content_hash : bool
+        If True, hash file contents instead of size and mtime. Slower, but
+        robust to copies that do not preserve timestamps.
+    """
+    h = hashlib.sha1()
+    for p in map(Path, paths):
+        key = f"{p.parent.name}/{p.name}"
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            h.update(f"{key}:missing\n".encode())
+            continue
+        if content_hash:
+            with open(p, "rb") as f:
+                h.update(f"{key}:{hashlib.sha1(f.read()).hexdigest()}\n".encode())
+        else:
+            h.update(f"{key}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def _jsonable(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return str(obj)
+
+
+def params_fingerprint(params: dict) -> str:
+    """Digest of a (JSON-serialisable, numpy scalars allowed) parameter dict."""
+    text = json.dumps(params, sort_keys=True, default=_jsonable)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class CacheManifest:
+    """
+    Fingerprint manifest of one cache directory.
+
+    Parameters
+    ----------
+    cache_dir : str or Path
+        Directory holding the cached .npy files and manifest.json.
+    """
+
+    def __init__(self, cache_dir: str | Path):
+        self.cache_dir = Path(cache_dir)
+        self.path = self.cache_dir / MANIFEST_NAME
+
+    @staticmethod
+    def fingerprint(sources: str, params: dict) -> dict:
+        """Entry fingerprint from a source digest and a parameter dict."""
+        return {"sources": sources, "params": params_fingerprint(params)}
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def is_fresh(self, name: str, fingerprint: dict) -> bool:
+        """True if cache file `name` exists and was built from `fingerprint`."""
+        if not (self.cache_dir / name).exists():
+            return False
+        return self._read().get(name) == fingerprint
+
+    def stale(self, fingerprints: dict[str, dict]) -> list[str]:
+        """Names (keys of `fingerprints`) whose cache entries must be rebuilt."""
+        entries = self._read()
+        return [name for name, fp in fingerprints.items()
+                if entries.get(name) != fp or not (self.cache_dir / name).exists()]
+
+    def record(self, fingerprints: dict[str, dict]):
+        """Mark entries as freshly written with the given fingerprints."""
+        entries = self._read()
+        entries.update(fingerprints)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
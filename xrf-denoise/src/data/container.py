@@ -0,0 +1,221 @@
+"""Single-file scan container with memory-mapped access.
+
+A whole dataset (all detectors of one campaign) is packed into one
+uncompressed .npz file:
+
+    counts_<det>      (rows, cols, C) smallest unsigned int dtype; one fixed-size
+                      binary record per pixel, so a spectrum is one contiguous read
+    present_<det>     (rows, cols) bool, False where None_N.mca was missing
+    meta_<det>_<KEY>  (rows, cols) per-pixel header column (float64, or str
+                      for non-numeric keys such as START_TIME)
+    cal_slope, cal_intercept, cal_points, rows, cols, detectors
+
+Members are stored without compression, so the counts arrays can be opened
+with np.memmap directly inside the zip. Plain np.load() still reads the file.
+"""
+
+import struct
+import zipfile
+import numpy as np
+from pathlib import Path
+from typing import Optional
+
+from .header_index import header_columns
+from .mca import compact_dtype, parse_mca_bytes
+
+# Calibration points (channel, keV) shared by the analysis scripts
+CAL_POINTS = np.array([[219, 6.4], [278, 8.0], [363, 10.5], [436, 12.6], [869, 25.3]])
+
+DETECTORS = ("10264", "19511", "stacked")
+
+
+def pack_dataset(
+    dataset_dir: str | Path,
+    out_path: str | Path,
+    detectors: tuple[str, ...] = DETECTORS,
+    rows: int = 60,
+    cols: int = 120,
+    cal_slope: Optional[float] = None,
+    cal_intercept: Optional[float] = None,
+) -> Path:
+    """
+    Pack all None_N.mca files of a dataset into one container file.
+
+    Parameters
+    ----------
+    dataset_dir : str or Path
+        Root dataset directory (e.g., 'aurora-antico1-prova1').
+    out_path : str or Path
+        Output .npz path.
+    detectors : tuple of str
+        Detector folders to pack; folders that do not exist are skipped.
+    rows, cols : int
+        Scan grid dimensions.
+    cal_slope, cal_intercept : float, optional
+        Energy calibration. Defaults to a linear fit of CAL_POINTS.
+
+    Returns
+    -------
+    Path of the written container.
+    """
+    dataset_dir = Path(dataset_dir)
+    out_path = Path(out_path)
+    if cal_slope is None or cal_intercept is None:
+        cal_slope, cal_intercept = np.polyfit(CAL_POINTS[:, 0], CAL_POINTS[:, 1], 1)
+
+    total = rows * cols
+    arrays = {}
+    packed = []
+    for det in detectors:
+        folder = dataset_dir / det
+        if not folder.is_dir():
+            continue
+
+        spectra, metas = [None] * total, [None] * total
+        for i in range(1, total + 1):
+            path = folder / f"None_{i}.mca"
+            if path.exists():
+                with open(path, "rb") as f:
+                    metas[i - 1], spectra[i - 1] = parse_mca_bytes(f.read())
+
+        lengths = [len(s) for s in spectra if s is not None]
+        if not lengths:
+            continue
+        n_ch = lengths[0]
+        peak = max((int(s.max()) for s in spectra if s is not None and len(s)), default=0)
+
+        counts = np.zeros((total, n_ch), dtype=compact_dtype(peak))
+        for k, s in enumerate(spectra):
+            if s is not None:
+                counts[k, :min(len(s), n_ch)] = s[:n_ch]
+        present = np.array([s is not None for s in spectra])
+
+        arrays[f"counts_{det}"] = counts.reshape(rows, cols, n_ch)
+        arrays[f"present_{det}"] = present.reshape(rows, cols)
+        for key, column in header_columns(metas).items():
+            arrays[f"meta_{det}_{key}"] = column.reshape(rows, cols)
+        packed.append(det)
+        print(f"  Packed {det}: {int(present.sum())}/{total} spectra, "
+              f"{n_ch} ch, {counts.dtype}")
+
+    arrays.update(
+        cal_slope=np.float64(cal_slope),
+        cal_intercept=np.float64(cal_intercept),
+        cal_points=CAL_POINTS,
+        rows=np.int64(rows),
+        cols=np.int64(cols),
+        detectors=np.array(packed),
+    )
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "wb") as f:
+        np.savez(f, **arrays)  # savez stores members uncompressed (ZIP_STORED)
+    return out_path
+
+
+def is_container(path: str | Path) -> bool:
+    """True if `path` is a packed scan container file."""
+    path = Path(path)
+    return path.is_file() and path.suffix == ".npz"
+
+
+def _memmap_member(path: Path, zf: zipfile.ZipFile, name: str) -> np.memmap:
+    """Memory-map an uncompressed .npy member of a zip file in place."""
+    info = zf.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"{name} in {path} is compressed and cannot be memory-mapped")
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        local = f.read(30)
+        name_len, extra_len = struct.unpack("<HH", local[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran else "C")
+
+
+class ScanContainer:
+    """
+    Read-only view of a packed scan.
+
+    Counts are memory-mapped: opening the container reads only the zip
+    directory and small arrays, and a spectrum or an element window touches
+    only the pages it needs.
+
+    Parameters
+    ----------
+    path : str or Path
+        Container written by :func:`pack_dataset`.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._npz = np.load(self.path)
+        self._zip = zipfile.ZipFile(self.path)
+        self.rows = int(self._npz["rows"])
+        self.cols = int(self._npz["cols"])
+        self.cal_slope = float(self._npz["cal_slope"])
+        self.cal_intercept = float(self._npz["cal_intercept"])
+        self.detectors = [str(d) for d in self._npz["detectors"]]
+        self._counts = {}
+
+    def close(self):
+        self._npz.close()
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def counts(self, detector: str) -> np.memmap:
+        """Memory-mapped raw counts, shape (rows, cols, C)."""
+        if detector not in self._counts:
+            if detector not in self.detectors:
+                raise KeyError(f"Detector {detector} not in {self.path}")
+            self._counts[detector] = _memmap_member(
+                self.path, self._zip, f"counts_{detector}.npy")
+        return self._counts[detector]
+
+    def n_channels(self, detector: str) -> int:
+        return self.counts(detector).shape[2]
+
+    def energy_axis(self, detector: str) -> np.ndarray:
+        """Energy axis in keV for all channels."""
+        return np.arange(self.n_channels(detector)) * self.cal_slope + self.cal_intercept
+
+    def spectrum(self, detector: str, row: int, col: int) -> np.ndarray:
+        """Raw counts of one pixel (a single contiguous read)."""
+        return np.array(self.counts(detector)[row, col])
+
+    def window(self, detector: str, lo: int, hi: int) -> np.ndarray:
+        """Sum of channels [lo, hi) at every pixel, shape (rows, cols)."""
+        return self.counts(detector)[:, :, lo:hi].sum(axis=2)
+
+    def present(self, detector: str) -> np.ndarray:
+        return self._npz[f"present_{detector}"]
+
+    def meta_keys(self, detector: str) -> list[str]:
+        prefix = f"meta_{detector}_"
+        return [k[len(prefix):] for k in self._npz.files if k.startswith(prefix)]
+
+    def meta(self, detector: str, key: str) -> np.ndarray:
+        """Per-pixel header column, shape (rows, cols)."""
+        return self._npz[f"meta_{detector}_{key}"]
+
+    def times(self, detector: str) -> np.ndarray:
+        """REAL_TIME per pixel, flat (rows * cols,); 1.0 where unknown."""
+        if "REAL_TIME" not in self.meta_keys(detector):
+            return np.ones(self.rows * self.cols)
+        t = self.meta(detector, "REAL_TIME").astype(np.float64).ravel()
+        return np.where(np.isnan(t), 1.0, t)
+
+
+def open_scan(path: str | Path) -> ScanContainer:
+    """Open a packed scan container."""
+    return ScanContainer(path)
@@ -0,0 +1,105 @@
+"""SNIP continuum (background) estimation for whole scans.
+
+SNIP (statistics-sensitive non-linear iterative peak clipping) replaces
+every channel by the smaller of itself and the mean of its two neighbours
+p channels away, for p up to `width`: peaks narrower than the window are
+clipped away and the smooth continuum (scatter, bremsstrahlung, Ar/K/Ca
+tails) remains. Spectra are clipped in the log-log-sqrt (LLS) domain, which
+compresses the dynamic range so weak and strong peaks are treated alike.
+
+All spectra of an (..., C) array are clipped together, one vectorized
+slice operation per window step. cached_continuum persists the continuum of
+a cube next to its .npy cache, so map extraction, NMF and denoising can all
+start from the same continuum-free spectra without recomputing it.
+"""
+
+import numpy as np
+from pathlib import Path
+from typing import Optional
+
+from .cache import CacheManifest, source_fingerprint
+
+
+def snip_width(width_kev: float, cal_slope: float) -> int:
+    """SNIP window half-width in channels for a width in keV."""
+    return max(1, int(round(width_kev / cal_slope)))
+
+
+def snip_continuum(
+    spectra: np.ndarray,
+    width: int,
+    decreasing: bool = True,
+    chunk_size: int = 4096,
+    dtype: np.dtype = np.float32,
+) -> np.ndarray:
+    """
+    SNIP continuum of every spectrum.
+
+    Parameters
+    ----------
+    spectra : np.ndarray, shape (..., C)
+        Counts or CPS, e.g. an (N, C) matrix or an (H, W, C) cube.
+    width : int
+        Largest clipping half-width in channels (about the width of the
+        broadest peak to remove; see snip_width).
+    decreasing : bool
+        Clip from the widest window down to 1 channel, which follows the
+        continuum more smoothly under crowded peaks; False clips 1 .. width.
+    chunk_size : int
+        Spectra processed per block, bounds the working memory.
+    dtype : np.dtype
+        Compute and output dtype.
+
+    Returns
+    -------
+    np.ndarray, same shape as `spectra`
+        Continuum, <= the spectrum in every channel.
+    """
+    flat = spectra.reshape(-1, spectra.shape[-1])
+    out = np.empty(flat.shape, dtype=dtype)
+    n_ch = flat.shape[1]
+    steps = range(min(width, (n_ch - 1) // 2), 0, -1) if decreasing \
+        else range(1, min(width, (n_ch - 1) // 2) + 1)
+    for start in range(0, len(flat), chunk_size):
+        v = np.maximum(flat[start:start + chunk_size], 0).astype(dtype)
+        # LLS: log(log(sqrt(y + 1) + 1) + 1)
+        np.log1p(np.log1p(np.sqrt(v + 1)), out=v)
+        for p in steps:
+            mean = (v[:, :-2 * p] + v[:, 2 * p:]) * 0.5
+            np.minimum(v[:, p:-p], mean, out=v[:, p:-p])
+        np.expm1(np.expm1(v), out=v)
+        out[start:start + chunk_size] = v * v - 1
+    return out.reshape(spectra.shape)
+
+
+def remove_continuum(spectra: np.ndarray, continuum: np.ndarray) -> np.ndarray:
+    """Net spectra: spectra minus continuum, clipped at 0 (float32 or wider)."""
+    dtype = np.result_type(spectra.dtype, continuum.dtype, np.float32)
+    return np.maximum(spectra.astype(dtype, copy=False) - continuum, 0)
+
+
+def cached_continuum(
+    cube: np.ndarray,
+    width: int,
+    cube_cache_path: Optional[str | Path],
+    decreasing: bool = True,
+) -> np.ndarray:
+    """
+    SNIP continuum of `cube`, persisted as <cache stem>_snip<width>.npy next
+    to the cube's .npy cache and reused (memory-mapped) while that cache
+    file is unchanged. Without a cache path it is only computed.
+    """
+    if cube_cache_path is None:
+        return snip_continuum(cube, width, decreasing)
+    cube_cache_path = Path(cube_cache_path)
+    path = cube_cache_path.with_name(f"{cube_cache_path.stem}_snip{width}.npy")
+    manifest = CacheManifest(path.parent)
+    fingerprint = {path.name: manifest.fingerprint(
+        source_fingerprint([cube_cache_path]),
+        {'kind': 'snip', 'width': width, 'decreasing': decreasing, 'shape': cube.shape})}
+    if not manifest.stale(fingerprint):
+        return np.load(path, mmap_mode="r")
+    continuum = snip_continuum(cube, width, decreasing)
+    np.save(path, continuum)
+    manifest.record(fingerprint)
+    return continuum
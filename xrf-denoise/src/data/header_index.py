@@ -0,0 +1,160 @@
+"""Header-only metadata index of a scan.
+
+Reads just the 'KEY - VALUE' header of every None_N.mca (REAL_TIME,
+LIVE_TIME, START_TIME, ...) into one column per key with one entry per
+pixel. The index is cached next to the dataset as <detector>_headers.npz
+(validated by a cache manifest), so acquisition QA maps and per-pixel
+acquisition times are available without parsing any count data. For a
+dataset inside a zip/tar archive the index is cached next to the archive.
+Callers that keep their own cache directory (the cube loader) pass it as
+cache_dir so the raw dataset is never written to; a directory that cannot
+be written only disables caching.
+"""
+
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+
+from .archive import ArchiveFolder, mca_folder, scan_fingerprint
+from .cache import CacheManifest, mca_paths
+from .mca import parse_header_bytes, read_header
+
+START_TIME_FORMAT = "%m/%d/%Y %H:%M:%S"
+
+
+def header_columns(metas: list) -> dict[str, np.ndarray]:
+    """
+    Columnar table from per-pixel header dicts (None for missing pixels).
+
+    Numeric keys become float64 columns (NaN where missing), all others str.
+    """
+    keys = sorted({k for m in metas if m for k in m})
+    columns = {}
+    for key in keys:
+        values = [m.get(key) if m else None for m in metas]
+        try:
+            columns[key] = np.array([np.nan if v is None else float(v) for v in values])
+        except ValueError:
+            columns[key] = np.array(["" if v is None else v for v in values])
+    return columns
+
+
+def build_header_index(
+    dataset_dir: str | Path,
+    detector: str,
+    rows: int = 60,
+    cols: int = 120,
+    use_cache: bool = True,
+    cache_dir: str | Path | None = None,
+) -> dict[str, np.ndarray]:
+    """
+    Per-pixel header table of one detector.
+
+    Parameters
+    ----------
+    dataset_dir : str or Path
+        Root dataset directory (e.g., 'aurora-antico1-prova1'), or a zip/tar
+        archive of it.
+    detector : str
+        Detector ID ('10264' or '19511').
+    rows, cols : int
+        Scan grid dimensions.
+    use_cache : bool
+        Read/write <dataset_dir>/<detector>_headers.npz.
+    cache_dir : str or Path, optional
+        Keep the index in this directory instead, as
+        <dataset name>_<detector>_headers.npz.
+
+    Returns
+    -------
+    dict of str -> np.ndarray, shape (rows * cols,)
+        One column per header key, plus 'present' (bool).
+    """
+    total = rows * cols
+    folder = mca_folder(Path(dataset_dir) / detector)
+    if isinstance(folder, ArchiveFolder):
+        cache_dir = Path(cache_dir) if cache_dir else folder.archive.parent
+        cache_path = cache_dir / (f"{folder.archive.name}_"
+                                  f"{folder.inner.replace('/', '_')}_headers.npz")
+    elif cache_dir:
+        cache_dir = Path(cache_dir)
+        cache_path = cache_dir / f"{Path(dataset_dir).name}_{detector}_headers.npz"
+    else:
+        cache_dir = Path(dataset_dir)
+        cache_path = cache_dir / f"{detector}_headers.npz"
+    manifest = CacheManifest(cache_dir)
+    fingerprint = {cache_path.name: manifest.fingerprint(
+        scan_fingerprint(folder, total), {'rows': rows, 'cols': cols})}
+
+    if use_cache and not manifest.stale(fingerprint):
+        with np.load(cache_path) as f:
+            return {k: f[k] for k in f.files}
+
+    if isinstance(folder, ArchiveFolder):
+        headers = {i: parse_header_bytes(raw) for i, raw in folder.read(range(1, total + 1))}
+        metas = [headers.get(i) for i in range(1, total + 1)]
+    else:
+        metas = [read_header(p) if p.exists() else None for p in mca_paths(folder, total)]
+    index = header_columns(metas)
+    index['present'] = np.array([m is not None for m in metas])
+
+    if use_cache:
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            np.savez(cache_path, **index)
+            manifest.record(fingerprint)
+        except OSError:
+            pass  # read-only location, the index is simply rebuilt next time
+    return index
+
+
+def acquisition_times(index: dict[str, np.ndarray]) -> np.ndarray:
+    """REAL_TIME per pixel (NaN where missing), as used for CPS normalization."""
+    if 'REAL_TIME' in index and index['REAL_TIME'].dtype.kind == 'f':
+        t = index['REAL_TIME'].copy()
+    else:
+        t = np.ones(index['present'].size)  # parser default when the key is absent
+    t[~index['present']] = np.nan
+    return t
+
+
+def dead_time_map(index: dict, rows: int, cols: int) -> np.ndarray:
+    """Dead-time fraction 1 - LIVE_TIME / REAL_TIME, shape (rows, cols)."""
+    if 'LIVE_TIME' not in index or 'REAL_TIME' not in index:
+        return np.full((rows, cols), np.nan)
+    real, live = index['REAL_TIME'], index['LIVE_TIME']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dt = 1.0 - live / real
+    return dt.reshape(rows, cols)
+
+
+def start_seconds(index: dict) -> np.ndarray:
+    """START_TIME as seconds since the first pixel (NaN where unknown)."""
+    out = np.full(index['present'].size, np.nan)
+    for i, s in enumerate(index.get('START_TIME', [])):
+        try:
+            out[i] = datetime.strptime(str(s), START_TIME_FORMAT).timestamp()
+        except ValueError:
+            pass
+    if np.isfinite(out).any():
+        out -= np.nanmin(out)
+    return out
+
+
+def timing_drift_map(index: dict, rows: int, cols: int) -> np.ndarray:
+    """
+    Deviation (s) of each pixel's start time from a uniform acquisition
+    clock with the median pixel-to-pixel interval.
+    """
+    t = start_seconds(index)
+    steps = np.diff(t)
+    if not np.isfinite(steps).any():
+        return np.full((rows, cols), np.nan)
+    expected = np.arange(t.size) * np.nanmedian(steps)
+    offset = np.nanmedian(t - expected)
+    return (t - expected - offset).reshape(rows, cols)
+
+
+def missing_map(index: dict, rows: int, cols: int) -> np.ndarray:
+    """True where None_N.mca is missing, shape (rows, cols)."""
+    return ~index['present'].reshape(rows, cols)
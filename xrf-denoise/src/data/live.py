@@ -0,0 +1,177 @@
+"""Incremental ingest of a scan that is still being acquired.
+
+The instrument writes None_1.mca, None_2.mca, ... as the scan progresses.
+LiveScan polls the detector folder, parses every new file exactly once and
+folds it into element maps and a running sum spectrum, so partial maps are
+available while the scan runs. A pixel the instrument skipped, or a file
+whose final write was aborted (no <<END>>), never completes, so watching
+stops after an idle timeout and reports those pixels.
+"""
+
+import os
+import re
+import time
+import numpy as np
+from pathlib import Path
+from typing import Callable, Optional
+
+from ..analysis.lines import compile_lines, element_specs
+from .mca import parse_mca_bytes
+
+_NAME_RE = re.compile(r"^None_(\d+)\.mca$")
+
+
+class LiveScan:
+    """
+    Element maps of a scan that grow as new spectra are written.
+
+    Parameters
+    ----------
+    folder : str or Path
+        Detector folder the instrument writes None_N.mca files into.
+    rows, cols : int
+        Scan grid dimensions.
+    elements : dict
+        {name: {'kev': line energy, ...}}, e.g. Config.elements. Compiled
+        once with element_specs / compile_lines, the same kernels as the
+        batch scripts, so entries with 'bg_hw' get the sideband baseline.
+    cal_slope, cal_intercept : float
+        Energy calibration (keV = ch * slope + intercept).
+    half_width_kev : float
+        Integration half-width of elements that do not set their own 'hw'.
+    normalize_cps : bool
+        If True, maps and sum spectrum are accumulated in counts per second.
+    n_channels : int
+        Channels of the energy axis the kernel is compiled for; longer
+        spectra are truncated to it.
+    """
+
+    def __init__(
+        self,
+        folder: str | Path,
+        rows: int,
+        cols: int,
+        elements: dict,
+        cal_slope: float,
+        cal_intercept: float,
+        half_width_kev: float = 0.3,
+        normalize_cps: bool = False,
+        n_channels: int = 1024,
+    ):
+        self.folder = Path(folder)
+        self.rows, self.cols = rows, cols
+        self.element_keys = list(elements)
+        self.normalize_cps = normalize_cps
+
+        energy = np.arange(n_channels) * cal_slope + cal_intercept
+        specs = element_specs({el: {'hw': half_width_kev, **info}
+                               for el, info in elements.items()})
+        self.kernel = compile_lines(specs, energy, cal_slope)
+
+        self.maps = np.zeros((len(self.element_keys), rows, cols), dtype=np.float64)
+        self.times = np.full(rows * cols, np.nan)
+        self.acquired = np.zeros(rows * cols, dtype=bool)
+        # 1-based indices of files seen without <<END>> (still being written)
+        self.incomplete = set()
+        self.sum_spectrum = None
+
+    @property
+    def n_acquired(self) -> int:
+        return int(self.acquired.sum())
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.acquired.all())
+
+    def missing(self) -> list[int]:
+        """1-based indices of pixels whose file has not appeared at all."""
+        return [int(i) for i in np.flatnonzero(~self.acquired) + 1
+                if i not in self.incomplete]
+
+    def element_map(self, key: str) -> np.ndarray:
+        """Current (rows, cols) map of one element; NaN where not yet acquired."""
+        m = self.maps[self.element_keys.index(key)].copy()
+        m[~self.acquired.reshape(self.rows, self.cols)] = np.nan
+        return m
+
+    def _new_indices(self) -> list[int]:
+        """1-based indices of None_N.mca files not yet ingested."""
+        found = []
+        try:
+            it = os.scandir(self.folder)
+        except FileNotFoundError:
+            # The acquisition has not created the folder yet
+            return found
+        with it:
+            for entry in it:
+                m = _NAME_RE.match(entry.name)
+                if m:
+                    i = int(m.group(1))
+                    if 1 <= i <= self.acquired.size and not self.acquired[i - 1]:
+                        found.append(i)
+        return sorted(found)
+
+    def _ingest(self, i: int) -> bool:
+        """Parse None_i.mca into the maps; False if it is still being written."""
+        with open(self.folder / f"None_{i}.mca", "rb") as f:
+            raw = f.read()
+        if b"<<END>>" not in raw:
+            self.incomplete.add(i)
+            return False
+        self.incomplete.discard(i)
+        meta, counts = parse_mca_bytes(raw)
+        t = float(meta.get("REAL_TIME", 1.0))
+        spectrum = counts / max(t, 0.1) if self.normalize_cps else counts.astype(np.float64)
+
+        if self.sum_spectrum is None:
+            self.sum_spectrum = np.zeros(len(spectrum))
+        n = min(len(spectrum), len(self.sum_spectrum))
+        self.sum_spectrum[:n] += spectrum[:n]
+
+        r, c = (i - 1) // self.cols, (i - 1) % self.cols
+        n = min(len(spectrum), len(self.kernel.weights))
+        self.maps[:, r, c] = spectrum[:n] @ self.kernel.weights[:n]
+        self.times[i - 1] = t
+        self.acquired[i - 1] = True
+        return True
+
+    def poll(self) -> list[int]:
+        """Ingest every complete new file once; return the indices ingested."""
+        done = []
+        for i in self._new_indices():
+            if self._ingest(i):
+                done.append(i)
+        return done
+
+    def watch(
+        self,
+        interval: float = 2.0,
+        emit_every: float = 60.0,
+        on_update: Optional[Callable[["LiveScan"], None]] = None,
+        timeout: Optional[float] = 600.0,
+    ) -> "LiveScan":
+        """
+        Poll until the scan is complete (or `timeout` seconds pass without a
+        new file), calling `on_update(self)` at most every `emit_every`
+        seconds when new pixels arrived, and once at the end.
+
+        timeout=None waits indefinitely, which never returns if a pixel is
+        skipped or its file is left incomplete. After a timeout, missing()
+        and incomplete hold the pixels that were not acquired.
+        """
+        last_emit = last_new = time.monotonic()
+        emitted = self.n_acquired
+        while not self.complete:
+            if self.poll():
+                last_new = time.monotonic()
+            now = time.monotonic()
+            if on_update and self.n_acquired > emitted and now - last_emit >= emit_every:
+                on_update(self)
+                last_emit, emitted = now, self.n_acquired
+            if timeout is not None and now - last_new > timeout:
+                break
+            if not self.complete:
+                time.sleep(interval)
+        if on_update and self.n_acquired > emitted:
+            on_update(self)
+        return self
@@ -1,51 +1,465 @@
-"""Load raw XRF datacubes from .mca files."""
+"""Load raw XRF datacubes from .mca files (directories or archives)."""
 
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
 from typing import Optional
 
+from .archive import ArchiveFolder, mca_folder, read_mca_files, scan_fingerprint
+from .cache import CacheManifest
+from .container import is_container, open_scan
+from .header_index import acquisition_times, build_header_index
+from .mca import compact_dtype, parse_mca_raw
+from .spectral_index import SpectralIndex, cached_index
 
-def parse_mca_file(filepath: str | Path) -> dict:
+
+def channel_index(channels, n_channels: int) -> Optional[np.ndarray]:
+    """
+    Sorted channel indices selected by `channels`.
+
+    `channels` is None (all channels), a slice, e.g. from
+    Config.channel_range, or a list of (lo, hi) half-open channel windows.
+    """
+    if channels is None:
+        return None
+    if isinstance(channels, slice):
+        return np.arange(n_channels)[channels]
+    return np.unique(np.concatenate(
+        [np.arange(max(0, lo), min(n_channels, hi)) for lo, hi in channels]))
+
+
+def _channels_spec(channels):
+    """JSON-friendly form of a channel selection, for cache fingerprints."""
+    if isinstance(channels, slice):
+        return [channels.start, channels.stop, channels.step]
+    return None if channels is None else [[int(lo), int(hi)] for lo, hi in channels]
+
+
+def iter_spectra(
+    folder: str | Path | ArchiveFolder,
+    total: int,
+    n_workers: int = 1,
+    chunk_size: int = 256,
+):
+    """
+    Yield (i, parse_mca_file dict) for every existing None_i.mca, i = 1..total,
+    in index order (archive order for a compressed tar).
+
+    `folder` may be a directory or a folder inside a zip/tar archive (see
+    src.data.archive). For archives, chunks of members are decompressed and
+    parsed by `n_workers` threads, each with its own archive handle.
+    """
+    if not isinstance(folder, ArchiveFolder):
+        folder = mca_folder(folder)
+    if n_workers <= 1 or not isinstance(folder, ArchiveFolder) or not folder.splittable:
+        for i, raw in read_mca_files(folder, range(1, total + 1)):
+            yield i, parse_mca_raw(raw)
+        return
+
+    def _chunk(indices):
+        return [(i, parse_mca_raw(raw)) for i, raw in folder.read(indices)]
+
+    chunks = [range(lo, min(lo + chunk_size, total + 1))
+              for lo in range(1, total + 1, chunk_size)]
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for chunk in pool.map(_chunk, chunks):
+            yield from chunk
+
+
+def _fill_pixels(
+    cube: np.ndarray,
+    times: np.ndarray,
+    folder: Path | ArchiveFolder,
+    indices: range,
+    normalize_cps: bool,
+    channels: Optional[np.ndarray] = None,
+) -> list[int]:
+    """Parse None_i.mca for i in `indices` into `cube`/`times`; return missing i.
+
+    With `channels` (sorted indices) only those channels are stored."""
+    cols, n_ch = cube.shape[1], cube.shape[2]
+    found = set()
+    for i, raw in read_mca_files(folder, indices):
+        found.add(i)
+        data = parse_mca_raw(raw)
+        r = (i - 1) // cols
+        c = (i - 1) % cols
+        spectrum = data['counts']
+        if channels is not None:
+            spectrum = spectrum[channels[channels < len(spectrum)]]
+        spectrum = spectrum[:n_ch]
+        t = data['time']
+        times[i - 1] = t
+
+        if normalize_cps:
+            cube[r, c, :len(spectrum)] = spectrum / max(t, 0.1)
+        else:
+            cube[r, c, :len(spectrum)] = spectrum
+    return [i for i in indices if i not in found]
+
+
+def _ingest_chunk(args: tuple) -> tuple[list[int], range, np.ndarray]:
+    """Worker: attach to the shared cube and fill one chunk of pixel indices."""
+    shm_name, shape, dtype, folder, indices, normalize_cps, channels = args
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        cube = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        times = np.full(shape[0] * shape[1], np.nan)
+        missing = _fill_pixels(cube, times, folder, indices, normalize_cps, channels)
+        del cube
+    finally:
+        shm.close()
+    return missing, indices, times[indices.start - 1:indices.stop - 1]
+
+
+def detect_n_channels(folder: str | Path | ArchiveFolder, total: int) -> int:
+    """Channel count of the first existing None_N.mca in `folder`."""
+    for _, data in iter_spectra(folder, total):
+        return len(data['counts'])
+    raise FileNotFoundError(f"No None_N.mca files in {folder}")
+
+
+def counts_to_cps(
+    counts: np.ndarray,
+    times: np.ndarray,
+    dtype: np.dtype = np.float32,
+) -> np.ndarray:
     """
-    Parse a single .mca spectrum file.
+    Counts per second for a batch of raw spectra.
+
+    counts (..., C) is divided by max(time, 0.1) with times shaped (...);
+    unknown times (NaN, missing files) count as 1 s, as in the parser.
+    """
+    t = np.maximum(np.nan_to_num(np.asarray(times, dtype=np.float64), nan=1.0), 0.1)
+    return (counts / t[..., None]).astype(dtype, copy=False)
+
+
+def load_counts_matrix(
+    dataset_dir: str | Path,
+    detectors: list[str],
+    total: int,
+    n_workers: int = 1,
+    channels=None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Raw spectra of several detectors as one compact (n_det, total, C) matrix.
+
+    `channels` restricts storage to a slice or list of (lo, hi) channel
+    windows (see channel_index); C is then the number of selected channels.
+
+    Returns
+    -------
+    counts : np.ndarray, shape (n_det, total, C), smallest unsigned dtype
+    times : np.ndarray, shape (n_det, total), REAL_TIME (NaN if missing)
+    """
+    folders = [mca_folder(Path(dataset_dir) / det) for det in detectors]
+    n_ch = detect_n_channels(folders[0], total)
+    idx = channel_index(channels, n_ch)
+    width = n_ch if idx is None else len(idx)
+    counts = np.zeros((len(folders), total, width), dtype=np.uint32)
+    times = np.full((len(folders), total), np.nan)
+    results = ingest_folders(folders, 1, total, [width] * len(folders),
+                             n_workers=n_workers, dtype=np.uint32,
+                             channels=[idx] * len(folders))
+    for d, (folder, (cube, t, missing)) in enumerate(zip(folders, results)):
+        counts[d], times[d] = cube[0], t
+        for i in missing:
+            print(f"Warning: Missing file None_{i}.mca in {folder}")
+    return counts.astype(compact_dtype(int(counts.max())), copy=False), times
+
+
+def average_cps(
+    counts: np.ndarray,
+    times: np.ndarray,
+    channels: slice = slice(None),
+    dtype: np.dtype = np.float32,
+) -> np.ndarray:
+    """Detector-averaged CPS (total, C') of a load_counts_matrix result,
+    converted only for the requested channel window."""
+    out = np.zeros(counts[0][:, channels].shape, dtype=dtype)
+    for d in range(counts.shape[0]):
+        out += counts_to_cps(counts[d][:, channels], times[d], dtype) / counts.shape[0]
+    return out
+
+
+def ingest_folders(
+    folders: list[str | Path],
+    rows: int,
+    cols: int,
+    n_channels: list[int],
+    normalize_cps: bool = False,
+    n_workers: int = 1,
+    dtype: np.dtype = np.float32,
+    chunks_per_worker: int = 4,
+    channels: Optional[list] = None,
+) -> list[tuple[np.ndarray, np.ndarray, list[int]]]:
+    """
+    Read None_1.mca ... None_{rows*cols}.mca of several folders into cubes.
+
+    With n_workers > 1 the pixel indices of every folder are split into
+    contiguous chunks and all chunks go to one process pool, interleaved
+    across folders, so reading and parsing of different detectors and
+    campaigns overlap. Workers write straight into one shared-memory cube per
+    folder; each pixel has a fixed slot, so the result does not depend on
+    scheduling.
 
     Parameters
     ----------
-    filepath : str or Path
-        Path to the .mca file.
+    folders : list of str or Path
+        Detector folders containing the None_N.mca files, or folders inside
+        zip/tar archives (e.g. 'prova3.zip/10264'); archive members are
+        decompressed by the workers, in parallel where the format allows.
+    rows, cols : int
+        Scan grid dimensions.
+    n_channels : list of int
+        Channels stored per spectrum for each folder; longer spectra are
+        truncated.
+    normalize_cps : bool
+        If True, divide counts by acquisition time (counts per second).
+    n_workers : int
+        Number of worker processes. With 1, everything runs in this process
+        (one thread per folder).
+    dtype : np.dtype
+        Cube dtype.
+    chunks_per_worker : int
+        Chunks scheduled per worker and folder, for load balancing.
+    channels : list of np.ndarray or None, optional
+        Per folder, sorted channel indices to keep (see channel_index).
 
     Returns
     -------
-    dict
-        'counts': np.ndarray of shape (n_channels,), dtype float64
-        'time': float, acquisition time in seconds (REAL_TIME)
-    """
-    meta, counts, in_data = {}, [], False
-    with open(filepath) as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            if line == "<<DATA>>":
-                in_data = True
+    list of (cube, times, missing) per folder, see ingest_folder.
+    """
+    folders = [f if isinstance(f, ArchiveFolder) else mca_folder(f) for f in folders]
+    total = rows * cols
+    shapes = [(rows, cols, n_ch) for n_ch in n_channels]
+    channels = channels or [None] * len(folders)
+    dtype = np.dtype(dtype)
+
+    if n_workers <= 1:
+        def _one(folder, shape, idx):
+            cube = np.zeros(shape, dtype=dtype)
+            times = np.full(total, np.nan)
+            missing = _fill_pixels(cube, times, folder, range(1, total + 1),
+                                   normalize_cps, idx)
+            return cube, times, missing
+
+        if len(folders) == 1:
+            return [_one(folders[0], shapes[0], channels[0])]
+        # No child processes (safe for scripts without a __main__ guard),
+        # but file reads of the different folders still overlap
+        with ThreadPoolExecutor(max_workers=len(folders)) as pool:
+            return list(pool.map(_one, folders, shapes, channels))
+
+    n_chunks = max(1, min(total, n_workers * chunks_per_worker))
+    bounds = np.linspace(1, total + 1, n_chunks + 1).astype(int)
+    chunks = [range(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    # A compressed tar is one stream: read it in one pass by a single worker
+    folder_chunks = [[range(1, total + 1)]
+                     if isinstance(f, ArchiveFolder) and not f.splittable else chunks
+                     for f in folders]
+
+    shms = []
+    try:
+        for shape in shapes:
+            shms.append(shared_memory.SharedMemory(
+                create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize)))
+        shared = [np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+                  for shape, shm in zip(shapes, shms)]
+        for cube in shared:
+            cube[:] = 0
+        times = [np.full(total, np.nan) for _ in folders]
+        missing = [[] for _ in folders]
+
+        # Round-robin over folders so every source progresses at once
+        owners, jobs = [], []
+        for k in range(len(chunks)):
+            for f, (folder, shape, shm) in enumerate(zip(folders, shapes, shms)):
+                if k >= len(folder_chunks[f]):
+                    continue
+                idx = folder_chunks[f][k]
+                owners.append(f)
+                jobs.append((shm.name, shape, dtype, folder, idx, normalize_cps,
+                             channels[f]))
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            for f, (chunk_missing, idx, chunk_times) in zip(owners,
+                                                             pool.map(_ingest_chunk, jobs)):
+                missing[f].extend(chunk_missing)
+                times[f][idx.start - 1:idx.stop - 1] = chunk_times
+        results = [(cube.copy(), t, sorted(m))
+                   for cube, t, m in zip(shared, times, missing)]
+        del shared, cube
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return results
+
+
+def ingest_folder(
+    folder: str | Path,
+    rows: int,
+    cols: int,
+    n_channels: int,
+    normalize_cps: bool = False,
+    n_workers: int = 1,
+    dtype: np.dtype = np.float32,
+    chunks_per_worker: int = 4,
+) -> tuple[np.ndarray, np.ndarray, list[int]]:
+    """
+    Read None_1.mca ... None_{rows*cols}.mca into a (rows, cols, C) cube.
+
+    Single-folder form of ingest_folders (same parameters).
+
+    Returns
+    -------
+    cube : np.ndarray, shape (rows, cols, n_channels)
+    times : np.ndarray, shape (rows * cols,), REAL_TIME per pixel (NaN if missing)
+    missing : list of int, 1-based indices of files that do not exist
+    """
+    return ingest_folders([folder], rows, cols, [n_channels], normalize_cps,
+                          n_workers, dtype, chunks_per_worker)[0]
+
+
+def load_datacubes(
+    sources: list[tuple[str | Path, str]],
+    rows: int = 60,
+    cols: int = 120,
+    normalize_cps: bool = False,
+    cache_paths: Optional[dict] = None,
+    n_workers: int = 1,
+    channels=None,
+    index: bool = False,
+) -> tuple[dict, dict]:
+    """
+    Load several (campaign, detector) datacubes concurrently.
+
+    Cached and container sources are opened directly; everything else is
+    ingested in one pass with a shared process pool (see ingest_folders).
+
+    Parameters
+    ----------
+    sources : list of (dataset_dir, detector)
+        E.g. [('aurora-antico1-prova1', '10264'), ('aurora-antico1-prova2',
+        'stacked')]. dataset_dir may also be a scan container, or a zip/tar
+        archive of the dataset (or a folder inside one).
+    rows, cols : int
+        Scan grid dimensions.
+    normalize_cps : bool
+        If True, return float32 counts per second.
+    cache_paths : dict, optional
+        {(dataset_dir, detector): .npy path} for sources that should be cached.
+    n_workers : int
+        Worker processes shared by all sources. 1 = serial.
+    channels : slice or list of (lo, hi), optional
+        Keep only these channels, e.g. Config.channel_range(1.0, 14.0);
+        metadata['channels'] then holds the selected channel indices.
+    index : bool
+        If True, metadata['index'] holds a SpectralIndex (prefix sums along
+        the energy axis) of each cube, saved next to its cache and reused
+        while the cache is unchanged.
+
+    Returns
+    -------
+    cubes : dict of (dataset_dir, detector) -> np.ndarray (rows, cols, C)
+    metadata : dict of (dataset_dir, detector) -> dict, see load_datacube
+    """
+    cache_paths = cache_paths or {}
+    cubes, metadata = {}, {}
+    todo = []
+    for key in sources:
+        dataset_dir, detector = key
+        if is_container(dataset_dir):
+            cubes[key], metadata[key] = _load_from_container(dataset_dir, detector,
+                                                             normalize_cps, channels)
+            continue
+
+        folder = mca_folder(Path(dataset_dir) / detector)
+        cache_path = Path(cache_paths[key]) if cache_paths.get(key) else None
+        manifest = fingerprint = None
+        if cache_path:
+            manifest = CacheManifest(cache_path.parent)
+            fingerprint = {cache_path.name: manifest.fingerprint(
+                scan_fingerprint(folder, rows * cols),
+                {'detector': detector, 'rows': rows, 'cols': cols, 'storage': 'counts',
+                 'channels': _channels_spec(channels)})}
+            if not manifest.stale(fingerprint):
+                # Counts from the cache; acquisition times and missing
+                # pixels from the header index
+                cube = np.load(cache_path)
+                headers = build_header_index(dataset_dir, detector, rows, cols,
+                                             cache_dir=cache_path.parent)
+                times = acquisition_times(headers)
+                missing = [int(i) + 1 for i in np.flatnonzero(~headers['present'])]
+                for i in missing:
+                    print(f"Warning: Missing file None_{i}.mca in {folder}")
+                metadata[key] = _cube_metadata(
+                    key, cube, times, missing,
+                    channel_index(channels, detect_n_channels(folder, rows * cols)),
+                    from_cache=True)
+                if normalize_cps:
+                    cube = counts_to_cps(cube, times.reshape(rows, cols))
+                cubes[key] = cube
                 continue
-            if line == "<<END>>":
-                in_data = False
-                break
-            if in_data:
-                try:
-                    counts.append(int(line))
-                except ValueError:
-                    pass
-            elif " - " in line:
-                k, v = line.split(" - ", 1)
-                meta[k.strip()] = v.strip()
+        todo.append((key, folder, cache_path, manifest, fingerprint))
+
+    if not todo:
+        return cubes, _with_index(cubes, metadata, cache_paths, normalize_cps, index)
+
+    full = [detect_n_channels(folder, rows * cols) for _, folder, *_ in todo]
+    idxs = [channel_index(channels, n) for n in full]
+    n_chs = [n if idx is None else len(idx) for n, idx in zip(full, idxs)]
+    results = ingest_folders([folder for _, folder, *_ in todo], rows, cols, n_chs,
+                             n_workers=n_workers, dtype=np.uint32, channels=idxs)
+
+    for (key, folder, cache_path, manifest, fingerprint), n_ch, idx, (cube, times, missing) \
+            in zip(todo, n_chs, idxs, results):
+        cube = cube.astype(compact_dtype(int(cube.max())), copy=False)
+        for i in missing:
+            print(f"Warning: Missing file None_{i}.mca in {folder}")
+
+        if cache_path:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            np.save(cache_path, cube)
+            manifest.record(fingerprint)
+
+        metadata[key] = _cube_metadata(key, cube, times, missing, idx, from_cache=False)
+        if normalize_cps:
+            cube = counts_to_cps(cube, times.reshape(rows, cols))
+        cubes[key] = cube
+    return cubes, _with_index(cubes, metadata, cache_paths, normalize_cps, index)
+
+
+def _cube_metadata(key, cube, times, missing, channels, from_cache: bool) -> dict:
+    """load_datacubes metadata of one raw count cube (before any CPS
+    conversion), the same for freshly ingested and cached cubes."""
+    rows, cols, n_ch = cube.shape
     return {
-        "counts": np.array(counts, dtype=np.float64),
-        "time": float(meta.get("REAL_TIME", 1.0)),
+        'n_channels': n_ch,
+        'rows': rows,
+        'cols': cols,
+        'detector': key[1],
+        'times': times,
+        'channels': channels,
+        'mean_time': float(np.nanmean(times)) if len(missing) < times.size else 0.0,
+        'total_counts_mean': float(cube.sum(axis=2).mean()),
+        'missing': missing,
+        'from_cache': from_cache,
     }
 
 
+def _with_index(cubes, metadata, cache_paths, normalize_cps, index):
+    """Attach metadata['index'] when requested; only raw count cubes with a
+    cache get a persisted index (CPS cubes depend on the times as well)."""
+    if index:
+        for key, cube in cubes.items():
+            cache_path = None if normalize_cps else cache_paths.get(key)
+            metadata[key]['index'] = (cached_index(cube, cache_path) if cache_path
+                                      else SpectralIndex.from_cube(cube))
+    return metadata
+
+
 def load_datacube(
     dataset_dir: str | Path,
     detector: str,
@@ -53,6 +467,9 @@ def load_datacube(
     cols: int = 120,
     normalize_cps: bool = False,
     cache_path: Optional[str | Path] = None,
+    n_workers: int = 1,
+    channels=None,
+    index: bool = False,
 ) -> tuple[np.ndarray, dict]:
     """
     Load all spectra from a detector folder into a 3D datacube.
@@ -60,63 +477,77 @@ def load_datacube(
     Parameters
     ----------
     dataset_dir : str or Path
-        Root dataset directory (e.g., 'aurora-antico1-prova1').
+        Root dataset directory (e.g., 'aurora-antico1-prova1'), a scan
+        container written by src.data.container.pack_dataset, or a zip/tar
+        archive of the dataset directory, read without extraction (see
+        src.data.archive).
     detector : str
-        Detector ID ('10264' or '19511').
+        Detector ID ('10264', '19511' or 'stacked').
     rows, cols : int
-        Scan grid dimensions.
+        Scan grid dimensions (taken from the container when one is given).
     normalize_cps : bool
         If True, divide counts by acquisition time (counts per second).
     cache_path : str or Path, optional
-        If provided, save/load cached .npy file.
+        If provided, save/load cached .npy file. The cache is reused only
+        while the source files and load parameters match its manifest
+        entry (see src.data.cache). Not used for containers.
+    n_workers : int
+        Worker processes for parsing (see ingest_folder). 1 = serial.
+    channels : slice or list of (lo, hi), optional
+        Keep only these channels (see load_datacubes).
+    index : bool
+        Also return metadata['index'], a SpectralIndex of the cube for O(1)
+        window integrals, persisted next to cache_path (see load_datacubes).
 
     Returns
     -------
-    cube : np.ndarray, shape (rows, cols, n_channels), float32
-    metadata : dict with 'n_channels', 'mean_time', 'total_counts_mean'
+    cube : np.ndarray, shape (rows, cols, n_channels)
+        Raw counts in the smallest unsigned integer dtype that fits (a
+        read-only memmap for containers), or float32 CPS if normalize_cps.
+        Convert batches with counts_to_cps / astype at the point of use.
+    metadata : dict with 'n_channels', 'times' (REAL_TIME per pixel, flat),
+        'mean_time', 'total_counts_mean', 'missing'
     """
-    if cache_path and Path(cache_path).exists():
-        cube = np.load(cache_path).astype(np.float32)
-        n_ch = cube.shape[2]
-        return cube, {'n_channels': n_ch, 'from_cache': True}
-
-    folder = Path(dataset_dir) / detector
-    total = rows * cols
-
-    # Determine channel count from first file
-    first = parse_mca_file(folder / "None_1.mca")
-    n_ch = len(first['counts'])
+    key = (dataset_dir, detector)
+    cubes, metadata = load_datacubes([key], rows, cols, normalize_cps,
+                                     cache_paths={key: cache_path}, n_workers=n_workers,
+                                     channels=channels, index=index)
+    return cubes[key], metadata[key]
 
-    cube = np.zeros((rows, cols, n_ch), dtype=np.float64)
-    times = []
 
-    for i in range(1, total + 1):
-        data = parse_mca_file(folder / f"None_{i}.mca")
-        r = (i - 1) // cols
-        c = (i - 1) % cols
-        spectrum = data['counts']
-        t = data['time']
-        times.append(t)
-
-        if normalize_cps:
-            cube[r, c, :len(spectrum)] = spectrum / max(t, 0.1)
-        else:
-            cube[r, c, :len(spectrum)] = spectrum
+def _load_from_container(
+    path: str | Path,
+    detector: str,
+    normalize_cps: bool,
+    channels=None,
+) -> tuple[np.ndarray, dict]:
+    """load_datacube for a packed scan: memory-map counts, no parsing."""
+    with open_scan(path) as scan:
+        cube = scan.counts(detector)
+        times = scan.times(detector)
+        present = scan.present(detector).ravel()
+        rows, cols = scan.rows, scan.cols
 
-    cube = cube.astype(np.float32)
+    idx = channel_index(channels, cube.shape[2])
+    if isinstance(channels, slice):
+        cube = cube[:, :, channels]  # still a memmap view
+    elif idx is not None:
+        cube = np.asarray(cube[:, :, idx])
 
-    if cache_path:
-        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
-        np.save(cache_path, cube)
+    if normalize_cps:
+        cube = counts_to_cps(cube, times.reshape(rows, cols))
 
     metadata = {
-        'n_channels': n_ch,
+        'n_channels': cube.shape[2],
         'rows': rows,
         'cols': cols,
         'detector': detector,
-        'mean_time': float(np.mean(times)),
-        'total_counts_mean': float(cube.sum(axis=2).mean()),
+        'times': times,
+        'channels': idx,
+        'mean_time': float(times[present].mean()) if present.any() else 0.0,
+        'missing': [int(i) + 1 for i in np.flatnonzero(~present)],
         'from_cache': False,
+        'from_container': True,
     }
     return cube, metadata
 
@@ -128,31 +559,32 @@ def load_both_detectors(
     rows: int = 60,
     cols: int = 120,
     cache_dir: Optional[str | Path] = None,
+    n_workers: int = 1,
 ) -> tuple[np.ndarray, np.ndarray, dict]:
     """
     Load datacubes from both detectors.
 
+    `dataset_dir` may be a dataset directory or a packed scan container
+    (in which case both cubes are memory-mapped and cache_dir is ignored).
+
     Returns
     -------
     cube_a, cube_b : np.ndarray, shape (rows, cols, n_channels)
     metadata : dict
     """
-    cache_a = Path(cache_dir) / f"{detector_a}_raw.npy" if cache_dir else None
-    cache_b = Path(cache_dir) / f"{detector_b}_raw.npy" if cache_dir else None
-
-    print(f"  Loading detector {detector_a}...", end=" ", flush=True)
-    cube_a, meta_a = load_datacube(dataset_dir, detector_a, rows, cols,
-                                   cache_path=cache_a)
-    print(f"OK ({meta_a['n_channels']} ch)")
+    key_a, key_b = (dataset_dir, detector_a), (dataset_dir, detector_b)
+    cache_paths = ({key_a: Path(cache_dir) / f"{detector_a}_raw.npy",
+                    key_b: Path(cache_dir) / f"{detector_b}_raw.npy"} if cache_dir else None)
 
-    print(f"  Loading detector {detector_b}...", end=" ", flush=True)
-    cube_b, meta_b = load_datacube(dataset_dir, detector_b, rows, cols,
-                                   cache_path=cache_b)
-    print(f"OK ({meta_b['n_channels']} ch)")
+    print(f"  Loading detectors {detector_a} + {detector_b}...", end=" ", flush=True)
+    cubes, meta = load_datacubes([key_a, key_b], rows, cols,
+                                 cache_paths=cache_paths, n_workers=n_workers)
+    cube_a, cube_b = cubes[key_a], cubes[key_b]
+    print(f"OK ({meta[key_a]['n_channels']} / {meta[key_b]['n_channels']} ch)")
 
     metadata = {
-        'n_channels': meta_a['n_channels'],
-        'rows': rows, 'cols': cols,
+        'n_channels': meta[key_a]['n_channels'],
+        'rows': cube_a.shape[0], 'cols': cube_a.shape[1],
         'detector_a': detector_a,
         'detector_b': detector_b,
         'mean_counts_a': float(cube_a.sum(axis=2).mean()),
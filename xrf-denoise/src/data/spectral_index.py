@@ -0,0 +1,101 @@
+"""Prefix-sum index along the energy axis of a datacube.
+
+planes[c] holds, per pixel, the sum of channels 0 .. c-1, so the integral
+over any channel window [lo, hi) is planes[hi] - planes[lo]: two plane
+reads and one subtraction, whatever the window width. The index is built
+once per cube and can be saved next to the cube cache (validated by the
+cache manifest) and memory-mapped on later runs.
+
+Functions that integrate channel windows (datacube_to_element_map,
+compute_element_snr, registration.compute_element_map) accept a
+SpectralIndex wherever they accept a cube.
+"""
+
+import numpy as np
+from pathlib import Path
+from typing import Optional
+
+from .cache import CacheManifest, source_fingerprint
+from .mca import compact_dtype
+
+
+class SpectralIndex:
+    """
+    Cumulative sums of a (..., C) cube, stored channel-major as (C + 1, ...).
+
+    Integer cubes are summed exactly in the smallest unsigned dtype that
+    holds the largest pixel total; float cubes in float64.
+    """
+
+    def __init__(self, planes: np.ndarray):
+        self.planes = planes
+
+    @classmethod
+    def from_cube(cls, cube: np.ndarray) -> "SpectralIndex":
+        """Build the index of `cube` (shape (..., C))."""
+        spatial, n_ch = cube.shape[:-1], cube.shape[-1]
+        if cube.dtype.kind in "ui":
+            acc = np.uint64 if cube.dtype.kind == "u" else np.int64
+        else:
+            acc = np.float64
+        planes = np.zeros((n_ch + 1,) + spatial, dtype=acc)
+        np.cumsum(np.moveaxis(cube, -1, 0), axis=0, dtype=acc, out=planes[1:])
+        if cube.dtype.kind == "u":
+            planes = planes.astype(compact_dtype(int(planes[-1].max(initial=0))), copy=False)
+        return cls(planes)
+
+    @property
+    def n_channels(self) -> int:
+        return self.planes.shape[0] - 1
+
+    @property
+    def shape(self) -> tuple:
+        """Shape of the indexed cube, (..., C)."""
+        return self.planes.shape[1:] + (self.n_channels,)
+
+    def window_sum(self, lo: int, hi: int) -> np.ndarray:
+        """Sum over channels [lo, hi) per pixel (clipped to the cube), float64."""
+        lo = min(max(0, lo), self.n_channels)
+        hi = min(max(lo, hi), self.n_channels)
+        return self.planes[hi].astype(np.float64) - self.planes[lo]
+
+    def save(self, path: str | Path):
+        np.save(path, np.asarray(self.planes))
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "SpectralIndex":
+        return cls(np.load(path, mmap_mode="r" if mmap else None))
+
+
+def window_integral(data, lo: int, hi: int) -> np.ndarray:
+    """
+    Per-pixel integral over channels [lo, hi) of a cube or SpectralIndex.
+
+    Cubes are summed in at least float32 (as element maps always were);
+    an index returns exact float64 window sums.
+    """
+    if isinstance(data, SpectralIndex):
+        return data.window_sum(lo, hi)
+    window = data[..., max(0, lo):max(0, hi)]
+    return window.sum(axis=-1, dtype=np.result_type(window.dtype, np.float32))
+
+
+def cached_index(cube: np.ndarray, cube_cache_path: Optional[str | Path]) -> SpectralIndex:
+    """
+    SpectralIndex of `cube`, persisted as <cache stem>_index.npy next to the
+    cube's .npy cache and reused while that cache file is unchanged.
+    Without a cache path the index is only built in memory.
+    """
+    if cube_cache_path is None:
+        return SpectralIndex.from_cube(cube)
+    cube_cache_path = Path(cube_cache_path)
+    index_path = cube_cache_path.with_name(f"{cube_cache_path.stem}_index.npy")
+    manifest = CacheManifest(index_path.parent)
+    fingerprint = {index_path.name: manifest.fingerprint(
+        source_fingerprint([cube_cache_path]), {'kind': 'prefix_sum', 'shape': cube.shape})}
+    if not manifest.stale(fingerprint):
+        return SpectralIndex.load(index_path)
+    index = SpectralIndex.from_cube(cube)
+    index.save(index_path)
+    manifest.record(fingerprint)
+    return index
@@ -0,0 +1,112 @@
+"""Memory-bounded, stat-validated cache of parsed .mca spectra.
+
+Replaces an unbounded ``functools.lru_cache`` around the parser: entries are
+keyed on the resolved path, revalidated against (size, mtime) on every
+lookup, stored as compact unsigned integers, and evicted least-recently-used
+once the byte budget is exceeded. SPECTRUM_CACHE / cached_parse are one
+shared instance for the analysis scripts.
+"""
+
+import os
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+
+from .mca import compact_dtype, parse_mca_bytes
+
+# Rough per-entry bookkeeping (dict, key, stat tuple) on top of the arrays
+_ENTRY_OVERHEAD = 256
+
+
+class SpectrumCache:
+    """
+    LRU cache of parsed spectra with a byte budget.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Budget for cached counts and headers. The least recently used
+        spectra are evicted once it is exceeded.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, filepath: str | Path) -> dict:
+        """
+        Parsed spectrum, as returned by :func:`src.data.mca.parse_mca_file`.
+
+        'counts' is a fresh float64 array and 'meta' a fresh dict on every
+        call, so callers may modify them without corrupting the cache.
+        """
+        key = os.path.abspath(filepath)
+        st = os.stat(key)
+        stamp = (st.st_size, st.st_mtime_ns)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        else:
+            if entry is not None:
+                self.stale += 1
+                self._drop(key)
+            self.misses += 1
+            entry = self._load(key, stamp)
+
+        _, counts, time, meta, _ = entry
+        return {"counts": counts.astype(np.float64), "time": time, "meta": dict(meta)}
+
+    def _load(self, key: str, stamp: tuple) -> tuple:
+        with open(key, "rb") as f:
+            meta, counts = parse_mca_bytes(f.read())
+        if counts.size and counts.min() >= 0:
+            counts = counts.astype(compact_dtype(int(counts.max())))
+        time = float(meta.get("REAL_TIME", 1.0))
+        size = (counts.nbytes + _ENTRY_OVERHEAD
+                + sum(len(k) + len(v) for k, v in meta.items()))
+        entry = (stamp, counts, time, meta, size)
+
+        self._entries[key] = entry
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        return entry
+
+    def _drop(self, key: str):
+        self.nbytes -= self._entries.pop(key)[4]
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def info(self) -> dict:
+        """Counters: hits, misses, evictions, stale (file changed), size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale": self.stale,
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# Parsed spectra shared by the analysis scripts, bounded to ~256 MB
+SPECTRUM_CACHE = SpectrumCache(max_bytes=256 * 2**20)
+
+
+def cached_parse(filepath: str | Path) -> dict:
+    """Parsed spectrum served from SPECTRUM_CACHE (see SpectrumCache.get)."""
+    return SPECTRUM_CACHE.get(filepath)